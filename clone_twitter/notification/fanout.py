@@ -0,0 +1,122 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from notification import stream, unread
+from notification.models import Mention, Notification, NotificationActor
+
+User = get_user_model()
+
+# mentions and notifications of a write, run by the tasks of notification/tasks.py.
+# a notification is never written twice for the same (actor, tweet, type, notified user), so a task delivered twice
+# or a like / unlike / like again does not notify twice: every actor of a notification is a NotificationActor row,
+# whose unique key turns a concurrent second delivery into an IntegrityError, and the delivery is then run again
+# against what the first one wrote.
+# notifications of the NOTIFICATION_GROUP_TYPES collapse: another actor of the same type on the same tweet within
+# NOTIFICATION_GROUP_WINDOW seconds of a group's latest activity joins the group (actor_count, actors) instead of
+# adding a row, and moves it to the top as unread.
+
+
+def mention(user_id, tweet):
+    try:
+        user = User.objects.get(user_id=user_id)
+        mention = Mention.objects.create(tweet=tweet, user=user)
+        return mention
+    except User.DoesNotExist:
+        return None
+    except IntegrityError:
+        return None
+
+
+def mention_all(author, tweet, content):
+    # Mention rows and MENTION notifications for the @user_ids in content
+    user_ids = {x[1:] for x in content.split(' ') if x.startswith('@')}
+    if not user_ids:
+        return []
+    pks = list(User.objects.filter(user_id__in=user_ids).values_list('pk', flat=True))
+    Mention.objects.bulk_create([Mention(tweet=tweet, user_id=pk) for pk in pks], ignore_conflicts=True)
+    return notify_users(author, tweet, 'MENTION', Q(pk__in=pks))
+
+
+def notify_users(me, tweet, noti_type, recipients):
+    # notify the users matching the Q recipients who allow notifications and were not notified yet, except me;
+    # returns the notifications written or joined
+    try:
+        return deliver(me, tweet, noti_type, recipients)
+    except IntegrityError:      # lost a race with another delivery of the same notifications
+        return deliver(me, tweet, noti_type, recipients)
+
+
+def deliver(me, tweet, noti_type, recipients):
+    delivered = NotificationActor.objects.filter(actor=me, noti_type=noti_type, tweet_key=tweet_key(tweet)).values('notified_id')
+    pks = User.objects.filter(recipients, allow_notification=True).exclude(pk=me.pk).exclude(pk__in=delivered).values_list('pk', flat=True)
+    if tweet is not None and noti_type in settings.NOTIFICATION_GROUP_TYPES:
+        return group(me, tweet, noti_type, list(pks))
+    with transaction.atomic():
+        created = create(me, tweet, noti_type, list(pks))
+        unread.add([x.notified_id for x in created])
+        stream.push(me, created)
+    return created
+
+
+def tweet_key(tweet):
+    return tweet.id if tweet is not None else 0
+
+
+def create(me, tweet, noti_type, pks):
+    # new notifications with me as their first actor
+    if not pks:
+        return []
+    created = Notification.objects.bulk_create([
+        Notification(noti_type=noti_type, user=me, tweet=tweet, notified_id=pk, actors=[me.pk]) for pk in pks
+    ])
+    if created[0].pk is None:       # the backend does not return the ids of a bulk insert
+        created = list(Notification.objects.filter(user=me, tweet=tweet, noti_type=noti_type, notified_id__in=pks))
+    add_actor(me, created)
+    return created
+
+
+def add_actor(me, notifications):
+    NotificationActor.objects.bulk_create([
+        NotificationActor(notification=x, actor=me, notified_id=x.notified_id, noti_type=x.noti_type, tweet_key=x.tweet_id or 0)
+        for x in notifications
+    ])
+
+
+def group(me, tweet, noti_type, pks):
+    # join the open group of each user, or start one
+    if not pks:
+        return []
+    now = timezone.now()
+    since = now - timedelta(seconds=settings.NOTIFICATION_GROUP_WINDOW)
+    with transaction.atomic():
+        groups = dict()
+        rows = Notification.objects.select_for_update().filter(notified_id__in=pks, tweet=tweet, noti_type=noti_type, created_at__gte=since)
+        for notification in rows.order_by('created_at', 'id'):
+            groups[notification.notified_id] = notification      # latest group per user
+        joined = list(groups.values())
+        reopened = [x.notified_id for x in joined if x.is_read]     # read groups, unread again
+        for notification in joined:
+            notification.actors = ([me.pk] + notification.actors)[:settings.NOTIFICATION_GROUP_SAMPLE]
+            Notification.objects.filter(pk=notification.pk).update(
+                user=me, actor_count=F('actor_count') + 1, actors=notification.actors, is_read=False, created_at=now)
+        add_actor(me, joined)
+        created = create(me, tweet, noti_type, [pk for pk in pks if pk not in groups])
+        unread.add(reopened + [x.notified_id for x in created])
+        stream.push(me, joined + created)
+    return joined + created
+
+
+def notify(me, user_id, tweet, noti_type):
+    notifications = notify_users(me, tweet, noti_type, Q(user_id=user_id))
+    return notifications[0] if notifications else None
+
+
+def notify_all(me, tweet, noti_type, replying=None):
+    # the author and the users mentioned in tweet; the notifications point to replying if given
+    recipients = Q(pk=tweet.author_id) | Q(pk__in=Mention.objects.filter(tweet=tweet).values('user_id'))
+    return notify_users(me, replying or tweet, noti_type, recipients)
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.6 on 2026-10-17 18:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notification', '0004_auto_20220128_1909'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['notified', 'created_at'], name='noti_notified_created_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.6 on 2026-10-17 19:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notification', '0005_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='actor_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='actors',
+            field=models.JSONField(default=list),
+        ),
+    ]
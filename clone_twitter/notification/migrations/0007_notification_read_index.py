@@ -0,0 +1,17 @@
+# Generated by Django 3.2.6 on 2026-10-17 19:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notification', '0006_notification_group'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['notified', 'is_read', 'created_at'], name='noti_notified_read_idx'),
+        ),
+    ]
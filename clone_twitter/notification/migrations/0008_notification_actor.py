@@ -0,0 +1,48 @@
+# Generated by Django 3.2.6 on 2026-10-17 19:42
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def record_actors(apps, schema_editor):
+    # the actors known so far: the latest ones kept on each notification
+    Notification = apps.get_model('notification', 'Notification')
+    NotificationActor = apps.get_model('notification', 'NotificationActor')
+    last_pk = 0
+    while True:
+        notifications = list(Notification.objects.filter(pk__gt=last_pk).order_by('pk')[:1000])
+        if not notifications:
+            return
+        last_pk = notifications[-1].pk
+        NotificationActor.objects.bulk_create([
+            NotificationActor(notification_id=x.pk, actor_id=pk, notified_id=x.notified_id, noti_type=x.noti_type, tweet_key=x.tweet_id or 0)
+            for x in notifications for pk in x.actors or [x.user_id]
+        ], ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notification', '0007_notification_read_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationActor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('noti_type', models.CharField(choices=[('LIKE', 'like'), ('REPLY', 'reply'), ('RETWEET', 'retweet'), ('FOLLOW', 'follow'), ('MENTION', 'mention')], max_length=10)),
+                ('tweet_key', models.BigIntegerField(default=0)),
+                ('actor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('notification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='actor_set', to='notification.notification')),
+                ('notified', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='notificationactor',
+            constraint=models.UniqueConstraint(fields=('actor', 'notified', 'noti_type', 'tweet_key'), name='unique notification delivery'),
+        ),
+        migrations.RunPython(record_actors, migrations.RunPython.noop),
+    ]
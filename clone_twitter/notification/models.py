@@ -27,8 +27,33 @@ class Notification(models.Model):
     )
 
     noti_type = models.CharField(choices=TYPE, max_length=10)
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notify')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notify')   # latest actor of a group
+    actor_count = models.PositiveIntegerField(default=1)
+    actors = models.JSONField(default=list)     # pks of the latest actors, newest first, up to NOTIFICATION_GROUP_SAMPLE; all in actor_set
     tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name='notify_in', null=True)
     notified = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notified')
     is_read = models.BooleanField(default=False)
-    created_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    created_at = models.DateTimeField(auto_now_add=True)    # latest activity of a group
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['notified', 'created_at'], name='noti_notified_created_idx'),     # keyset pages
+            models.Index(fields=['notified', 'is_read', 'created_at'], name='noti_notified_read_idx'),     # unread count / mark as read
+        ]
+
+class NotificationActor(models.Model):
+    # every actor of a notification. a delivery is one row per (actor, notified user, type, tweet), so delivering it
+    # twice, from a redelivered task or a concurrent one, fails on the key instead of notifying twice
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='actor_set')
+    actor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    notified = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')     # copied from the notification for the key
+    noti_type = models.CharField(choices=Notification.TYPE, max_length=10)
+    tweet_key = models.BigIntegerField(default=0)      # id of the notification's tweet, 0 for none: NULLs never collide
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['actor', 'notified', 'noti_type', 'tweet_key'],
+                name='unique notification delivery'
+            )
+        ]
@@ -1,7 +1,12 @@
 from rest_framework import serializers
 
+from notification import unread
 from notification.models import Notification
-from tweet.serializers import UserSerializer, custom_paginator, TweetSummarySerializer
+from tweet.loaders import EngagementLoader
+from tweet.paginations import keyset_paginator
+from tweet.serializers import UserSerializer, TweetSummarySerializer
+from twitter.dataloader import get_loader
+from user.loaders import users_by_pk
 
 
 class NotificationSerializer(serializers.ModelSerializer):
@@ -11,28 +16,50 @@ class NotificationSerializer(serializers.ModelSerializer):
 
     user = UserSerializer(read_only=True)
     tweet = TweetSummarySerializer(read_only=True)
+    actors = serializers.SerializerMethodField()
     written_by_me = serializers.SerializerMethodField()
 
+    def get_actors(self, notification):
+        # latest actors of a group, from the users primed for the page
+        request = self.context['request']
+        users = get_loader(request, users_by_pk).load_many(notification.actors or [notification.user_id])
+        return UserSerializer([x for x in users if x is not None], many=True, context=self.context).data
+
     def get_written_by_me(self, notification):
         tweet = notification.tweet
         if tweet is None:
             return False
-        author = tweet.author
         me = self.context['request'].user
 
-        return author == me
+        return tweet.author_id == me.pk
 
 
 class NotificationListSerializer(serializers.Serializer):
     notifications = serializers.SerializerMethodField()
 
+    @staticmethod
+    def page(me, request, mention):
+        if mention:
+            notifications = me.notified.select_related('user', 'tweet__author').filter(noti_type='MENTION').order_by('-created_at', '-id')
+        else:
+            notifications = me.notified.select_related('user', 'tweet__author').all().order_by('-created_at', '-id')
+        return keyset_paginator(notifications, 10, request)
+
+    @staticmethod
+    def batches(request, notification):
+        # independent loads for the page, run at once by the async NotificationView
+        engagement = EngagementLoader.for_request(request)
+        users = get_loader(request, users_by_pk)
+        return [
+            lambda: engagement.prime([x.tweet for x in notification if x.tweet is not None]),
+            lambda: users.prime({pk for x in notification for pk in x.actors or [x.user_id]}),
+        ]
+
     def get_notifications(self, me):
         request = self.context['request']
-        if self.context['mention']:
-            notifications = me.notified.select_related('tweet').filter(noti_type='MENTION').order_by('-created_at')
-        else:
-            notifications = me.notified.select_related('tweet').all().order_by('-created_at')
-        notification, previous_page, next_page = custom_paginator(notifications, 10, request)
+        notification, previous_page, next_page = self.context.get('page') or self.page(me, request, self.context['mention'])
+        for batch in self.batches(request, notification):
+            batch()
         serializer = NotificationSerializer(notification, context={'request': request}, many=True)
         data = serializer.data
         # print(data)
@@ -45,8 +72,6 @@ class NotificationListSerializer(serializers.Serializer):
         return data
 
     def update(self, me, validated_data):
-        notifications = me.notified.all()
-        for notification in notifications:
-            notification.is_read = True
-            notification.save()
+        # one UPDATE of the unread rows only (found through noti_notified_read_idx), and the counter
+        unread.clear(me)
         return me
\ No newline at end of file
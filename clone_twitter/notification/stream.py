@@ -0,0 +1,124 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+import jwt
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from rest_framework_jwt.settings import api_settings
+
+from twitter.pubsub import get_bus
+
+User = get_user_model()
+
+# server-sent events of new notifications and unread counts, so clients need not poll
+# /notification/count/ and /notification/:
+#   GET /api/v1/notification/stream/  with 'Authorization: JWT <token>', or ?token=<token> for EventSource
+#   event: notification   data: {"notification_count": n, "notifications": [{"id", "noti_type", "tweet_id", "user_id"}]}
+# the first event carries the current count only. served by twitter/asgi.py in front of Django: an idle stream is a
+# coroutine waiting on its bus subscription, so one ASGI worker holds thousands of them.
+
+PATH = '/api/v1/notification/stream/'
+
+jwt_decode_handler = api_settings.JWT_DECODE_HANDLER
+jwt_get_username_from_payload = api_settings.JWT_PAYLOAD_GET_USERNAME_HANDLER
+
+
+def channel(pk):
+    return 'notification:%d' % pk
+
+
+def publish(pk, data):
+    get_bus().publish(channel(pk), json.dumps(data))
+
+
+def push(me, notifications):
+    # after commit, one event per notified user with its unread count
+    if notifications:
+        transaction.on_commit(lambda: push_now(me, notifications))
+
+
+def push_now(me, notifications):
+    by_user = dict()
+    for notification in notifications:
+        by_user.setdefault(notification.notified_id, []).append({
+            'id': notification.id,
+            'noti_type': notification.noti_type,
+            'tweet_id': notification.tweet_id,
+            'user_id': me.user_id,
+        })
+    counts = dict(User.objects.filter(pk__in=by_user).values_list('pk', 'unread_notifications'))
+    for pk, data in by_user.items():
+        publish(pk, {'notification_count': counts.get(pk, 0), 'notifications': data})
+
+
+def token_of(scope):
+    headers = dict(scope['headers'])
+    prefix, _, token = headers.get(b'authorization', b'').decode().partition(' ')
+    if prefix == 'JWT' and token:
+        return token
+    tokens = parse_qs(scope.get('query_string', b'').decode()).get('token')
+    return tokens[0] if tokens else None
+
+
+@sync_to_async
+def authenticate(token):
+    try:
+        username = jwt_get_username_from_payload(jwt_decode_handler(token))
+        return User.objects.get_by_natural_key(username)
+    except (jwt.InvalidTokenError, User.DoesNotExist):
+        return None
+
+
+def event(data):
+    return ('event: notification\ndata: %s\n\n' % data).encode()
+
+
+async def respond(send, status, message):
+    body = json.dumps({'message': message}).encode()
+    await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def application(scope, receive, send):
+    if scope['method'] != 'GET':
+        return await respond(send, 405, 'method not allowed: only GET')
+    token = token_of(scope)
+    user = await authenticate(token) if token else None
+    if user is None:
+        return await respond(send, 401, 'authentication credentials were not provided or are invalid')
+
+    subscription = get_bus().subscribe(channel(user.pk))
+    disconnected = asyncio.ensure_future(wait_disconnect(receive))
+    message = None
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),     # nginx: do not buffer the stream
+        ]})
+        await send({'type': 'http.response.body', 'body': event(json.dumps({'notification_count': user.unread_notifications})), 'more_body': True})
+        while True:
+            if message is None:
+                message = asyncio.ensure_future(subscription.get())
+            done, pending = await asyncio.wait({message, disconnected}, timeout=settings.NOTIFICATION_STREAM_HEARTBEAT, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                break
+            if message in done:
+                body = event(message.result())
+                message = None
+            else:
+                body = b': ping\n\n'     # keeps proxies from closing an idle stream
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        subscription.close()
+        for task in (message, disconnected):
+            if task is not None:
+                task.cancel()
@@ -0,0 +1,51 @@
+from celery import shared_task
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from notification import fanout, unread
+from tweet.models import Tweet
+
+User = get_user_model()
+
+# side effects of writes, queued once the write commits so the response does not wait for them.
+# with CELERY_TASK_ALWAYS_EAGER they run inline at commit. objects deleted before a task runs are skipped.
+
+
+def dispatch(task, *args):
+    transaction.on_commit(lambda: task.delay(*args))
+
+
+@shared_task
+def notify_mentions(author_pk, tweet_id, content, reply_to=None):
+    author = User.objects.filter(pk=author_pk).first()
+    tweet = Tweet.objects.filter(pk=tweet_id).first()
+    if author is None or tweet is None:
+        return 0
+    if reply_to is not None:
+        fanout.mention(reply_to, tweet)
+    return len(fanout.mention_all(author, tweet, content))
+
+
+@shared_task
+def notify_all(actor_pk, tweet_id, noti_type, replying_id=None):
+    actor = User.objects.filter(pk=actor_pk).first()
+    tweet = Tweet.objects.filter(pk=tweet_id).first()
+    replying = Tweet.objects.filter(pk=replying_id).first() if replying_id is not None else None
+    if actor is None or tweet is None or (replying_id is not None and replying is None):
+        return 0
+    return len(fanout.notify_all(actor, tweet, noti_type, replying))
+
+
+@shared_task
+def notify(actor_pk, user_id, tweet_id, noti_type):
+    actor = User.objects.filter(pk=actor_pk).first()
+    tweet = Tweet.objects.filter(pk=tweet_id).first() if tweet_id is not None else None
+    if actor is None or (tweet_id is not None and tweet is None):
+        return 0
+    return int(fanout.notify(actor, user_id, tweet, noti_type) is not None)
+
+
+@shared_task
+def reconcile_unread_counts():
+    # scheduled by CELERY_BEAT_SCHEDULE
+    return unread.reconcile()
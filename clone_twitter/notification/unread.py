@@ -0,0 +1,43 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, F
+
+from notification import stream
+from notification.models import Notification
+
+User = get_user_model()
+
+# unread notification counts kept in User.unread_notifications, so NotificationCountView reads the user already
+# loaded by authentication. notification/fanout.py adds, viewing the tab clears; rows deleted with their tweet
+# or actor are not subtracted, so reconcile() (scheduled by CELERY_BEAT_SCHEDULE) corrects drift.
+
+
+def add(pks):
+    # one more unread notification for each user pk
+    if pks:
+        User.objects.filter(pk__in=pks).update(unread_notifications=F('unread_notifications') + 1)
+
+
+def clear(user):
+    with transaction.atomic():
+        user.notified.filter(is_read=False).update(is_read=True)
+        User.objects.filter(pk=user.pk).update(unread_notifications=0)
+        transaction.on_commit(lambda: stream.publish(user.pk, {'notification_count': 0, 'notifications': []}))
+    user.unread_notifications = 0
+
+
+def reconcile(batch_size=1000):
+    # rewrite the counts that differ from the unread rows; returns the number of users corrected
+    corrected = 0
+    last_pk = 0
+    while True:
+        users = list(User.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'unread_notifications')[:batch_size])
+        if not users:
+            return corrected
+        last_pk = users[-1][0]
+        unread = Notification.objects.filter(notified_id__gte=users[0][0], notified_id__lte=last_pk, is_read=False)
+        actual = dict(unread.values_list('notified_id').annotate(n=Count('id')).order_by())
+        for pk, count in users:
+            if actual.get(pk, 0) != count:
+                User.objects.filter(pk=pk).update(unread_notifications=actual.get(pk, 0))
+                corrected += 1
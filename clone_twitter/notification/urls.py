@@ -1,7 +1,11 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import SimpleRouter
 
-from notification.views import NotificationView, NotificationCountView, NotificationMentionView
+from notification.views import NotificationView, NotificationCountView, NotificationMentionView, AsyncNotificationView
+
+if settings.ASYNC_READ_VIEWS:       # ASGI deployments (twitter/asyncviews.py)
+    NotificationView = AsyncNotificationView
 
 router = SimpleRouter()
 
@@ -10,5 +14,6 @@ urlpatterns = [
     path('notification/', NotificationView.as_view(), name='notification'),                                 # /api/v1/notification/
     path('notification/mention/', NotificationMentionView.as_view(), name='notification'),                  # /api/v1/notification/
     path('notification/count/', NotificationCountView.as_view(), name='notification_count'),                # /api/v1/notification/count/
+    # /api/v1/notification/stream/ is served by twitter/asgi.py (notification/stream.py)
     path('', include(router.urls))
 ]
\ No newline at end of file
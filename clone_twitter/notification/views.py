@@ -1,3 +1,4 @@
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
 from django.db import IntegrityError
 from drf_yasg import openapi
@@ -6,8 +7,10 @@ from rest_framework import permissions, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from notification import unread
 from notification.models import Mention, Notification
 from notification.serializers import NotificationListSerializer
+from twitter.asyncviews import AsyncAPIView, gather
 
 User = get_user_model()
 
@@ -75,7 +78,20 @@ class NotificationCountView(APIView):
 
     def get(self, request):
         me = request.user
-        notification_count = me.notified.filter(is_read=False).count()
+        notification_count = me.unread_notifications    # loaded with the user, no query (notification/unread.py)
         data = {'notification_count': notification_count}
 
-        return Response(data=data, status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response(data=data, status=status.HTTP_200_OK)
+
+
+class AsyncNotificationView(AsyncAPIView, NotificationView):     # routed when settings.ASYNC_READ_VIEWS is on
+
+    @swagger_auto_schema(tags=["Notification"], responses=NotificationView.responses)
+
+    async def get(self, request):
+        me = request.user
+        page = await sync_to_async(NotificationListSerializer.page)(me, request, False)
+        await gather(lambda: unread.clear(me), *NotificationListSerializer.batches(request, page[0]))
+        serializer = NotificationListSerializer(me, context={'request': request, 'mention': False, 'page': page})
+
+        return Response(await sync_to_async(lambda: serializer.data)(), status=status.HTTP_200_OK)
@@ -0,0 +1,158 @@
+# Benchmarks are not collected by the default test run (they do not match test*.py).
+# Run them explicitly:
+#   python manage.py test tweet.benchmarks
+
+import time
+import unittest
+from threading import Barrier, Thread
+from types import SimpleNamespace
+
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework import status
+
+from tweet import counters
+from tweet.models import Tweet, TimelineEntry, UserLike
+from tweet.serializers import LikeSerializer
+from tweet.tests import UserFactory, FollowFactory
+from user.models import User
+from user.serializers import jwt_token_of
+
+
+def follower_distributions(n_authors, max_followers):
+    # follower count of each author the reader follows
+    return {
+        'flat': [max_followers // 10] * n_authors,
+        'skewed': [max_followers] + [max_followers // 50] * (n_authors - 1),
+        'zipf': [max(1, max_followers // (i + 1)) for i in range(n_authors)],
+    }
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class TimelineFanOutBenchmark(TestCase):
+    # compares the cost of fanning tweets out on write with the latency of reading the home timeline,
+    # with and without pulling the tweets of high-follower authors at read time
+
+    N_AUTHORS = 10
+    MAX_FOLLOWERS = 1000
+    TWEETS_PER_AUTHOR = 5
+    READS = 20
+    HYBRID_LIMIT = 100
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pool = [
+            UserFactory(
+                email='pool%d@email.com' % i,
+                user_id='pool%d' % i,
+                username='pool%d' % i,
+                password='password',
+                is_verified=True
+            ) for i in range(cls.MAX_FOLLOWERS)]
+
+    def build_graph(self, counts):
+        authors = []
+        for i, count in enumerate(counts):
+            author = UserFactory(email='author%d@email.com' % i, user_id='author%d' % i, username='author%d' % i,
+                                 password='password', is_verified=True)
+            for follower in self.pool[:count]:
+                FollowFactory(follower=follower, following=author)
+            User.objects.filter(pk=author.pk).update(followers_count=count)
+            authors.append(User.objects.get(pk=author.pk))
+        return authors
+
+    def run_scenario(self, counts, limit):
+        authors = self.build_graph(counts)
+        reader_token = 'JWT ' + jwt_token_of(self.pool[0])
+        author_tokens = ['JWT ' + jwt_token_of(author) for author in authors]
+
+        with override_settings(TIMELINE_FANOUT_FOLLOWER_LIMIT=limit):
+            start = time.perf_counter()
+            for _ in range(self.TWEETS_PER_AUTHOR):
+                for token in author_tokens:
+                    response = self.client.post('/api/v1/tweet/', data={'content': 'content'},
+                                                content_type='application/json', HTTP_AUTHORIZATION=token)
+                    self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            write_ms = (time.perf_counter() - start) * 1000 / (self.TWEETS_PER_AUTHOR * len(authors))
+
+            start = time.perf_counter()
+            for _ in range(self.READS):
+                response = self.client.get('/api/v1/home/', HTTP_AUTHORIZATION=reader_token)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+            read_ms = (time.perf_counter() - start) * 1000 / self.READS
+
+        return write_ms, read_ms, TimelineEntry.objects.count()
+
+    def test_fan_out_vs_read_latency(self):
+        print()
+        print('%-8s %-7s %14s %14s %14s' % ('dist', 'mode', 'write ms/tweet', 'read ms/home', 'entries'))
+        distributions = follower_distributions(self.N_AUTHORS, self.MAX_FOLLOWERS)
+        for name, counts in distributions.items():
+            for mode, limit in (('push', self.MAX_FOLLOWERS), ('hybrid', self.HYBRID_LIMIT)):
+                savepoint = transaction.savepoint()     # every scenario starts from the bare user pool
+                write_ms, read_ms, entries = self.run_scenario(counts, limit)
+                transaction.savepoint_rollback(savepoint)
+                print('%-8s %-7s %14.2f %14.2f %14d' % (name, mode, write_ms, read_ms, entries))
+
+
+@unittest.skipIf(connection.vendor == 'sqlite', 'sqlite serializes every writer on one database lock')
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class HotTweetLikeBenchmark(TransactionTestCase):
+    # many threads liking one tweet at once, with the like counter updated on the tweet row
+    # (every like transaction waits on the same row lock) and spread over counter shards
+
+    THREADS = (1, 8, 32)
+    LIKES_PER_THREAD = 50
+    SHARDS = 16
+
+    def setUp(self):
+        n_users = max(self.THREADS) * self.LIKES_PER_THREAD
+        self.users = [
+            UserFactory(email='liker%d@email.com' % i, user_id='liker%d' % i, username='liker%d' % i, password='password')
+            for i in range(n_users)]
+        author = UserFactory(email='author@email.com', user_id='author', username='author', password='password')
+        self.tweet = Tweet.objects.create(tweet_type='GENERAL', author=author, content='viral')
+
+    def like_all(self, users, barrier, errors):
+        barrier.wait()
+        try:
+            for user in users:
+                serializer = LikeSerializer(data={'id': self.tweet.id}, context={'request': SimpleNamespace(user=user)})
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    def run_scenario(self, n_threads, shards):
+        UserLike.objects.filter(liked=self.tweet).delete()
+        Tweet.objects.filter(pk=self.tweet.pk).update(like_count=0)
+
+        with override_settings(TWEET_COUNTER_SHARDS=shards):
+            barrier, errors = Barrier(n_threads + 1), []
+            threads = [
+                Thread(target=self.like_all, args=(self.users[i::n_threads][:self.LIKES_PER_THREAD], barrier, errors))
+                for i in range(n_threads)]
+            for thread in threads:
+                thread.start()
+            barrier.wait()
+            start = time.perf_counter()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            if errors:
+                raise errors[0]
+            counters.flush(batch_size=n_threads * self.LIKES_PER_THREAD)
+
+        likes = n_threads * self.LIKES_PER_THREAD
+        self.assertEqual(Tweet.objects.get(pk=self.tweet.pk).like_count, likes)
+        return likes / elapsed
+
+    def test_hot_tweet_like_throughput(self):
+        print()
+        print('%-8s %14s %14s %8s' % ('threads', 'row likes/s', 'shard likes/s', 'gain'))
+        for n_threads in self.THREADS:
+            row = self.run_scenario(n_threads, 0)
+            sharded = self.run_scenario(n_threads, self.SHARDS)
+            print('%-8d %14.0f %14.0f %7.2fx' % (n_threads, row, sharded, sharded / row))
@@ -0,0 +1,96 @@
+from django.db import connection
+
+from tweet.models import Reply, Tweet
+
+# reply chains and conversation trees of threads.
+# a chain is walked up the Reply(replied, replying) edges by one recursive query (MySQL 8, sqlite), instead of a query
+# per ancestor. a conversation is a tree kept on its tweets: Tweet.conversation_id is the id of the root and Tweet.path
+# the ids from the root down to the tweet, SEGMENT hex digits each. sorting by path lists a tree depth first with
+# siblings oldest first, and the subtree of a tweet is the range of paths it prefixes, one scan of
+# tweet_conversation_path_idx. paths stay when a tweet is deleted (Reply.replied set null), so its replies stay in
+# the conversation and in the subtrees of its ancestors.
+# replies deeper than the path holds continue at the deepest level, as later siblings of the tweet they reply to.
+
+DELETED = object()     # stands for a tweet deleted from a chain
+
+SEGMENT = 10
+PATH_LENGTH = Tweet._meta.get_field('path').max_length
+
+ANCESTORS = '''
+WITH RECURSIVE chain (replying_id, replied_id, depth) AS (
+    SELECT {replying}, {replied}, 1 FROM {reply} WHERE {replying} = %s
+    UNION ALL
+    SELECT r.{replying}, r.{replied}, chain.depth + 1 FROM {reply} r JOIN chain ON r.{replying} = chain.replied_id
+    WHERE chain.depth < %s
+)
+SELECT replied_id FROM chain ORDER BY depth
+'''
+
+
+def ancestor_ids(tweet_id, limit):
+    # ids of the tweets tweet_id replies to, nearest first, at most limit + 1 of them: one past the limit tells whether
+    # the chain goes on. None stands for a deleted tweet, which ends the chain.
+    quote = connection.ops.quote_name
+    sql = ANCESTORS.format(
+        reply=quote(Reply._meta.db_table),
+        replying=quote(Reply._meta.get_field('replying').column),
+        replied=quote(Reply._meta.get_field('replied').column),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [tweet_id, limit + 1])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def ancestors(tweet, limit):
+    # (tweets tweet replies to, nearest first and with their authors, at most limit of them;
+    #  what the last of them replies to: None at the root, DELETED, or the id of the next tweet past the limit)
+    if tweet.tweet_type != 'REPLY':
+        return [], None
+    ids = ancestor_ids(tweet.id, limit)
+    if None in ids:
+        ids = ids[:ids.index(None)] + [DELETED]
+    rest = ids[limit] if len(ids) > limit else None
+    ids = [x for x in ids[:limit] if x is not DELETED]
+
+    tweets = Tweet.objects.select_related('author').in_bulk(ids)
+    chain = []
+    for pk in ids:
+        if pk not in tweets:        # deleted since the chain was read
+            return chain, DELETED
+        chain.append(tweets[pk])
+    if rest is None and (chain[-1] if chain else tweet).tweet_type == 'REPLY':
+        rest = DELETED
+    return chain, rest
+
+
+def segment(pk):
+    return '%010x' % pk
+
+
+def full_path(tweet):
+    return tweet.path or segment(tweet.id)
+
+
+def root_id(tweet):
+    return tweet.conversation_id or tweet.id
+
+
+def depth(tweet):
+    # 0 at the root
+    return len(tweet.path) // SEGMENT - 1 if tweet.path else 0
+
+
+def attach(reply, replied):
+    # place the new tweet reply under replied, in the transaction creating their Reply
+    parent = full_path(replied)
+    if len(parent) + SEGMENT > PATH_LENGTH:
+        parent = parent[:-SEGMENT]
+    reply.conversation_id = root_id(replied)
+    reply.path = parent + segment(reply.id)
+    Tweet.objects.filter(pk=reply.pk).update(conversation_id=reply.conversation_id, path=reply.path)
+
+
+def subtree(tweet):
+    # the replies under tweet, at any depth; order by 'path' for tree order
+    prefix = full_path(tweet)
+    return Tweet.objects.filter(conversation_id=root_id(tweet), path__gt=prefix, path__lt=prefix + '~')
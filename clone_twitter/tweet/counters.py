@@ -0,0 +1,111 @@
+import random
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+
+from tweet.models import Tweet, Reply, Retweet, Quote, UserLike, TweetCounterShard
+
+# counter column -> (relation model, foreign key to the counted tweet)
+COUNTERS = {
+    'reply_count': (Reply, 'replied'),
+    'retweet_count': (Retweet, 'retweeted'),
+    'quote_count': (Quote, 'quoted'),
+    'like_count': (UserLike, 'liked'),
+}
+
+# columns whose increments go to TweetCounterShard rows (see TWEET_COUNTER_SHARDS) instead of the tweet row
+SHARDED_COUNTERS = ('retweet_count', 'like_count')
+
+
+def add(tweet_id, field, delta=1):
+    # call inside the transaction that inserts / deletes the counted row
+    if field in SHARDED_COUNTERS and settings.TWEET_COUNTER_SHARDS > 0:
+        add_to_shard(tweet_id, field, delta)
+        return
+    # atomic in-place increment
+    tweets = Tweet.objects.filter(pk=tweet_id)
+    if delta < 0:
+        tweets = tweets.filter(**{field + '__gte': -delta})     # unsigned column on MySQL
+    tweets.update(**{field: F(field) + delta})
+
+
+def add_to_shard(tweet_id, field, delta):
+    # only the lock of one random shard row is taken, so up to TWEET_COUNTER_SHARDS writers proceed in parallel
+    shard = random.randrange(settings.TWEET_COUNTER_SHARDS)
+    shards = TweetCounterShard.objects.filter(tweet_id=tweet_id, field=field, shard=shard)
+    if shards.update(delta=F('delta') + delta):
+        return
+    try:
+        with transaction.atomic():
+            TweetCounterShard.objects.create(tweet_id=tweet_id, field=field, shard=shard, delta=delta)
+    except IntegrityError:      # created concurrently
+        shards.update(delta=F('delta') + delta)
+
+
+def pending_counts(tweet_ids):
+    # {tweet id: {counter column: sum of the shards not yet flushed}}
+    pending = defaultdict(dict)
+    rows = TweetCounterShard.objects.filter(tweet_id__in=tweet_ids).values_list('tweet_id', 'field').annotate(n=Sum('delta')).order_by()
+    for tweet_id, field, n in rows:
+        pending[tweet_id][field] = n
+    return pending
+
+
+def flush(batch_size=1000):
+    # fold up to batch_size shard rows into the counter columns; returns the number of rows folded
+    with transaction.atomic():
+        shards = list(TweetCounterShard.objects.select_for_update().order_by('id').values_list('id', 'tweet_id', 'field', 'delta')[:batch_size])
+        totals = defaultdict(int)
+        for shard_id, tweet_id, field, delta in shards:
+            totals[(tweet_id, field)] += delta
+        for (tweet_id, field), delta in sorted(totals.items()):     # fixed order, so concurrent flushes cannot deadlock
+            tweets = Tweet.objects.filter(pk=tweet_id)
+            if delta < 0:
+                tweets.filter(**{field + '__lt': -delta}).update(**{field: 0})
+                tweets = tweets.filter(**{field + '__gte': -delta})
+            if delta:
+                tweets.update(**{field: F(field) + delta})
+        TweetCounterShard.objects.filter(id__in=[x[0] for x in shards]).delete()
+    return len(shards)
+
+
+def remove_tweet(tweet):
+    # decrement the counters of the tweets `tweet` replied to, quoted or retweeted; call before deleting it
+    targets = [
+        ('reply_count', Reply.objects.filter(replying=tweet, replied__isnull=False).values_list('replied_id', flat=True)),
+        ('quote_count', Quote.objects.filter(quoting=tweet).values_list('quoted_id', flat=True)),
+        ('retweet_count', Retweet.objects.filter(retweeting=tweet).exclude(retweeted=tweet).values_list('retweeted_id', flat=True)),
+    ]
+    for field, tweet_ids in targets:
+        for tweet_id in list(tweet_ids):
+            add(tweet_id, field, -1)
+
+
+def actual_counts(tweet_ids):
+    # {tweet id: {counter column: value counted from the relation tables}}
+    counts = {tweet_id: {field: 0 for field in COUNTERS} for tweet_id in tweet_ids}
+    for field, (model, fk) in COUNTERS.items():
+        rows = model.objects.filter(**{fk + '__in': tweet_ids}).values_list(fk).annotate(n=Count('id')).order_by()
+        for tweet_id, n in rows:
+            counts[tweet_id][field] = n
+    return counts
+
+
+def reconcile(tweets):
+    # fix drifted counters of the given tweets; returns the number of tweets updated.
+    # a column is expected to hold the actual count minus what is still pending in its shards.
+    tweets = list(tweets)
+    tweet_ids = [x.id for x in tweets]
+    counts = actual_counts(tweet_ids)
+    pending = pending_counts(tweet_ids)
+    drifted = []
+    for tweet in tweets:
+        expected = {field: max(0, value - pending[tweet.id].get(field, 0)) for field, value in counts[tweet.id].items()}
+        if any(getattr(tweet, field) != value for field, value in expected.items()):
+            for field, value in expected.items():
+                setattr(tweet, field, value)
+            drifted.append(tweet)
+    Tweet.objects.bulk_update(drifted, list(COUNTERS))
+    return len(drifted)
@@ -0,0 +1,104 @@
+from collections import defaultdict
+
+from tweet import counters
+from tweet.models import Retweet, TweetMedia, UserLike
+from twitter.dataloader import get_loader
+
+
+# batch functions of twitter/dataloader.py for tweets
+
+def user_likes(edges):
+    # (user pk, tweet id) -> whether the user likes the tweet
+    edges = list(edges)
+    found = UserLike.objects.filter(user_id__in={x for x, y in edges}, liked_id__in={y for x, y in edges})
+    found = set(found.values_list('user_id', 'liked_id'))
+    return {edge: edge in found for edge in edges}
+
+
+def user_retweets(edges):
+    # (user pk, tweet id) -> whether the user retweeted the tweet
+    edges = list(edges)
+    found = Retweet.objects.filter(user_id__in={x for x, y in edges}, retweeted_id__in={y for x, y in edges})
+    found = set(found.values_list('user_id', 'retweeted_id'))
+    return {edge: edge in found for edge in edges}
+
+
+def tweet_media(tweet_ids):
+    # tweet id -> its TweetMedia
+    found = defaultdict(list)
+    for tweet_media in TweetMedia.objects.filter(tweet_id__in=tweet_ids).order_by('id'):
+        found[tweet_media.tweet_id].append(tweet_media)
+    return found
+
+
+class EngagementLoader:
+    # reply / retweet / quote / like counts and the viewer's retweet / like flags for a page of tweets.
+    # counts come from the denormalized counter columns of the tweets (and of the tweets they retweet)
+    # plus their unflushed counter shards, flags from the request's user_likes / user_retweets loaders.
+    # one loader lives on each request, so nested serializers share what has already been loaded.
+
+    COUNTERS = (
+        ('replies', 'reply_count'),
+        ('retweets', 'retweet_count'),
+        ('quotes', 'quote_count'),
+        ('likes', 'like_count'),
+    )
+
+    def __init__(self, request):
+        self.me = None if request.user.is_anonymous else request.user
+        self.sources = dict()       # tweet id -> id of the tweet it retweets (itself if not a retweet)
+        self.counts = dict()        # tweet id -> {'replies': n, 'retweets': n, 'quotes': n, 'likes': n}
+        self.retweeted = get_loader(request, user_retweets, False)
+        self.liked = get_loader(request, user_likes, False)
+
+    @classmethod
+    def for_request(cls, request):
+        loader = getattr(request, '_engagement_loader', None)
+        if loader is None:
+            loader = cls(request)
+            request._engagement_loader = loader
+        return loader
+
+    def prime(self, tweets):
+        tweets = [x for x in tweets if x.id not in self.sources]
+        if not tweets:
+            return
+
+        loaded = dict()
+        for tweet in tweets:
+            self.sources[tweet.id] = tweet.id
+            loaded[tweet.id] = {key: getattr(tweet, field) for key, field in self.COUNTERS}
+
+        retweet_ids = [x.id for x in tweets if x.tweet_type == 'RETWEET']
+        if retweet_ids:
+            fields = ['retweeted__' + field for key, field in self.COUNTERS]
+            rows = Retweet.objects.filter(retweeting_id__in=retweet_ids).values_list('retweeting_id', 'retweeted_id', *fields)
+            for retweeting_id, retweeted_id, *values in rows:
+                self.sources[retweeting_id] = retweeted_id
+                loaded[retweeted_id] = {key: value for (key, field), value in zip(self.COUNTERS, values)}
+
+        loaded = {x: loaded[x] for x in loaded if x not in self.counts}
+        if loaded:
+            pending = counters.pending_counts(list(loaded))     # increments not yet flushed from the shards
+            for tweet_id, counts in loaded.items():
+                for key, field in self.COUNTERS:
+                    counts[key] = max(0, counts[key] + pending[tweet_id].get(field, 0))
+            self.counts.update(loaded)
+
+        ids = {x.id for x in tweets} | {self.sources[x.id] for x in tweets}
+        if self.me is not None:
+            self.retweeted.prime([(self.me.pk, x) for x in ids])
+            self.liked.prime([(self.me.pk, x) for x in ids])
+
+    def source_id(self, tweet):
+        return self.sources[tweet.id]
+
+    def count(self, tweet_id, key):
+        return self.counts[tweet_id][key]
+
+    def user_retweet(self, tweet_id):
+        return self.me is not None and self.retweeted.load((self.me.pk, tweet_id))
+
+    def user_like(self, tweet_id):
+        return self.me is not None and self.liked.load((self.me.pk, tweet_id))
+
@@ -0,0 +1,69 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+# load benchmark of the read endpoints against a running server, to compare deployments, e.g.
+#   gunicorn twitter.wsgi:application -w 4 --bind 0.0.0.0:8000
+#   ASYNC_READ_VIEWS=true gunicorn twitter.asgi:application -w 4 -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:8000
+# then, against each:
+#   python manage.py loadtest http://localhost:8000 --token <jwt> --tweet 1 --user me -c 64 -n 5000
+
+PATHS = {
+    'home': '/api/v1/home/',
+    'tweet': '/api/v1/tweet/%s/',
+    'usertweets': '/api/v1/usertweets/%s/tweets/',
+    'notification': '/api/v1/notification/',
+}
+
+
+class Command(BaseCommand):
+    help = 'Measure throughput and latency of the read endpoints of a running server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('base_url', help='e.g. http://localhost:8000')
+        parser.add_argument('--token', required=True, help='JWT of the reading user')
+        parser.add_argument('--tweet', help='tweet id for /tweet/{id}/ (skipped if unset)')
+        parser.add_argument('--user', help='user_id for /usertweets/{user_id}/tweets/ (skipped if unset)')
+        parser.add_argument('-c', '--concurrency', type=int, default=32, help='clients sending requests at once')
+        parser.add_argument('-n', '--requests', type=int, default=1000, help='requests per endpoint')
+
+    def handle(self, *args, **options):
+        urls = {'home': PATHS['home'], 'notification': PATHS['notification']}
+        if options['tweet']:
+            urls['tweet'] = PATHS['tweet'] % options['tweet']
+        if options['user']:
+            urls['usertweets'] = PATHS['usertweets'] % options['user']
+
+        headers = {'Authorization': 'JWT ' + options['token']}
+        local = threading.local()
+
+        def get(url):
+            session = getattr(local, 'session', None)       # keep-alive connection per client
+            if session is None:
+                session = local.session = requests.Session()
+            started = time.perf_counter()
+            response = session.get(url, headers=headers)
+            return time.perf_counter() - started, response.status_code
+
+        for name, path in urls.items():
+            url = options['base_url'].rstrip('/') + path
+            latency, status = get(url)      # warm up, and fail early on a bad token or id
+            if status != 200:
+                raise CommandError(f'{url}: status {status}')
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(options['concurrency']) as pool:
+                results = list(pool.map(get, [url] * options['requests']))
+            elapsed = time.perf_counter() - started
+
+            latencies = sorted(x for x, status in results)
+            errors = sum(status != 200 for x, status in results)
+            p50, p90, p99 = (latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000 for q in (0.5, 0.9, 0.99))
+            self.stdout.write(
+                f'{name:<13} {len(results) / elapsed:8.1f} req/s  mean {statistics.mean(latencies) * 1000:7.1f} ms  '
+                f'p50 {p50:7.1f}  p90 {p90:7.1f}  p99 {p99:7.1f}  errors {errors}'
+            )
@@ -0,0 +1,26 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tweet import timeline
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Rebuild materialized home timelines from the Tweet and Follow tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='*', help='user_id of the timelines to rebuild (default: all users)')
+
+    def handle(self, *args, **options):
+        users = User.objects.all().order_by('pk')
+        if options['user_ids']:
+            users = users.filter(user_id__in=options['user_ids'])
+
+        count = 0
+        for user in users.iterator():
+            with transaction.atomic():
+                timeline.rebuild(user)
+            count += 1
+        self.stdout.write(f'rebuilt {count} timelines')
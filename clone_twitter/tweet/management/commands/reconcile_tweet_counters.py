@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tweet import counters
+from tweet.models import Tweet
+
+
+class Command(BaseCommand):
+    help = 'Recount replies, retweets, quotes and likes of every tweet and fix drifted counter columns'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='tweets recounted per transaction')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        fields = ['id'] + list(counters.COUNTERS)
+
+        checked, fixed, last_id = 0, 0, 0
+        while True:
+            with transaction.atomic():
+                chunk = list(Tweet.objects.select_for_update().filter(id__gt=last_id).order_by('id').only(*fields)[:chunk_size])
+                if not chunk:
+                    break
+                fixed += counters.reconcile(chunk)
+            checked += len(chunk)
+            last_id = chunk[-1].id
+        self.stdout.write(f'checked {checked} tweets, fixed {fixed}')
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tweet import search_index
+
+
+class Command(BaseCommand):
+    help = 'Build the in-process tweet search index from the database and write a snapshot workers restore on startup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.TWEET_SEARCH_INDEX_SNAPSHOT, help='snapshot file')
+
+    def handle(self, *args, **options):
+        index = search_index.snapshot(options['path'])
+        self.stdout.write(f'indexed {len(index.documents)} tweets, {len(index.postings)} terms into {options["path"]}')
@@ -0,0 +1,52 @@
+# Generated by Django 3.2.6 on 2026-10-17 18:44
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+
+
+def count_engagements(apps, schema_editor):
+    Tweet = apps.get_model('tweet', 'Tweet')
+    counters = {
+        'reply_count': (apps.get_model('tweet', 'Reply'), 'replied'),
+        'retweet_count': (apps.get_model('tweet', 'Retweet'), 'retweeted'),
+        'quote_count': (apps.get_model('tweet', 'Quote'), 'quoted'),
+        'like_count': (apps.get_model('tweet', 'UserLike'), 'liked'),
+    }
+    for field, (model, fk) in counters.items():
+        counts = model.objects.filter(**{fk: OuterRef('pk')}).values(fk).annotate(c=Count('id')).values('c')
+        Tweet.objects.filter(pk__in=model.objects.values(fk + '_id')).update(**{field: Subquery(counts)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweet', '0013_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tweet',
+            name='quote_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tweet',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tweet',
+            name='retweet_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='tweet',
+            index=models.Index(fields=['tweet_type', 'written_at'], name='tweet_type_written_idx'),
+        ),
+        migrations.RunPython(count_engagements, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.6 on 2026-10-17 18:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweet', '0014_tweet_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TweetCounterShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(max_length=20)),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('delta', models.IntegerField(default=0)),
+                ('tweet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counter_shards', to='tweet.tweet')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='tweetcountershard',
+            constraint=models.UniqueConstraint(fields=('tweet', 'field', 'shard'), name='unique counter shard'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations
+
+# FULLTEXT indexes only exist on MySQL; on other databases search falls back to scanning (tweet/search.py)
+
+
+def add_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    table = schema_editor.quote_name(apps.get_model('tweet', 'Tweet')._meta.db_table)
+    schema_editor.execute('ALTER TABLE %s ADD FULLTEXT INDEX tweet_content_ft (content) WITH PARSER ngram' % table)
+
+
+def drop_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    table = schema_editor.quote_name(apps.get_model('tweet', 'Tweet')._meta.db_table)
+    schema_editor.execute('ALTER TABLE %s DROP INDEX tweet_content_ft' % table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweet', '0015_tweetcountershard'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_fulltext_index, drop_fulltext_index),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.6 on 2026-10-17 18:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweet', '0016_tweet_content_fulltext'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tweet',
+            index=models.Index(fields=['author', 'created_at'], name='tweet_author_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tweet',
+            index=models.Index(fields=['retweeting_user', 'created_at'], name='tweet_retweeting_created_idx'),
+        ),
+    ]
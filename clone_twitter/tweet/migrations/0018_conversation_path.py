@@ -0,0 +1,51 @@
+# Generated by Django 3.2.6 on 2026-10-17 19:24
+
+from django.db import migrations, models
+
+SEGMENT = 10
+PATH_LENGTH = 500
+
+
+def build_paths(apps, schema_editor):
+    # as tweet.conversation.attach; a parent is older than its replies, so it is placed first.
+    # replies whose parent is already deleted start conversations of their own
+    Tweet = apps.get_model('tweet', 'Tweet')
+    Reply = apps.get_model('tweet', 'Reply')
+    placed = dict()     # reply id -> (conversation_id, path)
+    batch = []
+    edges = Reply.objects.filter(replied__isnull=False).order_by('replying_id').values_list('replying_id', 'replied_id')
+    for replying_id, replied_id in edges.iterator(chunk_size=10000):
+        conversation_id, parent = placed.get(replied_id, (replied_id, '%010x' % replied_id))
+        if len(parent) + SEGMENT > PATH_LENGTH:
+            parent = parent[:-SEGMENT]
+        placed[replying_id] = (conversation_id, parent + '%010x' % replying_id)
+        batch.append(Tweet(id=replying_id, conversation_id=conversation_id, path=placed[replying_id][1]))
+        if len(batch) >= 1000:
+            Tweet.objects.bulk_update(batch, ['conversation_id', 'path'])
+            batch = []
+    Tweet.objects.bulk_update(batch, ['conversation_id', 'path'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweet', '0017_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='conversation_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tweet',
+            name='path',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AddIndex(
+            model_name='tweet',
+            index=models.Index(fields=['conversation_id', 'path'], name='tweet_conversation_path_idx'),
+        ),
+        migrations.RunPython(build_paths, migrations.RunPython.noop),
+    ]
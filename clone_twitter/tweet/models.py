@@ -22,6 +22,25 @@ class Tweet(models.Model):
     written_at = models.DateTimeField(default=timezone.now)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # denormalized counters, maintained by tweet.counters (see manage.py reconcile_tweet_counters)
+    reply_count = models.PositiveIntegerField(default=0)
+    retweet_count = models.PositiveIntegerField(default=0)
+    quote_count = models.PositiveIntegerField(default=0)
+    like_count = models.PositiveIntegerField(default=0)
+
+    # conversation tree of replies, maintained by tweet.conversation.attach: id of the root tweet, and the ids from the
+    # root down to this tweet as fixed width segments; both empty on a root
+    conversation_id = models.BigIntegerField(null=True, blank=True)
+    path = models.CharField(max_length=500, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['tweet_type', 'written_at'], name='tweet_type_written_idx'),
+            models.Index(fields=['author', 'created_at'], name='tweet_author_created_idx'),           # keyset pages of a user's tweets
+            models.Index(fields=['retweeting_user', 'created_at'], name='tweet_retweeting_created_idx'),
+            models.Index(fields=['conversation_id', 'path'], name='tweet_conversation_path_idx'),  # subtrees in tree order
+        ]
+
 
 class TweetMedia(models.Model):
     media = models.FileField(upload_to=media_directory_path)
@@ -64,4 +83,40 @@ class UserLike(models.Model):
                 fields=['user', 'liked'],
                 name='unique like'
             )
-        ]
\ No newline at end of file
+        ]
+
+class TimelineEntry(models.Model):
+    # materialized home timeline: one row per (owner, tweet) written at fan-out time
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline')
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name='timeline_entries')
+    actor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')   # author, or retweeting user for RETWEET
+    created_at = models.DateTimeField()   # copy of tweet.created_at
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'tweet'],
+                name='unique timeline entry'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='timeline_user_created_idx'),
+            models.Index(fields=['user', 'actor'], name='timeline_user_actor_idx'),
+        ]
+
+
+class TweetCounterShard(models.Model):
+    # pending increments of a hot counter column, spread over shards so concurrent likes / retweets
+    # of one tweet do not all wait on the lock of its row. folded into Tweet by tweet.counters.flush
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name='counter_shards')
+    field = models.CharField(max_length=20)     # Tweet counter column, e.g. 'like_count'
+    shard = models.PositiveSmallIntegerField()
+    delta = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['tweet', 'field', 'shard'],
+                name='unique counter shard'
+            )
+        ]
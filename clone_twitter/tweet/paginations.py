@@ -1,24 +1,108 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
 from rest_framework import pagination
 from rest_framework.views import Response
 
-class TweetListPagination(pagination.PageNumberPagination):
+from twitter.paginations import CountModePagination
+
+
+class TweetListPagination(CountModePagination):
     page_size = 15
 
+
+# keyset (cursor) pagination: a page is the n rows after / before the position of a row in the list ordering,
+# so deep pages cost the same as the first one and no COUNT is run.
+# ?cursor= carries the direction and the ordering values of the row the page starts from.
+
+def encode_cursor(direction, values):
+    values = [x.isoformat() if isinstance(x, datetime) else x for x in values]     # keeps microseconds, unlike DjangoJSONEncoder
+    data = json.dumps([direction, values])
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor, fields):
+    # fields: the model fields (or annotation output fields) of the ordering keys; values that are not theirs,
+    # like a string for an id, make the cursor invalid rather than the query fail
+    try:
+        direction, values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError, binascii.Error):
+        return None
+    if direction not in ('next', 'previous') or not isinstance(values, list) or len(values) != len(fields):
+        return None
+    if any(isinstance(x, bool) or not isinstance(x, (str, int, float)) for x in values):
+        return None
+    try:
+        return direction, [field.to_python(x) for field, x in zip(fields, values)]
+    except (ValidationError, ValueError, TypeError):
+        return None
+
+
+def key_fields(query, keys):
+    # the fields the ordering keys of a query read
+    fields = []
+    for key in keys:
+        if key in query.annotations:
+            fields.append(query.annotations[key].output_field)
+        elif key == 'pk':
+            fields.append(query.get_meta().pk)
+        else:
+            fields.append(query.get_meta().get_field(key))
+    return fields
+
+
+def after(keys, values, op):
+    # rows whose (keys...) tuple is beyond values, comparing with op ('lt' or 'gt')
+    q = Q()
+    for i, key in enumerate(keys):
+        q |= Q(**dict(zip(keys[:i], values[:i])), **{'%s__%s' % (key, op): values[i]})
+    return q
+
+
+def keyset_paginator(queryset, n, request, ordering=None):
+    # ordering: fields (or annotations) of the rows, all ascending or all descending, unique together (end with id).
+    # defaults to the ordering of the queryset. returns the page and the previous / next cursors (None at either end)
+    ordering = list(ordering or queryset.query.order_by)
+    descending = ordering[0].startswith('-')
+    keys = [x.lstrip('-') for x in ordering]
+    reverse_ordering = [x if descending else '-' + x for x in keys]
+    forward, backward = ('lt', 'gt') if descending else ('gt', 'lt')
+
+    cursor = decode_cursor(request.GET.get('cursor', ''), key_fields(queryset.query, keys))
+    if cursor is None:
+        rows = list(queryset.order_by(*ordering)[:n + 1])
+        has_previous, has_next = False, len(rows) > n
+        rows = rows[:n]
+    elif cursor[0] == 'next':
+        rows = list(queryset.filter(after(keys, cursor[1], forward)).order_by(*ordering)[:n + 1])
+        has_previous, has_next = True, len(rows) > n
+        rows = rows[:n]
+    else:
+        rows = list(queryset.filter(after(keys, cursor[1], backward)).order_by(*reverse_ordering)[:n + 1])
+        has_previous, has_next = len(rows) > n, True
+        rows = rows[:n][::-1]
+
+    position = lambda row: [getattr(row, key) for key in keys]
+    previous_cursor = encode_cursor('previous', position(rows[0])) if rows and has_previous else None
+    next_cursor = encode_cursor('next', position(rows[-1])) if rows and has_next else None
+    return rows, previous_cursor, next_cursor
+
+
+class TweetCursorPagination(pagination.BasePagination):
+    # keyset pagination for viewsets; the queryset has to be ordered as keyset_paginator expects
+    page_size = 15
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page, self.previous, self.next = keyset_paginator(queryset, self.page_size, request)
+        return page
+
     def get_paginated_response(self, data):
         return Response({
-            'count': self.page.paginator.count,  # total objects count
-            'next': self.get_next_page_num(),
-            'previous': self.get_prev_page_num(),
+            'next': self.next,
+            'previous': self.previous,
             'results': data
         })
-
-
-    def get_next_page_num(self):
-        if not self.page.has_next():
-            return None
-        return self.page.next_page_number()
-
-    def get_prev_page_num(self):
-        if not self.page.has_previous():
-            return None
-        return self.page.previous_page_number()
@@ -0,0 +1,125 @@
+from collections import Counter
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import NotSupportedError, connection
+from django.db.models import FloatField, Func, Q
+from django.db.models.expressions import Case, When
+
+from tweet import search_index
+from tweet.models import Tweet
+from user.models import User
+
+# ngram_token_size of the MySQL server (default 2); shorter keywords cannot be looked up in the ngram FULLTEXT indexes
+NGRAM_TOKEN_SIZE = 2
+# the indexes are built without stopwords (tweet 0019, user 0025 migrations): with InnoDB's default list every ngram
+# containing one, like "a " or "i", would be missing. a server rebuilding them must run with innodb_ft_enable_stopword=OFF
+
+
+class Match(Func):
+    # MATCH (columns) AGAINST (query IN BOOLEAN MODE); the columns must be exactly those of one FULLTEXT index
+    output_field = FloatField()
+
+    def __init__(self, *columns, query):
+        super().__init__(*columns)
+        self.query = query
+
+    def as_sql(self, compiler, connection, **extra_context):
+        raise NotSupportedError('MATCH ... AGAINST is only supported on MySQL')
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        sql, params = super().as_sql(compiler, connection, template='MATCH (%(expressions)s) AGAINST (%%s IN BOOLEAN MODE)', **extra_context)
+        return sql, (*params, self.query)
+
+
+def boolean_query(keywords):
+    # any of the keywords, each as a phrase so the ngram parser requires its ngrams to be adjacent
+    return ' '.join('"%s"' % x.replace('"', '') for x in keywords)
+
+
+def tweet_candidates(keywords):
+    # Q narrowing tweets down, through the FULLTEXT indexes, to those whose content or author handles may contain a keyword.
+    # None when the indexes cannot be used and every tweet has to be scanned.
+    if connection.vendor != 'mysql' or any(len(x) < NGRAM_TOKEN_SIZE for x in keywords):
+        return None
+    query = boolean_query(keywords)
+    by_content = Tweet.objects.annotate(score=Match('content', query=query)).filter(score__gt=0).values('id')
+    by_author = User.objects.annotate(score=Match('username', 'user_id', query=query)).filter(score__gt=0).values('id')
+    return Q(id__in=by_content) | Q(author__in=by_author)
+
+
+def search_tweets(keywords):
+    # tweets containing at least one keyword in their content or author handles, annotated with num_keywords_included
+    index = search_index.current_index() if settings.TWEET_SEARCH_BACKEND == 'index' else None
+    if index is not None:
+        return search_indexed_tweets(index, keywords)
+
+    # the FULLTEXT indexes only preselect candidates; the count itself stays an exact substring match
+    tweets = Tweet.objects.all()
+    candidates = tweet_candidates(keywords)
+    if candidates is not None:
+        tweets = tweets.filter(candidates)
+    return tweets \
+        .annotate(num_keywords_included=sum([Case(When(Q(author__username__icontains=keyword) | Q(author__user_id__icontains=keyword) | Q(content__icontains=keyword), then=1), default=0) for keyword in keywords])) \
+        .filter(num_keywords_included__gte=1)
+
+
+def search_indexed_tweets(index, keywords):
+    # content is matched by terms of the in-process index (tweet/search_index.py), author handles by substring.
+    # each keyword brings its newest TWEET_SEARCH_INDEX_MAX_HITS matches of either kind
+    limit = settings.TWEET_SEARCH_INDEX_MAX_HITS
+    hits = Counter()    # tweet id -> keywords included
+    for keyword in keywords:
+        ids = index.search(keyword, limit)
+        authors = User.objects.filter(Q(username__icontains=keyword) | Q(user_id__icontains=keyword))
+        ids.update(Tweet.objects.filter(author__in=authors).order_by('-id').values_list('id', flat=True)[:limit])
+        hits.update(ids)
+    return RankedSearch(Tweet.objects.filter(id__in=list(hits)), hits)
+
+
+class RankedSearch:
+    # the tweets of an indexed search, ranked in Python: num_keywords_included comes from the index hits instead of
+    # a CASE over the id lists, so the ids are sent to the database once, and the rows of a page are loaded by id.
+    # supports filter(), select_related(), order_by(), count() and slicing, so it can be paginated like a queryset.
+
+    def __init__(self, queryset, hits, ordering=()):
+        self.queryset = queryset
+        self.hits = hits
+        self.ordering = ordering
+
+    def filter(self, *args, **kwargs):
+        return RankedSearch(self.queryset.filter(*args, **kwargs), self.hits, self.ordering)
+
+    def select_related(self, *fields):
+        return RankedSearch(self.queryset.select_related(*fields), self.hits, self.ordering)
+
+    def order_by(self, *ordering):
+        return RankedSearch(self.queryset, self.hits, ordering)
+
+    def count(self):
+        return self.queryset.count()
+
+    def __len__(self):
+        return self.count()
+
+    def ranked_ids(self):
+        keys = [x.lstrip('-') for x in self.ordering]
+        fields = [x for x in keys if x != 'num_keywords_included']
+        rows = [dict(zip(['id', *fields], row)) for row in self.queryset.order_by('-id').values_list('id', *fields)]
+        for row in rows:
+            row['num_keywords_included'] = self.hits[row['id']]
+        for key, ordering in reversed(list(zip(keys, self.ordering))):     # stable sorts, last key first
+            rows.sort(key=itemgetter(key), reverse=ordering.startswith('-'))
+        return [row['id'] for row in rows]
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        ids = self.ranked_ids()[key]
+        tweets = self.queryset.in_bulk(ids)
+        page = []
+        for pk in ids:
+            if pk in tweets:
+                tweets[pk].num_keywords_included = self.hits[pk]
+                page.append(tweets[pk])
+        return page
@@ -0,0 +1,302 @@
+import logging
+import os
+import struct
+import threading
+import time
+from bisect import insort
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils.module_loading import import_string
+
+from tweet.models import Tweet
+
+# in-process inverted index over tweet content, used by tweet/search.py when TWEET_SEARCH_BACKEND = 'index'.
+# every server process keeps its own copy, off the request path: start() (twitter/wsgi.py, twitter/asgi.py) loads it
+# in a background thread from a snapshot (manage.py snapshot_search_index) or the database, then catches it up with
+# tweets written by other processes every TWEET_SEARCH_INDEX_CATCH_UP seconds. the tweet-creation serializers of the
+# process update it directly. until it is loaded, searches go to the database.
+
+SNAPSHOT_MAGIC = b'TWIX'
+SNAPSHOT_VERSION = 1
+
+
+def encode_varint(n, out):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def decode_varints(data):
+    n, shift = 0, 0
+    for byte in data:
+        n |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            yield n
+            n, shift = 0, 0
+
+
+def read_varint(data, pos):
+    n, shift = 0, 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return n, pos
+        shift += 7
+
+
+class PostingList:
+    # ascending tweet ids stored as varint-encoded gaps; appending a newer tweet costs a few bytes
+
+    __slots__ = ('data', 'last')
+
+    def __init__(self, ids=()):
+        self.data = bytearray()
+        self.last = 0
+        for tweet_id in ids:
+            self.append(tweet_id)
+
+    def append(self, tweet_id):
+        if tweet_id > self.last:
+            encode_varint(tweet_id - self.last, self.data)
+            self.last = tweet_id
+        elif tweet_id < self.last:    # indexed out of order (e.g. caught up late): re-encode
+            ids = list(self)
+            if tweet_id not in ids:
+                insort(ids, tweet_id)
+                self.__init__(ids)
+
+    def __iter__(self):
+        return self.decode(self.data)
+
+    @staticmethod
+    def decode(data):
+        tweet_id = 0
+        for gap in decode_varints(data):
+            tweet_id += gap
+            yield tweet_id
+
+
+class InvertedIndex:
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.postings = dict()      # term -> PostingList
+        self.documents = set()      # indexed tweet ids
+        self.deleted = set()        # removed tweet ids still present in posting lists
+        self.last_id = 0            # highest indexed tweet id, where catch_up starts
+        self.lock = threading.Lock()
+
+    @property
+    def tokenizer_name(self):
+        return '%s.%s' % (type(self.tokenizer).__module__, type(self.tokenizer).__qualname__)
+
+    def add(self, tweet_id, text):
+        with self.lock:
+            if tweet_id in self.documents:
+                return
+            for term in set(self.tokenizer.tokenize(text)):
+                postings = self.postings.get(term)
+                if postings is None:
+                    postings = self.postings[term] = PostingList()
+                postings.append(tweet_id)
+            self.documents.add(tweet_id)
+            self.deleted.discard(tweet_id)
+            self.last_id = max(self.last_id, tweet_id)
+
+    def remove(self, tweet_id):
+        with self.lock:
+            if tweet_id in self.documents:
+                self.documents.discard(tweet_id)
+                self.deleted.add(tweet_id)
+
+    def catch_up(self):
+        # index tweets committed by other processes. ids are assigned before commit, so a window of
+        # TWEET_SEARCH_INDEX_OVERLAP ids below the watermark is re-read for transactions that committed late
+        since = max(0, self.last_id - settings.TWEET_SEARCH_INDEX_OVERLAP)
+        tweets = Tweet.objects.filter(id__gt=since).exclude(tweet_type='RETWEET').order_by('id').values_list('id', 'content')
+        for tweet_id, content in tweets.iterator():
+            with self.lock:
+                seen = tweet_id in self.documents or tweet_id in self.deleted
+            if not seen:
+                self.add(tweet_id, content)
+
+    def search(self, keyword, limit=None):
+        # ids of tweets containing every term of the keyword, only the newest limit of them if given
+        terms = set(self.tokenizer.tokenize(keyword))
+        if not terms:
+            return set()
+        with self.lock:     # add() extends the posting lists in place: intersect copies of them
+            postings = [self.postings.get(term) for term in terms]
+            if any(x is None for x in postings):
+                return set()
+            postings = [bytes(x.data) for x in postings]
+        postings.sort(key=len)      # intersect starting from the rarest term
+        ids = set(PostingList.decode(postings[0]))
+        for data in postings[1:]:
+            ids.intersection_update(PostingList.decode(data))
+            if not ids:
+                break
+        with self.lock:
+            ids = {x for x in ids if x not in self.deleted}
+        if limit is not None and len(ids) > limit:
+            ids = set(sorted(ids)[-limit:])
+        return ids
+
+    def compact(self):
+        # drop removed tweets from the posting lists
+        with self.lock:
+            if not self.deleted:
+                return
+            for term in list(self.postings):
+                ids = [x for x in self.postings[term] if x not in self.deleted]
+                if ids:
+                    self.postings[term] = PostingList(ids)
+                else:
+                    del self.postings[term]
+            self.deleted.clear()
+
+    # snapshot: magic, version, tokenizer name, last_id, documents (varint gaps), then every term with its posting list
+
+    def dump(self, file):
+        self.compact()
+        out = bytearray(SNAPSHOT_MAGIC)
+        out += struct.pack('>H', SNAPSHOT_VERSION)
+        name = self.tokenizer_name.encode()
+        encode_varint(len(name), out)
+        out += name
+        with self.lock:     # a consistent copy while add() and remove() go on
+            encode_varint(self.last_id, out)
+            documents = PostingList(sorted(self.documents)).data
+            encode_varint(len(documents), out)
+            out += documents
+            encode_varint(len(self.postings), out)
+            for term, postings in self.postings.items():
+                term = term.encode()
+                encode_varint(len(term), out)
+                out += term
+                encode_varint(postings.last, out)
+                encode_varint(len(postings.data), out)
+                out += postings.data
+        file.write(out)
+
+    @classmethod
+    def load(cls, file, tokenizer):
+        data = file.read()
+        if data[:4] != SNAPSHOT_MAGIC or struct.unpack('>H', data[4:6])[0] != SNAPSHOT_VERSION:
+            raise ValueError('not a search index snapshot of version %d' % SNAPSHOT_VERSION)
+        index = cls(tokenizer)
+
+        def read_bytes(pos):
+            length, pos = read_varint(data, pos)
+            return data[pos:pos + length], pos + length
+
+        name, pos = read_bytes(6)
+        if name.decode() != index.tokenizer_name:
+            raise ValueError('snapshot was built with tokenizer %s' % name.decode())
+        index.last_id, pos = read_varint(data, pos)
+        documents, pos = read_bytes(pos)
+        index.documents = set(PostingList.decode(documents))
+        n_terms, pos = read_varint(data, pos)
+        for _ in range(n_terms):
+            term, pos = read_bytes(pos)
+            postings = PostingList()
+            postings.last, pos = read_varint(data, pos)
+            encoded, pos = read_bytes(pos)
+            postings.data = bytearray(encoded)
+            index.postings[term.decode()] = postings
+        return index
+
+
+logger = logging.getLogger(__name__)
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def enabled():
+    return settings.TWEET_SEARCH_BACKEND == 'index'
+
+
+def current_index():
+    # the loaded index of this process, or None while it is loading
+    return _index
+
+
+def load():
+    # restore or build an index, catch it up and swap it in whole
+    global _index
+    tokenizer = import_string(settings.TWEET_SEARCH_TOKENIZER)()
+    index = restore(settings.TWEET_SEARCH_INDEX_SNAPSHOT, tokenizer) or InvertedIndex(tokenizer)
+    index.catch_up()
+    with _index_lock:
+        _index = index
+    return index
+
+
+def reset():
+    # forget the index of this process; searches go to the database until the next load()
+    global _index
+    with _index_lock:
+        _index = None
+
+
+def start():
+    # at server startup, in every worker process (start it after fork, i.e. without gunicorn --preload)
+    if not enabled():
+        return None
+    thread = threading.Thread(target=keep_up, name='search-index', daemon=True)
+    thread.start()
+    return thread
+
+
+def keep_up():
+    while True:
+        close_old_connections()     # this thread's connection, per CONN_MAX_AGE
+        try:
+            index = current_index()
+            if index is None:
+                load()
+            else:
+                index.catch_up()
+        except Exception:
+            logger.exception('search index catch up failed')
+        time.sleep(settings.TWEET_SEARCH_INDEX_CATCH_UP)
+
+
+def restore(path, tokenizer):
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as file:
+            return InvertedIndex.load(file, tokenizer)
+    except (ValueError, IndexError, UnicodeDecodeError):      # stale or corrupt snapshot: rebuild from the database
+        return None
+
+
+def snapshot(path):
+    # build a fresh index from the database and write it atomically to path
+    tokenizer = import_string(settings.TWEET_SEARCH_TOKENIZER)()
+    index = InvertedIndex(tokenizer)
+    index.catch_up()
+    tmp = '%s.tmp' % path
+    with open(tmp, 'wb') as file:
+        index.dump(file)
+    os.replace(tmp, path)
+    return index
+
+
+def index_tweet(tweet):
+    # called by the tweet-creation serializers; tweets of an index not loaded yet are picked up by catch_up
+    if enabled() and _index is not None:
+        transaction.on_commit(lambda: _index.add(tweet.id, tweet.content) if _index is not None else None)
+
+
+def unindex_tweet(tweet_id):
+    if enabled() and _index is not None:
+        transaction.on_commit(lambda: _index.remove(tweet_id) if _index is not None else None)
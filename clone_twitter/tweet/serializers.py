@@ -1,49 +1,20 @@
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
-from django.db import IntegrityError
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from django.db.models import Q
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
 
-from notification.models import Mention, Notification
+from notification import tasks as notification_tasks
+from tweet import conversation, counters, search_index, timeline
+from tweet.loaders import EngagementLoader, tweet_media
 from tweet.models import Tweet, Reply, Retweet, UserLike, TweetMedia, Quote
-from user.models import ProfileMedia
+from tweet.paginations import keyset_paginator
+from twitter.dataloader import LoaderListSerializer, LoaderMixin
+from user.avatars import AvatarMixin
+from user.loaders import follows, users_by_user_id
 User = get_user_model()
 
-def mention(user_id, tweet):
-    try:
-        user = User.objects.get(user_id=user_id)
-        mention = Mention.objects.create(tweet=tweet, user=user)
-        return mention
-    except User.DoesNotExist:
-        return None
-    except IntegrityError:
-        return None
-
-
-def notify(me, user_id, tweet, noti_type):
-    if me.user_id == user_id:
-        return None
-    try:
-        notified = User.objects.get(user_id=user_id)
-        notification = Notification.objects.create(noti_type=noti_type, user=me, tweet=tweet, notified=notified)
-        return notification
-    except User.DoesNotExist:
-        return None
-    except IntegrityError:
-        return None
-
-
-def notify_all(me, tweet, noti_type, replying=None):
-    author_id = tweet.author.user_id
-    mentioned_list = [x.user.user_id for x in tweet.mentions.all()]
-    if replying:
-        tweet = replying
-    notify(me, author_id, tweet, noti_type)
-    for mentioned in mentioned_list:
-        notify(me, mentioned, tweet, noti_type)
-
-
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(AvatarMixin, serializers.ModelSerializer):
     profile_img = serializers.SerializerMethodField()
 
     class Meta:
@@ -53,19 +24,13 @@ class UserSerializer(serializers.ModelSerializer):
             'user_id',
             'profile_img',
         ]
-    def get_profile_img(self, obj):
-        try:
-            profile_img = obj.profile_img.get()
-        except ProfileMedia.DoesNotExist:
-            return ProfileMedia.default_profile_img
-        return profile_img.media.url if profile_img.media else profile_img.image_url
-
 
-class UserListSerializer(serializers.ModelSerializer):
+class UserListSerializer(AvatarMixin, LoaderMixin, serializers.ModelSerializer):
     profile_img = serializers.SerializerMethodField()
 
     class Meta:
         model = User
+        list_serializer_class = LoaderListSerializer
         fields = [
             'username',
             'user_id',
@@ -76,36 +41,13 @@ class UserListSerializer(serializers.ModelSerializer):
 
     i_follow = serializers.SerializerMethodField()
 
-    def get_i_follow(self, user):
+    def prime(self, users):
         me = self.context['request'].user
-        following = user.following.filter(follower=me).count()
-        return following == 1
-
-    def get_profile_img(self, user):
-        try:
-            profile_img = user.profile_img.get()
-        except ProfileMedia.DoesNotExist:
-            return ProfileMedia.default_profile_img
-        return profile_img.media.url if profile_img.media else profile_img.image_url
-
-def custom_paginator(obj_list, n, request):
-    paginator = Paginator(obj_list, n)
-    page = request.GET.get('page')
-    try:
-        tweets = paginator.get_page(page)
-    except PageNotAnInteger:
-        tweets = paginator.get_page(1)
-    except EmptyPage:
-        tweets = paginator.get_page(paginator.num_pages)
-
-    index = tweets.number
-    max_index = len(paginator.page_range)
-
-    previous_page = None if index <= 1 else index-1
-    next_page = None if index >= max_index else index+1
-
-    return paginator.get_page(page), previous_page, next_page
+        self.loader(follows).prime([(me.pk, x.pk) for x in users])
 
+    def get_i_follow(self, user):
+        me = self.context['request'].user
+        return self.loader(follows).load((me.pk, user.pk))
 
 class TweetWriteSerializer(serializers.Serializer):
     content = serializers.CharField(required=False, max_length=500)
@@ -135,21 +77,20 @@ class TweetWriteSerializer(serializers.Serializer):
         else:
             quoted = None
 
-        tweet = Tweet.objects.create(tweet_type=tweet_type, author=author, content=content)
-
-        if quoted is not None:
-            quote = Quote.objects.create(quoted=quoted, quoting=tweet)
+        with transaction.atomic():
+            tweet = Tweet.objects.create(tweet_type=tweet_type, author=author, content=content)
+            if quoted is not None:
+                quote = Quote.objects.create(quoted=quoted, quoting=tweet)
+                counters.add(quoted.id, 'quote_count')
+        timeline.fan_out_on_commit(tweet, author)
+        search_index.index_tweet(tweet)
 
         media_list = self.context['request'].FILES.getlist('media')
         for media in media_list:
             if media is not None:
                 tweet_media = TweetMedia.objects.create(media=media, tweet=tweet)
 
-        splited = content.split(' ')
-        for x in splited:
-            if x.startswith('@'):
-                mention(x[1:], tweet)
-                notify(author, x[1:], tweet, 'MENTION')
+        notification_tasks.dispatch(notification_tasks.notify_mentions, author.pk, tweet.id, content)
 
         return tweet
 
@@ -162,10 +103,33 @@ class MediaSerializer(serializers.ModelSerializer):
         ]
 
 
-class TweetSerializer(serializers.ModelSerializer):
+class EngagementMixin(LoaderMixin):
+    def engagement(self):
+        return EngagementLoader.for_request(self.context['request'])
+
+    def prime(self, tweets):
+        for batch in self.batches(tweets):
+            batch()
+
+    def batches(self, tweets):
+        # the independent loads of prime(), which twitter.asyncviews.gather may run at once;
+        # loaders are looked up here, on the request's thread
+        engagement = self.engagement()
+        batches = [lambda: engagement.prime(tweets)]
+        if 'media' in self.fields:
+            media = self.loader(tweet_media, ())
+            batches.append(lambda: media.prime([x.id for x in tweets]))
+        if 'retweeting_user_name' in self.fields:
+            users = self.loader(users_by_user_id)
+            batches.append(lambda: users.prime([x.retweeting_user for x in tweets if x.tweet_type == 'RETWEET']))
+        return batches
+
+
+class TweetSerializer(EngagementMixin, serializers.ModelSerializer):
     class Meta:
         model = Tweet
         exclude = ['created_at']
+        list_serializer_class = LoaderListSerializer
 
     author = UserSerializer(read_only=True)
     media = serializers.SerializerMethodField()
@@ -177,54 +141,43 @@ class TweetSerializer(serializers.ModelSerializer):
     user_like = serializers.SerializerMethodField()
 
     def get_media(self, tweet):
-        media = tweet.media.all()
+        media = self.loader(tweet_media, ()).load(tweet.id)
         serializer = MediaSerializer(media, many=True)
         return serializer.data
 
     def get_retweeting_user_name(self, tweet):
         if tweet.tweet_type != 'RETWEET':
             return ''
-        retweeting_user = User.objects.get(user_id=tweet.retweeting_user)
-        return retweeting_user.username
+        retweeting_user = self.loader(users_by_user_id).load(tweet.retweeting_user)
+        return retweeting_user.username if retweeting_user is not None else ''
 
     def get_replies(self, tweet):
-        if tweet.tweet_type == 'RETWEET':
-            tweet = tweet.retweeting.all()[0].retweeted
-        return tweet.replied_by.all().count()
+        loader = self.engagement()
+        return loader.count(loader.source_id(tweet), 'replies')
 
     def get_retweets(self, tweet):
-        if tweet.tweet_type == 'RETWEET':
-            tweet = tweet.retweeting.all()[0].retweeted
-        return tweet.retweeted_by.all().count() + tweet.quoted_by.all().count()
+        loader = self.engagement()
+        source_id = loader.source_id(tweet)
+        return loader.count(source_id, 'retweets') + loader.count(source_id, 'quotes')
 
     def get_user_retweet(self, tweet):
-        me = self.context['request'].user
-        if me.is_anonymous:
-            return False
-        if tweet.tweet_type == 'RETWEET':
-            tweet = tweet.retweeting.all()[0].retweeted
-        user_retweet = tweet.retweeted_by.filter(user=me).count()
-        return user_retweet == 1
+        loader = self.engagement()
+        return loader.user_retweet(loader.source_id(tweet))
 
     def get_likes(self, tweet):
-        if tweet.tweet_type == 'RETWEET':
-            tweet = tweet.retweeting.all()[0].retweeted
-        return tweet.liked_by.all().count()
+        loader = self.engagement()
+        return loader.count(loader.source_id(tweet), 'likes')
 
     def get_user_like(self, tweet):
-        me = self.context['request'].user
-        if me.is_anonymous:
-            return False
-        if tweet.tweet_type == 'RETWEET':
-            tweet = tweet.retweeting.all()[0].retweeted
-        user_like = tweet.liked_by.filter(user=me).count()
-        return user_like == 1
+        loader = self.engagement()
+        return loader.user_like(loader.source_id(tweet))
 
 
-class TweetSummarySerializer(serializers.ModelSerializer):
+class TweetSummarySerializer(EngagementMixin, serializers.ModelSerializer):
     class Meta:
         model = Tweet
         exclude = ['created_at', 'retweeting_user']
+        list_serializer_class = LoaderListSerializer
 
     author = UserSerializer(read_only=True)
     replies = serializers.SerializerMethodField()
@@ -234,43 +187,32 @@ class TweetSummarySerializer(serializers.ModelSerializer):
     user_like = serializers.SerializerMethodField()
 
     def get_replies(self, tweet):
-        if tweet.tweet_type == 'RETWEET':
-            tweet = tweet.retweeting.all()[0].retweeted
-        return tweet.replied_by.all().count()
+        loader = self.engagement()
+        return loader.count(loader.source_id(tweet), 'replies')
 
     def get_retweets(self, tweet):
-        if tweet.tweet_type == 'RETWEET':
-            tweet = tweet.retweeting.all()[0].retweeted
-        return tweet.retweeted_by.all().count() + tweet.quoted_by.all().count()
+        loader = self.engagement()
+        source_id = loader.source_id(tweet)
+        return loader.count(source_id, 'retweets') + loader.count(source_id, 'quotes')
 
     def get_user_retweet(self, tweet):
-        me = self.context['request'].user
-        if me.is_anonymous:
-            return False
-        if tweet.tweet_type == 'RETWEET':
-            tweet = tweet.retweeting.all()[0].retweeted
-        user_retweet = tweet.retweeted_by.filter(user=me).count()
-        return user_retweet == 1
+        loader = self.engagement()
+        return loader.user_retweet(loader.source_id(tweet))
 
     def get_likes(self, tweet):
-        if tweet.tweet_type == 'RETWEET':
-            tweet = tweet.retweeting.all()[0].retweeted
-        return tweet.liked_by.all().count()
+        loader = self.engagement()
+        return loader.count(loader.source_id(tweet), 'likes')
 
     def get_user_like(self, tweet):
-        me = self.context['request'].user
-        if me.is_anonymous:
-            return False
-        if tweet.tweet_type == 'RETWEET':
-            tweet = tweet.retweeting.all()[0].retweeted
-        user_like = tweet.liked_by.filter(user=me).count()
-        return user_like == 1
+        loader = self.engagement()
+        return loader.user_like(loader.source_id(tweet))
 
 
-class TweetSearchInfoSerializer(serializers.ModelSerializer):
+class TweetSearchInfoSerializer(EngagementMixin, serializers.ModelSerializer):
     class Meta:
         model = Tweet
         fields = '__all__'
+        list_serializer_class = LoaderListSerializer
 
     author = UserSerializer(read_only=True)
     media = serializers.SerializerMethodField()
@@ -281,41 +223,32 @@ class TweetSearchInfoSerializer(serializers.ModelSerializer):
     user_like = serializers.SerializerMethodField()
     
     def get_media(self, tweet):
-        media = tweet.media.all()
+        media = self.loader(tweet_media, ()).load(tweet.id)
         serializer = MediaSerializer(media, many=True)
         return serializer.data
 
     def get_replies(self, tweet):
-        return tweet.replied_by.all().count()
+        return self.engagement().count(tweet.id, 'replies')
 
     def get_retweets(self, tweet):
-        return tweet.retweeted_by.all().count()
+        return self.engagement().count(tweet.id, 'retweets')
 
     def get_likes(self, tweet):
-        return tweet.liked_by.all().count()
+        return self.engagement().count(tweet.id, 'likes')
 
     def get_user_retweet(self, tweet):
-        me = self.context['request'].user
-        if me.is_anonymous:
-            return False
-        if tweet.tweet_type == 'RETWEET':
-            tweet = tweet.retweeting.all()[0].retweeted
-        user_retweet = tweet.retweeted_by.filter(user=me).count()
-        return user_retweet == 1
+        loader = self.engagement()
+        return loader.user_retweet(loader.source_id(tweet))
 
     def get_user_like(self, tweet):
-        me = self.context['request'].user
-        if me.is_anonymous:
-            return False
-        if tweet.tweet_type == 'RETWEET':
-            tweet = tweet.retweeting.all()[0].retweeted
-        user_like = tweet.liked_by.filter(user=me).count()
-        return user_like == 1
+        loader = self.engagement()
+        return loader.user_like(loader.source_id(tweet))
 
-class TweetDetailSerializer(serializers.ModelSerializer):
+class TweetDetailSerializer(EngagementMixin, serializers.ModelSerializer):
     class Meta:
         model = Tweet
         exclude = ['created_at']
+        list_serializer_class = LoaderListSerializer
 
     author = UserSerializer(read_only=True)
     media = serializers.SerializerMethodField()
@@ -328,54 +261,44 @@ class TweetDetailSerializer(serializers.ModelSerializer):
     replying_tweets = serializers.SerializerMethodField()
 
     def get_media(self, tweet):
-        media = tweet.media.all()
+        media = self.loader(tweet_media, ()).load(tweet.id)
         serializer = MediaSerializer(media, many=True)
         return serializer.data
 
     def get_retweets(self, tweet):
-        return tweet.retweeted_by.all().count()
+        return self.engagement().count(tweet.id, 'retweets')
 
     def get_user_retweet(self, tweet):
-        me = self.context['request'].user
-        if me.is_anonymous:
-            return False
-        user_retweet = tweet.retweeted_by.filter(user=me).count()
-        return user_retweet == 1
+        return self.engagement().user_retweet(tweet.id)
 
     def get_quotes(self, tweet):
-        return tweet.quoted_by.all().count()
+        return self.engagement().count(tweet.id, 'quotes')
 
     def get_likes(self, tweet):
-        return tweet.liked_by.all().count()
+        return self.engagement().count(tweet.id, 'likes')
 
     def get_user_like(self, tweet):
-        me = self.context['request'].user
-        if me.is_anonymous:
-            return False
-        user_like = tweet.liked_by.filter(user=me).count()
-        return user_like == 1
+        return self.engagement().user_like(tweet.id)
 
     def get_replied_tweet(self, tweet):
-        if tweet.tweet_type != 'REPLY':
-            return None
-        replied = tweet.replying_to.select_related('replied').get(replying=tweet)
-        if replied.replied is None:
-            return {'message': 'This Tweet was deleted by the Tweet author'}
-        request = self.context['request']
-        replied_tweet = TweetSerializer(replied.replied, context={'request': request})
-
-        data = replied_tweet.data
-        data['replied_tweet'] = self.get_replied_tweet(replied.replied)
-
-        return data
+        # the chain of tweets replied to, nested nearest first: one query for the chain and batched counters
+        chain, rest = conversation.ancestors(tweet, settings.TWEET_THREAD_MAX_DEPTH)
+        if rest is conversation.DELETED:
+            rest = {'message': 'This Tweet was deleted by the Tweet author'}
+        elif rest is not None:
+            rest = {'id': rest, 'message': 'More replies up the thread'}     # past the depth cap, open its thread
+        data = TweetSerializer(chain, context={'request': self.context['request']}, many=True).data
+        for x in reversed(data):
+            x['replied_tweet'] = rest
+            rest = x
+        return rest
 
     def get_replying_tweets(self, tweet):
-        replying = tweet.replied_by.select_related('replying').all()
-        if not replying:
-            return []
-        replying_list = [x.replying for x in replying]
+        replying_list = Tweet.objects.filter(replying_to__replied=tweet).select_related('author').order_by('created_at', 'id')
         request = self.context['request']
-        replying, previous_page, next_page = custom_paginator(replying_list, 10, request)
+        replying, previous_page, next_page = keyset_paginator(replying_list, 10, request)
+        if not replying and previous_page is None:
+            return []
         serializer = TweetSerializer(replying, context={'request': request}, many=True)
         data = serializer.data
 
@@ -425,24 +348,24 @@ class ReplySerializer(serializers.Serializer):
         else:
             quoted = None
 
-        replying = Tweet.objects.create(tweet_type=tweet_type, author=author, reply_to=reply_to, content=content)
-        reply = Reply.objects.create(replied=replied, replying=replying)
-
-        if quoted is not None:
-            quote = Quote.objects.create(quoted=quoted, quoting=replying)
+        with transaction.atomic():
+            replying = Tweet.objects.create(tweet_type=tweet_type, author=author, reply_to=reply_to, content=content)
+            reply = Reply.objects.create(replied=replied, replying=replying)
+            conversation.attach(replying, replied)
+            counters.add(replied.id, 'reply_count')
+            if quoted is not None:
+                quote = Quote.objects.create(quoted=quoted, quoting=replying)
+                counters.add(quoted.id, 'quote_count')
+        timeline.fan_out_on_commit(replying, author)
+        search_index.index_tweet(replying)
 
         media_list = self.context['request'].FILES.getlist('media')
         for media in media_list:
             if media is not None:
                 tweet_media = TweetMedia.objects.create(media=media, tweet=replying)
 
-        splited = content.split(' ')
-        for x in splited:
-            if x.startswith('@'):
-                mention(x[1:], replying)
-                notify(author, x[1:], replying, 'MENTION')
-        mention(reply_to, replying)
-        notify_all(author, replied, 'REPLY', replying)
+        notification_tasks.dispatch(notification_tasks.notify_mentions, author.pk, replying.id, content, reply_to)
+        notification_tasks.dispatch(notification_tasks.notify_all, author.pk, replied.id, 'REPLY', replying.id)
 
         return True
 
@@ -469,8 +392,11 @@ class RetweetSerializer(serializers.Serializer):
 
         exist = retweeted.retweeted_by.filter(user=me)
         if not exist:
-            retweeting = Tweet.objects.create(tweet_type=tweet_type, author=author, retweeting_user=retweeting_user, content=content, written_at=written_at)
-            retweet = Retweet.objects.create(retweeted=retweeted, retweeting=retweeting, user=me)
+            with transaction.atomic():
+                retweeting = Tweet.objects.create(tweet_type=tweet_type, author=author, retweeting_user=retweeting_user, content=content, written_at=written_at)
+                retweet = Retweet.objects.create(retweeted=retweeted, retweeting=retweeting, user=me)
+                counters.add(retweeted.id, 'retweet_count')
+            timeline.fan_out_on_commit(retweeting, me)
         else:
             false = Retweet.objects.create(retweeted=retweeted, retweeting=retweeted, user=me)
 
@@ -479,7 +405,7 @@ class RetweetSerializer(serializers.Serializer):
             if media is not None:
                 tweet_media = TweetMedia.objects.create(media=media.media, tweet=retweeting)
 
-        notify_all(me, retweeted, 'RETWEET')
+        notification_tasks.dispatch(notification_tasks.notify_all, me.pk, retweeted.id, 'RETWEET')
 
         return True
 
@@ -511,19 +437,18 @@ class QuoteSerializer(serializers.Serializer):
         content += ' dyzs1883jjmms.cloudfront.net/status/' + str(quoted.id)
         media_list = self.context['request'].FILES.getlist('media')
 
-        quoting = Tweet.objects.create(tweet_type=tweet_type, author=author, content=content)
-        quote = Quote.objects.create(quoted=quoted, quoting=quoting)
+        with transaction.atomic():
+            quoting = Tweet.objects.create(tweet_type=tweet_type, author=author, content=content)
+            quote = Quote.objects.create(quoted=quoted, quoting=quoting)
+            counters.add(quoted.id, 'quote_count')
+        timeline.fan_out_on_commit(quoting, author)
+        search_index.index_tweet(quoting)
 
         for media in media_list:
             if media is not None:
                 tweet_media = TweetMedia.objects.create(media=media, tweet=quoting)
 
-        splited = content.split(' ')
-        for x in splited:
-            if x.startswith('@'):
-                mention(x[1:], quoting)
-                notify(author, x[1:], quoting, 'MENTION')
-
+        notification_tasks.dispatch(notification_tasks.notify_mentions, author.pk, quoting.id, content)
 
         return True
 
@@ -542,9 +467,11 @@ class LikeSerializer(serializers.Serializer):
             liked = liked.retweeting.all()[0].retweeted
 
         me = self.context['request'].user
-        user_like = UserLike.objects.create(user=me, liked=liked)
+        with transaction.atomic():
+            user_like = UserLike.objects.create(user=me, liked=liked)
+            counters.add(liked.id, 'like_count')
 
-        notify_all(me, liked, 'LIKE')
+        notification_tasks.dispatch(notification_tasks.notify_all, me.pk, liked.id, 'LIKE')
 
         return True
 
@@ -557,19 +484,14 @@ class HomeSerializer(serializers.Serializer):
         serializer = UserSerializer(me)
         return serializer.data
 
-    def get_tweets(self, me):
-        follows = me.follower.select_related('following').all()
+    @staticmethod
+    def page(me, request):
+        tweet_list = timeline.home_tweets(me)    # materialized by timeline.fan_out / timeline.backfill
+        return keyset_paginator(tweet_list, 10, request, ordering=('-position', '-id'))
 
-        q = Q()
-        for follow in follows:
-            q |= (Q(author=follow.following) & ~Q(tweet_type='RETWEET'))                    # tweets written(or replied, quoted) by my following user
-            q |= (Q(retweeting_user=follow.following.user_id) & Q(tweet_type='RETWEET'))    # tweets retweeted by my following user
-        q |= (Q(author=me) & ~Q(tweet_type='RETWEET'))                                      # tweets written(or replied, quoted) by me
-        q |= (Q(retweeting_user=me.user_id) & Q(tweet_type='RETWEET'))                      # tweets retweeted by me
-
-        tweet_list = Tweet.objects.filter(q).order_by('-created_at')
+    def get_tweets(self, me):
         request = self.context['request']
-        tweets, previous_page, next_page = custom_paginator(tweet_list, 10, request)
+        tweets, previous_page, next_page = self.context.get('page') or self.page(me, request)     # async HomeView loads it first
         serializer = TweetSerializer(tweets, many=True, context={'request': request})
         data = serializer.data
 
@@ -0,0 +1,24 @@
+from celery import shared_task
+from django.conf import settings
+
+from tweet import counters, timeline
+from user.models import User
+
+
+@shared_task
+def flush_tweet_counters():
+    # scheduled by CELERY_BEAT_SCHEDULE; keeps folding while full batches come back
+    batch_size = settings.TWEET_COUNTER_FLUSH_BATCH
+    flushed = batch = counters.flush(batch_size)
+    while batch == batch_size:
+        batch = counters.flush(batch_size)
+        flushed += batch
+    return flushed
+
+
+@shared_task
+def backfill_followers(actor_pk):
+    # queued when an actor drops back to TIMELINE_FANOUT_FOLLOWER_LIMIT followers
+    actor = User.objects.filter(pk=actor_pk).first()
+    if actor is not None:
+        timeline.backfill_followers(actor)
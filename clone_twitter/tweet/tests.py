@@ -2,14 +2,39 @@ from django.test import TestCase
 
 from factory.django import DjangoModelFactory
 
+from notification import fanout, stream, tasks as notification_tasks, unread
+from notification.fanout import notify_all
+from notification.models import Mention, Notification
 from user.models import User, Follow
-from tweet.models import Tweet, Reply, Retweet, TweetMedia, UserLike, Quote
-from django.test import TestCase
-from django.db import transaction
+from tweet import conversation, counters, search, search_index, timeline
+from unittest import mock
+from tweet.models import Tweet, Reply, Retweet, TweetMedia, UserLike, Quote, TimelineEntry, TweetCounterShard
+from tweet.tasks import flush_tweet_counters
+from tweet.paginations import decode_cursor, encode_cursor, key_fields
+from tweet.views import TweetSearchViewSet, AsyncHomeView, AsyncTweetDetailView, AsyncUserTweetsView
+from notification.views import AsyncNotificationView
+from rest_framework.test import APIRequestFactory
+from django.test import TestCase, override_settings
+from django.db import IntegrityError, connection, transaction
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from user.serializers import jwt_token_of
+import asyncio
 import datetime
 from datetime import timedelta
+import os
+import tempfile
+from io import BytesIO, StringIO
+from django.core.management import call_command
+from django.core.cache import cache
+from django.utils import timezone
+from asgiref.sync import async_to_sync, sync_to_async
+import json
+import twitter.pubsub
+from twitter.asyncviews import gather
+from twitter.middleware import QueryCounter, QueryCountMiddleware, current_counter
+import fnmatch
+from django.core.exceptions import ImproperlyConfigured
 
 class UserFactory(DjangoModelFactory):
     class Meta:
@@ -576,6 +601,52 @@ class TweetDetailTestCase(TestCase):
 
         self.assertTrue(data['user_retweet'])
 
+    def reply_chain(self, depth):
+        # tweets[i + 1] replies to tweets[i]
+        tweets = [self.tweet]
+        for i in range(depth):
+            reply = TweetFactory(tweet_type='REPLY', author=self.user2, content='reply %d' % i, reply_to='user1_id')
+            ReplyFactory(replied=tweets[-1], replying=reply)
+            tweets.append(reply)
+        return tweets
+
+    def replied_chain(self, data):
+        chain = []
+        while data is not None and 'content' in data:
+            data = data['replied_tweet']
+            if data is not None and 'content' in data:
+                chain.append(data['content'])
+        return chain, data
+
+    def test_get_tweet_reply_chain(self):
+        tweets = self.reply_chain(12)
+        with CaptureQueriesContext(connection) as deep:
+            response = self.client.get('/api/v1/tweet/%d/' % tweets[-2].id, HTTP_AUTHORIZATION=self.user1_token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        chain, end = self.replied_chain(response.json())
+        self.assertEqual(chain, ['reply %d' % i for i in reversed(range(10))] + ['content'])
+        self.assertIsNone(end)
+
+        with CaptureQueriesContext(connection) as shallow:
+            self.client.get('/api/v1/tweet/%d/' % tweets[2].id, HTTP_AUTHORIZATION=self.user1_token)
+        self.assertEqual(len(deep), len(shallow))       # one query for the chain, whatever its depth
+
+    @override_settings(TWEET_THREAD_MAX_DEPTH=3)
+    def test_get_tweet_reply_chain_depth_cap(self):
+        tweets = self.reply_chain(5)
+        data = self.client.get('/api/v1/tweet/%d/' % tweets[-1].id, HTTP_AUTHORIZATION=self.user1_token).json()
+        chain, end = self.replied_chain(data)
+        self.assertEqual(chain, ['reply 3', 'reply 2', 'reply 1'])
+        self.assertEqual(end['id'], tweets[1].id)
+
+    def test_get_tweet_reply_chain_deleted(self):
+        tweets = self.reply_chain(3)
+        tweets[1].delete()
+        data = self.client.get('/api/v1/tweet/%d/' % tweets[-1].id, HTTP_AUTHORIZATION=self.user1_token).json()
+        chain, end = self.replied_chain(data)
+        self.assertEqual(chain, ['reply 1'])
+        self.assertEqual(end, {'message': 'This Tweet was deleted by the Tweet author'})
+
 
 class LikeTestCase(TestCase):
 
@@ -764,6 +835,9 @@ class HomeTestCase(TestCase):
             content = 'content'
         )
 
+        # fixtures bypass the fan-out on write
+        call_command('rebuild_timelines', stdout=StringIO())
+
     def test_get_home(self):
         # No following & No tweet
         response = self.client.get('/api/v1/home/', HTTP_AUTHORIZATION=self.user3_token)
@@ -884,6 +958,556 @@ class HomeTestCase(TestCase):
         self.assertFalse(following_tweet['user_like'])
 
 
+class TimelineTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+
+        cls.users = [
+            UserFactory(
+                email='email%d@email.com' % i,
+                user_id='user%d_id' % i,
+                username='username%d' % i,
+                password='password',
+                phone_number='010-0000-%04d' % i,
+                is_verified=True
+            ) for i in range(3)]
+
+        cls.tokens = ['JWT ' + jwt_token_of(User.objects.get(email='email%d@email.com' % i)) for i in range(3)]
+
+        cls.tweet = TweetFactory(
+            tweet_type = 'GENERAL',
+            author = cls.users[0],
+            content = 'old tweet'
+        )
+
+    def get_home_contents(self, token):
+        response = self.client.get('/api/v1/home/', HTTP_AUTHORIZATION=token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(x['tweet_type'], x['content']) for x in response.json()['tweets'][:-1]]
+
+    def test_fan_out_on_write(self):
+        FollowFactory(follower=self.users[1], following=self.users[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/tweet/', data={'content': 'new tweet'}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[0])
+            self.client.post('/api/v1/reply/', data={'id': self.tweet.id, 'content': 'reply'}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[0])
+
+        self.assertEqual(self.get_home_contents(self.tokens[0]), [('REPLY', 'reply'), ('GENERAL', 'new tweet')])
+        self.assertEqual(self.get_home_contents(self.tokens[1]), [('REPLY', 'reply'), ('GENERAL', 'new tweet')])
+        self.assertEqual(self.get_home_contents(self.tokens[2]), [])
+
+    def test_retweet_fan_out(self):
+        FollowFactory(follower=self.users[1], following=self.users[2])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/retweet/', data={'id': self.tweet.id}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[2])
+
+        self.assertEqual(self.get_home_contents(self.tokens[1]), [('RETWEET', 'old tweet')])
+        self.assertEqual(self.get_home_contents(self.tokens[2]), [('RETWEET', 'old tweet')])
+
+        self.client.delete('/api/v1/retweet/' + str(self.tweet.id) + '/', HTTP_AUTHORIZATION=self.tokens[2])
+        self.assertEqual(self.get_home_contents(self.tokens[1]), [])
+
+    def test_fan_out_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/api/v1/tweet/', data={'content': 'new tweet'}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[0])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(TimelineEntry.objects.filter(tweet__content='new tweet').exists())
+
+        # a failed fan out is logged, the tweet stays written
+        with mock.patch.object(timeline, 'fan_out', side_effect=IntegrityError), self.assertLogs('tweet.timeline', 'ERROR'):
+            for callback in callbacks:
+                callback()
+        self.assertTrue(Tweet.objects.filter(content='new tweet').exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/tweet/', data={'content': 'next tweet'}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[0])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.get_home_contents(self.tokens[0]), [('GENERAL', 'next tweet')])
+
+    def test_backfill_and_remove_on_follow(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/tweet/', data={'content': 'my tweet'}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[1])
+
+        response = self.client.post('/api/v1/follow/', data={'user_id': 'user0_id'}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[1])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.get_home_contents(self.tokens[1]), [('GENERAL', 'my tweet'), ('GENERAL', 'old tweet')])
+
+        response = self.client.delete('/api/v1/unfollow/user0_id/', HTTP_AUTHORIZATION=self.tokens[1])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_home_contents(self.tokens[1]), [('GENERAL', 'my tweet')])
+
+    def test_delete_tweet_removes_entries(self):
+        FollowFactory(follower=self.users[1], following=self.users[0])
+        call_command('rebuild_timelines', stdout=StringIO())
+        self.assertEqual(TimelineEntry.objects.filter(tweet=self.tweet).count(), 2)
+
+        self.client.delete('/api/v1/tweet/' + str(self.tweet.id) + '/', HTTP_AUTHORIZATION=self.tokens[0])
+        self.assertEqual(TimelineEntry.objects.count(), 0)
+
+
+class HybridTimelineTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+
+        cls.users = [
+            UserFactory(
+                email='email%d@email.com' % i,
+                user_id='user%d_id' % i,
+                username='username%d' % i,
+                password='password',
+                phone_number='010-0000-%04d' % i,
+                is_verified=True
+            ) for i in range(4)]
+
+        cls.tokens = ['JWT ' + jwt_token_of(User.objects.get(email='email%d@email.com' % i)) for i in range(4)]
+
+        # user0 is followed by everyone else, user1 only by user3
+        for i in (1, 2, 3):
+            cls.client_class().post('/api/v1/follow/', data={'user_id': 'user0_id'}, content_type='application/json', HTTP_AUTHORIZATION=cls.tokens[i])
+        cls.client_class().post('/api/v1/follow/', data={'user_id': 'user1_id'}, content_type='application/json', HTTP_AUTHORIZATION=cls.tokens[3])
+
+    def post(self, i, content):
+        with self.captureOnCommitCallbacks(execute=True):    # timelines are written once the tweet is committed
+            self.client.post('/api/v1/tweet/', data={'content': content}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[i])
+
+    def get_home_contents(self, i):
+        response = self.client.get('/api/v1/home/', HTTP_AUTHORIZATION=self.tokens[i])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [x['content'] for x in response.json()['tweets'][:-1]]
+
+    def test_followers_count(self):
+        self.assertEqual(User.objects.get(user_id='user0_id').followers_count, 3)
+        self.client.delete('/api/v1/unfollow/user0_id/', HTTP_AUTHORIZATION=self.tokens[3])
+        self.assertEqual(User.objects.get(user_id='user0_id').followers_count, 2)
+
+    @override_settings(TIMELINE_FANOUT_FOLLOWER_LIMIT=2)
+    def test_pull_high_follower_actor(self):
+        self.post(0, 'celebrity 1')
+        self.post(1, 'normal 1')
+        self.post(0, 'celebrity 2')
+
+        # only the celebrity's own timeline is written
+        tweet = Tweet.objects.get(content='celebrity 1')
+        self.assertEqual(list(TimelineEntry.objects.filter(tweet=tweet).values_list('user__user_id', flat=True)), ['user0_id'])
+
+        self.assertEqual(self.get_home_contents(3), ['celebrity 2', 'normal 1', 'celebrity 1'])
+        self.assertEqual(self.get_home_contents(2), ['celebrity 2', 'celebrity 1'])
+        self.assertEqual(self.get_home_contents(0), ['celebrity 2', 'celebrity 1'])
+
+    def test_crossing_follower_limit_does_not_duplicate(self):
+        self.post(0, 'fanned out')
+        with override_settings(TIMELINE_FANOUT_FOLLOWER_LIMIT=2):
+            self.post(0, 'pulled')
+            self.assertEqual(self.get_home_contents(3), ['pulled', 'fanned out'])
+
+    def test_count_tweets_in_both_sources_once(self):
+        self.post(0, 'fanned out')
+        with override_settings(TIMELINE_FANOUT_FOLLOWER_LIMIT=2):
+            self.post(0, 'pulled')
+            home = timeline.home_tweets(User.objects.get(user_id='user3_id'))
+            self.assertEqual(home.count(), 2)
+            self.assertEqual(len(home[:10]), 2)
+
+    def test_dropping_below_follower_limit_keeps_pulled_tweets(self):
+        with override_settings(TIMELINE_FANOUT_FOLLOWER_LIMIT=2):
+            self.post(0, 'pulled')
+            self.assertEqual(self.get_home_contents(2), ['pulled'])
+
+            # user0 falls back to 2 followers and is fanned out again
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.delete('/api/v1/unfollow/user0_id/', HTTP_AUTHORIZATION=self.tokens[3])
+            self.post(0, 'fanned out')
+            self.assertEqual(self.get_home_contents(2), ['fanned out', 'pulled'])
+            self.assertEqual(self.get_home_contents(1), ['fanned out', 'pulled'])
+
+    @override_settings(TIMELINE_MAX_LENGTH=2, TIMELINE_TRIM_INTERVAL=1)
+    def test_fan_out_trims(self):
+        for i in range(4):
+            self.post(0, 'tweet %d' % i)
+        self.assertEqual(self.get_home_contents(2), ['tweet 3', 'tweet 2'])
+        self.assertEqual(TimelineEntry.objects.filter(user__user_id='user2_id').count(), 2)
+
+
+class EngagementCountTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+
+        cls.users = [
+            UserFactory(
+                email='email%d@email.com' % i,
+                user_id='user%d_id' % i,
+                username='username%d' % i,
+                password='password',
+                phone_number='010-0000-%04d' % i,
+                is_verified=True
+            ) for i in range(3)]
+
+        cls.tokens = ['JWT ' + jwt_token_of(User.objects.get(email='email%d@email.com' % i)) for i in range(3)]
+
+        with cls.captureOnCommitCallbacks(execute=True):
+            for i in range(6):
+                cls.client_class().post('/api/v1/tweet/', data={'content': 'content%d' % i}, content_type='application/json', HTTP_AUTHORIZATION=cls.tokens[0])
+        cls.tweets = list(Tweet.objects.order_by('id'))
+
+    def post(self, url, i, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data=data, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[i])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_home_counts(self):
+        self.post('/api/v1/like/', 0, {'id': self.tweets[5].id})
+        self.post('/api/v1/like/', 1, {'id': self.tweets[5].id})
+        self.post('/api/v1/retweet/', 0, {'id': self.tweets[5].id})
+        self.post('/api/v1/quote/', 1, {'id': self.tweets[5].id, 'content': 'quote'})
+        self.post('/api/v1/reply/', 1, {'id': self.tweets[4].id, 'content': 'reply'})
+
+        response = self.client.get('/api/v1/home/', HTTP_AUTHORIZATION=self.tokens[0])
+        tweets = response.json()['tweets'][:-1]
+
+        retweet, tweet5, tweet4 = tweets[0], tweets[1], tweets[2]
+        for data in (retweet, tweet5):
+            self.assertEqual(data['content'], 'content5')
+            self.assertEqual(data['likes'], 2)
+            self.assertEqual(data['retweets'], 2)     # retweets + quotes
+            self.assertEqual(data['replies'], 0)
+            self.assertTrue(data['user_like'])
+            self.assertTrue(data['user_retweet'])
+        self.assertEqual(retweet['tweet_type'], 'RETWEET')
+        self.assertEqual(tweet4['replies'], 1)
+        self.assertFalse(tweet4['user_like'])
+
+        response = self.client.get('/api/v1/tweet/' + str(self.tweets[5].id) + '/', HTTP_AUTHORIZATION=self.tokens[2])
+        data = response.json()
+        self.assertEqual((data['retweets'], data['quotes'], data['likes']), (1, 1, 2))
+        self.assertFalse(data['user_like'])
+
+    def test_counts_are_batched_per_page(self):
+        for tweet in self.tweets:
+            self.post('/api/v1/like/', 1, {'id': tweet.id})
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/home/', HTTP_AUTHORIZATION=self.tokens[0])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([x['likes'] for x in response.json()['tweets'][:-1]], [1] * 6)
+
+        like_queries = [x['sql'] for x in queries.captured_queries if 'tweet_userlike' in x['sql']]
+        self.assertEqual(len(like_queries), 1)      # counts come from the counter columns, one viewer flag lookup
+
+
+    @override_settings(QUERY_COUNT_HEADER=True)
+    def test_page_relations_are_batched(self):
+        self.post('/api/v1/retweet/', 0, {'id': self.tweets[0].id})
+        response = self.client.get('/api/v1/home/', HTTP_AUTHORIZATION=self.tokens[0])
+        n_queries = int(response['X-Query-Count'])
+
+        for tweet in self.tweets[1:4]:
+            self.post('/api/v1/retweet/', 0, {'id': tweet.id})
+        response = self.client.get('/api/v1/home/', HTTP_AUTHORIZATION=self.tokens[0])
+        retweets = [x for x in response.json()['tweets'][:-1] if x['tweet_type'] == 'RETWEET']
+        self.assertEqual([x['retweeting_user_name'] for x in retweets], ['username0'] * 4)
+        self.assertEqual([x['media'] for x in retweets], [[]] * 4)
+        self.assertEqual(int(response['X-Query-Count']), n_queries)     # media, retweeting users and flags: one query each
+
+class TweetCounterTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+
+        cls.users = [
+            UserFactory(
+                email='email%d@email.com' % i,
+                user_id='user%d_id' % i,
+                username='username%d' % i,
+                password='password',
+                phone_number='010-0000-%04d' % i,
+                is_verified=True
+            ) for i in range(3)]
+
+        cls.tokens = ['JWT ' + jwt_token_of(User.objects.get(email='email%d@email.com' % i)) for i in range(3)]
+
+        cls.client_class().post('/api/v1/tweet/', data={'content': 'content'}, content_type='application/json', HTTP_AUTHORIZATION=cls.tokens[0])
+        cls.tweet = Tweet.objects.get(content='content')
+
+    def post(self, url, i, data):
+        response = self.client.post(url, data=data, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[i])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def delete(self, url, i):
+        response = self.client.delete(url, HTTP_AUTHORIZATION=self.tokens[i])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def counts(self):
+        counters.flush()
+        tweet = Tweet.objects.get(id=self.tweet.id)
+        return tweet.reply_count, tweet.retweet_count, tweet.quote_count, tweet.like_count
+
+    def test_counters_follow_writes(self):
+        self.post('/api/v1/like/', 1, {'id': self.tweet.id})
+        self.post('/api/v1/like/', 2, {'id': self.tweet.id})
+        self.post('/api/v1/retweet/', 1, {'id': self.tweet.id})
+        self.post('/api/v1/quote/', 2, {'id': self.tweet.id, 'content': 'quote'})
+        self.post('/api/v1/reply/', 1, {'id': self.tweet.id, 'content': 'reply'})
+        self.assertEqual(self.counts(), (1, 1, 1, 2))
+
+        self.delete('/api/v1/like/' + str(self.tweet.id) + '/', 2)
+        self.delete('/api/v1/retweet/' + str(self.tweet.id) + '/', 1)
+        self.delete('/api/v1/tweet/' + str(Tweet.objects.get(content='reply').id) + '/', 1)
+        self.delete('/api/v1/tweet/' + str(Tweet.objects.get(content__startswith='quote').id) + '/', 2)
+        self.assertEqual(self.counts(), (0, 0, 0, 1))
+
+    @override_settings(TWEET_COUNTER_SHARDS=4)
+    def test_sharded_counters(self):
+        for i in range(3):
+            self.post('/api/v1/like/', i, {'id': self.tweet.id})
+        self.post('/api/v1/retweet/', 1, {'id': self.tweet.id})
+        self.delete('/api/v1/like/' + str(self.tweet.id) + '/', 0)
+
+        tweet = Tweet.objects.get(id=self.tweet.id)
+        self.assertEqual((tweet.retweet_count, tweet.like_count), (0, 0))     # still in the shards
+        self.assertTrue(TweetCounterShard.objects.filter(tweet=tweet).exists())
+
+        response = self.client.get('/api/v1/tweet/' + str(self.tweet.id) + '/', HTTP_AUTHORIZATION=self.tokens[0])
+        self.assertEqual((response.json()['retweets'], response.json()['likes']), (1, 2))
+
+        call_command('reconcile_tweet_counters', stdout=StringIO())    # pending shards are not drift
+        pending = TweetCounterShard.objects.count()
+        self.assertEqual(flush_tweet_counters.delay().get(), pending)
+        self.assertFalse(TweetCounterShard.objects.exists())
+        self.assertEqual(self.counts(), (0, 1, 0, 2))
+
+    def test_reconcile_command(self):
+        UserLikeFactory(user=self.users[1], liked=self.tweet)
+        RetweetFactory(retweeted=self.tweet, retweeting=TweetFactory(tweet_type='RETWEET', author=self.users[0]), user=self.users[2])
+        Tweet.objects.filter(id=self.tweet.id).update(reply_count=5)
+
+        out = StringIO()
+        call_command('reconcile_tweet_counters', chunk_size=1, stdout=out)
+        self.assertEqual(self.counts(), (0, 1, 0, 1))
+        self.assertIn('fixed 1', out.getvalue())
+
+
+@override_settings(TWEET_SEARCH_BACKEND='index', TWEET_SEARCH_INDEX_SNAPSHOT='')
+class SearchIndexTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+
+        cls.users = [
+            UserFactory(
+                email='email%d@email.com' % i,
+                user_id='user%d_id' % i,
+                username='username%d' % i,
+                password='password',
+                phone_number='010-0000-%04d' % i,
+                is_verified=True
+            ) for i in range(2)]
+        cls.users.append(UserFactory(email='email2@email.com', user_id='runner', username='runner', password='password', is_verified=True))
+
+        cls.tokens = ['JWT ' + jwt_token_of(user) for user in cls.users]
+
+        contents = ['트위터에서 만나요', 'Running with friends', 'nothing here', '트위터 runs']
+        for i, content in enumerate(contents):
+            cls.client_class().post('/api/v1/tweet/', data={'content': content}, content_type='application/json', HTTP_AUTHORIZATION=cls.tokens[i % 2])
+        cls.tweets = {x.content: x for x in Tweet.objects.all()}
+
+    def setUp(self):
+        search_index.load()
+
+    def tearDown(self):
+        search_index.reset()
+
+    def search(self, query):
+        response = self.client.get('/api/v1/search/latest/', {'query': query}, HTTP_AUTHORIZATION=self.tokens[0])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [x['content'] for x in response.json()['results']]
+
+    def test_hangul_and_latin_terms(self):
+        self.assertEqual(self.search('트위터'), ['트위터 runs', '트위터에서 만나요'])
+        self.assertEqual(self.search('run'), ['트위터 runs', 'Running with friends'])
+        self.assertEqual(self.search('트위터 run')[0], '트위터 runs')
+        self.assertEqual(self.search('friend'), ['Running with friends'])
+        self.assertEqual(self.search('만나다'), [])
+
+    def test_catch_up_and_delete(self):
+        self.assertEqual(self.search('friend'), ['Running with friends'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/tweet/', data={'content': 'new friends'}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[1])
+        self.assertEqual(self.search('friend'), ['new friends', 'Running with friends'])
+
+        # written by another process: found once the index catches up, not by the search itself
+        TweetFactory(tweet_type='GENERAL', author=self.users[0], content='old friends')
+        self.assertEqual(self.search('friend'), ['new friends', 'Running with friends'])
+        search_index.current_index().catch_up()
+        self.assertEqual(self.search('friend'), ['old friends', 'new friends', 'Running with friends'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete('/api/v1/tweet/' + str(self.tweets['Running with friends'].id) + '/', HTTP_AUTHORIZATION=self.tokens[1])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.search('friend'), ['old friends', 'new friends'])
+
+    def test_database_until_loaded(self):
+        search_index.reset()
+        self.assertEqual(self.search('friends'), ['Running with friends'])
+        self.assertIsNone(search_index.current_index())
+
+    def test_newest_hits_ranked_in_python(self):
+        with override_settings(TWEET_SEARCH_INDEX_MAX_HITS=1):
+            self.assertEqual(self.search('트위터'), ['트위터 runs'])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.search('트위터 run'), ['트위터 runs', 'Running with friends', '트위터에서 만나요'])
+        tweet_id = str(self.tweets['트위터 runs'].id)
+        self.assertFalse([x for x in queries.captured_queries if 'CASE' in x['sql'] and tweet_id in x['sql']])
+
+    def test_handles_match_by_substring(self):
+        self.client.post('/api/v1/tweet/', data={'content': 'hello'}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[2])
+        self.assertEqual(self.search('unne'), ['hello'])
+
+    def test_snapshot_restore(self):
+        index = search_index.current_index()
+        index.remove(self.tweets['nothing here'].id)
+        snapshot = BytesIO()
+        index.dump(snapshot)
+        snapshot.seek(0)
+
+        restored = search_index.InvertedIndex.load(snapshot, index.tokenizer)
+        self.assertEqual(restored.last_id, index.last_id)
+        self.assertEqual(restored.documents, index.documents)
+        for term in ('트위', 'run', 'friend', 'noth'):
+            self.assertEqual(restored.search(term), index.search(term))
+        self.assertEqual(restored.search('friend'), {self.tweets['Running with friends'].id})
+        self.assertEqual(restored.search('nothing'), set())
+
+    def test_posting_list(self):
+        postings = search_index.PostingList([3, 200, 70000])
+        self.assertEqual(len(postings.data), 1 + 2 + 3)     # varint gaps: 3, 197, 69800
+        postings.append(100)    # out of order
+        postings.append(70001)
+        self.assertEqual(list(postings), [3, 100, 200, 70000, 70001])
+
+    def test_snapshot_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'index.snapshot')
+            call_command('snapshot_search_index', path=path, stdout=StringIO())
+            with override_settings(TWEET_SEARCH_INDEX_SNAPSHOT=path):
+                self.assertEqual(search_index.load().documents, {x.id for x in self.tweets.values()})
+                self.assertEqual(self.search('만나'), ['트위터에서 만나요'])
+
+
+class KeysetPaginationTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory(email='email@email.com', user_id='user_id', username='username', password='password', is_verified=True)
+        cls.token = 'JWT ' + jwt_token_of(cls.user)
+        for i in range(25):
+            cls.client_class().post('/api/v1/tweet/', data={'content': 'content%d' % i}, content_type='application/json', HTTP_AUTHORIZATION=cls.token)
+        Tweet.objects.update(created_at=timezone.now())     # all tied on created_at: id breaks the tie
+        call_command('rebuild_timelines', stdout=StringIO())
+
+    def home(self, cursor=None):
+        data = {'cursor': cursor} if cursor else {}
+        response = self.client.get('/api/v1/home/', data, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        tweets = response.json()['tweets']
+        return [x['content'] for x in tweets[:-1]], tweets[-1]
+
+    def test_home_cursor(self):
+        contents = ['content%d' % i for i in reversed(range(25))]
+
+        page1, info = self.home()
+        self.assertEqual(page1, contents[:10])
+        self.assertIsNone(info['previous'])
+
+        with CaptureQueriesContext(connection) as queries:
+            page2, info = self.home(info['next'])
+        self.assertEqual(page2, contents[10:20])
+        self.assertFalse([x for x in queries.captured_queries if 'COUNT(' in x['sql'] and 'tweet_timelineentry' in x['sql']])
+
+        page3, info = self.home(info['next'])
+        self.assertEqual(page3, contents[20:])
+        self.assertIsNone(info['next'])
+
+        back, info = self.home(info['previous'])
+        self.assertEqual(back, contents[10:20])
+        back, info = self.home(info['previous'])
+        self.assertEqual(back, contents[:10])
+        self.assertIsNone(info['previous'])
+
+        self.assertEqual(self.home('not a cursor')[0], contents[:10])
+
+    def test_cursor_values_are_type_checked(self):
+        contents = ['content%d' % i for i in reversed(range(25))]
+        now = timezone.now()
+        for values in (['yesterday', 1], [now.isoformat(), 'abc'], [now.isoformat(), [1]], [None, None], [now.isoformat(), True]):
+            self.assertEqual(self.home(encode_cursor('next', values))[0], contents[:10])
+            response = self.client.get('/api/v1/usertweets/user_id/tweets/', {'cursor': encode_cursor('next', values)}, HTTP_AUTHORIZATION=self.token)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIsNone(response.json()['previous'])
+
+        fields = key_fields(Tweet.objects.all().query, ['created_at', 'id'])
+        self.assertEqual(decode_cursor(encode_cursor('next', [now, 7]), fields), ('next', [now, 7]))
+        self.assertEqual(decode_cursor(encode_cursor('next', [now, '7']), fields), ('next', [now, 7]))
+        self.assertIsNone(decode_cursor(encode_cursor('next', [now, 'abc']), fields))
+
+    def test_user_tweets_cursor(self):
+        response = self.client.get('/api/v1/usertweets/user_id/tweets/', HTTP_AUTHORIZATION=self.token)
+        data = response.json()
+        self.assertNotIn('count', data)
+        self.assertEqual(len(data['results']), 15)
+
+        response = self.client.get('/api/v1/usertweets/user_id/tweets/', {'cursor': data['next']}, HTTP_AUTHORIZATION=self.token)
+        data = response.json()
+        self.assertEqual([x['content'] for x in data['results']], ['content%d' % i for i in reversed(range(10))])
+        self.assertIsNone(data['next'])
+        self.assertIsNotNone(data['previous'])
+
+
+class SearchTweetsTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            UserFactory(
+                email='email%d@email.com' % i,
+                user_id='user%d_id' % i,
+                username=name,
+                password='password',
+                phone_number='010-0000-%04d' % i,
+            ) for i, name in enumerate(['alice', 'bob'])]
+        for author, content in ((0, 'a cat'), (0, 'I am here'), (1, 'cats and dogs'), (1, 'nothing')):
+            TweetFactory(tweet_type='GENERAL', author=cls.users[author], content=content)
+
+    def matches(self, keywords):
+        tweets = search.search_tweets(keywords).order_by('-num_keywords_included', 'id')
+        return [(x.content, x.num_keywords_included) for x in tweets]
+
+    def test_search_tweets(self):
+        # exact substrings of content and author handles, stopwords included
+        self.assertEqual(self.matches(['cat']), [('a cat', 1), ('cats and dogs', 1)])
+        self.assertEqual(self.matches(['i am']), [('I am here', 1)])
+        self.assertEqual(self.matches(['cat', 'bob']), [('cats and dogs', 2), ('a cat', 1), ('nothing', 1)])
+        self.assertEqual(self.matches(['alice', 'a']), [('a cat', 2), ('I am here', 2), ('cats and dogs', 1)])
+        self.assertEqual(self.matches(['zebra']), [])
+
+    def test_tweet_candidates(self):
+        self.assertIsNone(search.tweet_candidates(['cat']))       # no FULLTEXT index off MySQL: scan
+
+        with mock.patch.object(search, 'connection', mock.Mock(vendor='mysql')):
+            self.assertIsNone(search.tweet_candidates(['cat', 'a']))      # shorter than an ngram
+            candidates = search.tweet_candidates(['cat', 'i "am"'])
+        by_content, by_author = [value for key, value in candidates.children]
+        self.assertEqual([key for key, value in candidates.children], ['id__in', 'author__in'])
+        self.assertEqual(by_content.query.annotations['score'].query, '"cat" "i am"')
+        self.assertEqual(by_author.query.annotations['score'].query, '"cat" "i am"')
+
+        query = Tweet.objects.all().query
+        match = search.Match('content', query='"cat"').resolve_expression(query)
+        sql, params = match.as_mysql(query.get_compiler('default'), connection)
+        self.assertEqual((sql, params), ('MATCH ("tweet_tweet"."content") AGAINST (%s IN BOOLEAN MODE)', ('"cat"',)))
+
+
 class GetSearchTweetTestCase(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -968,6 +1592,8 @@ class GetSearchTweetTestCase(TestCase):
                 )
             )
 
+        call_command('reconcile_tweet_counters', stdout=StringIO())     # factories bypass the counter columns
+
     def test_get_search_top(self):
         response = self.client.get(
             '/api/v1/search/top/',
@@ -982,7 +1608,7 @@ class GetSearchTweetTestCase(TestCase):
         # print(list(map(lambda x:x['author']['user_id'], response.json())))
         self.assertIn('media', data[0])
         self.assertEqual(list(map(lambda x:x['author']['user_id'], data)),
-        ['test9', 'test8ee', 'test7', 'test6', 'test5', 'test4', 'test2', 'test3'])
+        ['test9', 'test8ee', 'test7', 'test6', 'test5', 'test4', 'test3', 'test2'])   # test3: 1 retweet, 1 like / test2: 1 retweet, 0 likes
         self.assertEqual(list(map(lambda x:x['tweet_type'], data)),
         ['GENERAL', 'GENERAL', 'GENERAL', 'GENERAL', 'GENERAL', 'GENERAL', 'GENERAL', 'GENERAL'])
 
@@ -1004,6 +1630,31 @@ class GetSearchTweetTestCase(TestCase):
         self.assertEqual(list(map(lambda x:x['tweet_type'], data)),
         ['GENERAL', 'GENERAL', 'REPLY', 'GENERAL', 'REPLY', 'GENERAL', 'REPLY', 'GENERAL', 'GENERAL', 'GENERAL', 'GENERAL', 'GENERAL'])
 
+    def test_get_search_without_count(self):
+        response = self.client.get('/api/v1/search/latest/', {'query': 'bb cc aa dd ee'}, HTTP_AUTHORIZATION=self.tokens[0])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.json()['count'])
+        self.assertIsNone(response.json()['next'])
+        self.assertIsNone(response.json()['previous'])
+        self.assertEqual(len(response.json()['results']), 12)
+
+        response = self.client.get('/api/v1/search/latest/', {'query': 'bb cc aa dd ee', 'page': 2}, HTTP_AUTHORIZATION=self.tokens[0])
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_search_cached_count(self):
+        cache.clear()
+        TweetSearchViewSet.pagination_count_mode = 'cached'
+        self.addCleanup(setattr, TweetSearchViewSet, 'pagination_count_mode', 'none')
+
+        response = self.client.get('/api/v1/search/latest/', {'query': 'bb cc aa dd ee'}, HTTP_AUTHORIZATION=self.tokens[0])
+        self.assertEqual(response.json()['count'], 12)
+
+        # counted once per TTL: a new match is listed but not counted yet
+        TweetFactory(tweet_type='GENERAL', author=self.users[0], content='aa', written_at=datetime.datetime.now())
+        response = self.client.get('/api/v1/search/latest/', {'query': 'bb cc aa dd ee'}, HTTP_AUTHORIZATION=self.tokens[0])
+        self.assertEqual(response.json()['count'], 12)
+        self.assertEqual(len(response.json()['results']), 13)
+
 class QuoteTestCase(TestCase):
 
     @classmethod
@@ -1367,3 +2018,472 @@ class GetUserTweetsTestCase(TestCase):
         data = response.json()['results']
 
         self.assertEqual(data, [])
+
+
+class NotifyTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+
+        cls.users = [
+            UserFactory(
+                email='email%d@email.com' % i,
+                user_id='user%d_id' % i,
+                username='username%d' % i,
+                password='password',
+                phone_number='010-0000-%04d' % i,
+                is_verified=True,
+                allow_notification=(i != 4),
+            ) for i in range(5)]
+        cls.tokens = ['JWT ' + jwt_token_of(x) for x in cls.users]
+
+        content = 'hello @user2_id @user3_id @user4_id @user2_id @nobody @user0_id'
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.client_class().post('/api/v1/tweet/', data={'content': content}, content_type='application/json', HTTP_AUTHORIZATION=cls.tokens[0])
+        cls.tweet = Tweet.objects.get()
+
+    def notified(self, noti_type):
+        notifications = Notification.objects.filter(noti_type=noti_type).order_by('notified_id')
+        return [x.notified.user_id for x in notifications]
+
+    def test_mentions(self):
+        mentioned = Mention.objects.filter(tweet=self.tweet).order_by('user_id').values_list('user__user_id', flat=True)
+        self.assertEqual(list(mentioned), ['user0_id', 'user2_id', 'user3_id', 'user4_id'])
+        # once per user, not to the author, not to users who turned notifications off
+        self.assertEqual(self.notified('MENTION'), ['user2_id', 'user3_id'])
+
+    def test_notify_all_batched(self):
+        with CaptureQueriesContext(connection) as queries:
+            notify_all(self.users[1], self.tweet, 'REPLY')
+        statements = [x['sql'].split(' ')[0] for x in queries.captured_queries if 'SAVEPOINT' not in x['sql']]
+        # recipients, notifications, their ids where the backend does not return them, actors, unread counts
+        self.assertIn(statements, [['SELECT', 'INSERT', 'INSERT', 'UPDATE'], ['SELECT', 'INSERT', 'SELECT', 'INSERT', 'UPDATE']])
+        self.assertEqual(self.notified('REPLY'), ['user0_id', 'user2_id', 'user3_id'])
+
+    def test_concurrent_delivery_fails_on_the_key(self):
+        notify_all(self.users[1], self.tweet, 'REPLY')
+        notify_all(self.users[1], self.tweet, 'LIKE')
+        # second deliveries that checked before the first ones committed
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            fanout.create(self.users[1], self.tweet, 'REPLY', [self.users[2].pk])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            fanout.add_actor(self.users[1], Notification.objects.filter(noti_type='LIKE', notified=self.users[0]))
+        self.assertEqual(self.notified('REPLY'), ['user0_id', 'user2_id', 'user3_id'])
+
+    def test_reply_notifies_author_and_mentioned(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/reply/', data={'id': self.tweet.id, 'content': 'reply'}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[2])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        replying = Tweet.objects.get(content='reply')
+        self.assertEqual(self.notified('REPLY'), ['user0_id', 'user3_id'])
+        self.assertEqual(set(Notification.objects.filter(noti_type='REPLY').values_list('tweet_id', flat=True)), {replying.id})
+
+    def test_queued_after_commit_and_deduplicated(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/api/v1/like/', data={'id': self.tweet.id}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[1])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.notified('LIKE'), [])     # nothing written in the request
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.notified('LIKE'), ['user0_id', 'user2_id', 'user3_id'])
+
+        # a redelivered task and a like after an unlike notify nobody twice
+        self.assertEqual(notification_tasks.notify_all(self.users[1].pk, self.tweet.id, 'LIKE'), 0)
+        self.client.delete('/api/v1/like/%d/' % self.tweet.id, HTTP_AUTHORIZATION=self.tokens[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/like/', data={'id': self.tweet.id}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[1])
+        self.assertEqual(self.notified('LIKE'), ['user0_id', 'user2_id', 'user3_id'])
+
+    def test_likes_are_grouped(self):
+        for i in (1, 2, 3, 1):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post('/api/v1/like/', data={'id': self.tweet.id}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[i])
+        notification = Notification.objects.get(noti_type='LIKE', notified=self.users[0])
+        self.assertEqual((notification.actor_count, notification.actors, notification.user_id), (3, [self.users[3].pk, self.users[2].pk, self.users[1].pk], self.users[3].pk))
+
+        Notification.objects.filter(pk=notification.pk).update(is_read=True)
+        with self.settings(NOTIFICATION_GROUP_SAMPLE=2):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post('/api/v1/like/', data={'id': self.tweet.id}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[4])
+        notification.refresh_from_db()
+        self.assertEqual((notification.actor_count, notification.actors, notification.is_read), (4, [self.users[4].pk, self.users[3].pk], False))
+
+        response = self.client.get('/api/v1/notification/', HTTP_AUTHORIZATION=self.tokens[0])
+        data = [x for x in response.json()['notifications'][:-1] if x['noti_type'] == 'LIKE']
+        self.assertEqual((data[0]['actor_count'], [x['user_id'] for x in data[0]['actors']]), (4, ['user4_id', 'user3_id']))
+
+        # all actors are kept, not only the sample: one no longer listed does not notify again
+        self.assertEqual(set(notification.actor_set.values_list('actor_id', flat=True)), {self.users[i].pk for i in (1, 2, 3, 4)})
+        Notification.objects.filter(pk=notification.pk).update(created_at=timezone.now() - timedelta(days=2))
+        self.client.delete('/api/v1/like/%d/' % self.tweet.id, HTTP_AUTHORIZATION=self.tokens[2])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/like/', data={'id': self.tweet.id}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[2])
+        self.assertEqual(Notification.objects.filter(noti_type='LIKE', notified=self.users[0]).count(), 1)
+
+        # a new group once the last one has been quiet for the window
+        user = UserFactory(email='email5@email.com', user_id='user5_id', username='username5', password='password', phone_number='010-0000-0005', is_verified=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/like/', data={'id': self.tweet.id}, content_type='application/json', HTTP_AUTHORIZATION='JWT ' + jwt_token_of(user))
+        self.assertEqual(Notification.objects.filter(noti_type='LIKE', notified=self.users[0]).count(), 2)
+
+    def test_unread_count(self):
+        response = self.client.get('/api/v1/notification/count/', HTTP_AUTHORIZATION=self.tokens[2])
+        self.assertEqual(response.json()['notification_count'], 1)     # MENTION
+
+        for i in (1, 3):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post('/api/v1/like/', data={'id': self.tweet.id}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[i])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/notification/count/', HTTP_AUTHORIZATION=self.tokens[2])
+        self.assertEqual(response.json()['notification_count'], 2)     # MENTION, one LIKE group
+        self.assertFalse([x for x in queries.captured_queries if 'notification_notification' in x['sql']])
+
+        self.client.get('/api/v1/notification/', HTTP_AUTHORIZATION=self.tokens[2])
+        self.assertEqual(User.objects.get(pk=self.users[2].pk).unread_notifications, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/like/', data={'id': self.tweet.id}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[4])
+        self.assertEqual(User.objects.get(pk=self.users[2].pk).unread_notifications, 1)     # the group is unread again
+
+        # drift from deleted rows is corrected by the reconciler
+        User.objects.filter(pk=self.users[3].pk).update(unread_notifications=7)
+        self.assertEqual(notification_tasks.reconcile_unread_counts(), 1)
+        self.assertEqual(User.objects.get(pk=self.users[3].pk).unread_notifications, Notification.objects.filter(notified=self.users[3], is_read=False).count())
+
+    def test_view_marks_read_with_one_update(self):
+        unread.clear(self.users[2])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/reply/', data={'id': self.tweet.id, 'content': 'reply'}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[0])
+        response = self.client.get('/api/v1/notification/count/', HTTP_AUTHORIZATION=self.tokens[2])
+        self.assertEqual(response.json()['notification_count'], 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/notification/', HTTP_AUTHORIZATION=self.tokens[2])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        updates = [x['sql'] for x in queries.captured_queries if x['sql'].startswith('UPDATE "notification_notification"')]
+        self.assertEqual(len(updates), 1)
+        self.assertFalse(Notification.objects.filter(notified=self.users[2], is_read=False).exists())
+        response = self.client.get('/api/v1/notification/count/', HTTP_AUTHORIZATION=self.tokens[2])
+        self.assertEqual(response.json()['notification_count'], 0)
+
+
+class NotificationStreamTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+
+        cls.users = [
+            UserFactory(
+                email='email%d@email.com' % i,
+                user_id='user%d_id' % i,
+                username='username%d' % i,
+                password='password',
+                phone_number='010-0000-%04d' % i,
+                is_verified=True,
+            ) for i in range(2)]
+        cls.tokens = [jwt_token_of(x) for x in cls.users]
+        cls.tweet = TweetFactory(tweet_type='GENERAL', author=cls.users[0], content='content')
+
+    def setUp(self):
+        twitter.pubsub.reset()
+
+    def run_stream(self, headers, query_string=b'', events=1):
+        # serve one stream until it sent `events` events, publishing a message after the first
+        sent = []
+
+        async def receive():
+            while len([x for x in sent if x.get('body', b'').startswith(b'event:')]) < events:
+                await asyncio.sleep(0.01)
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            if len(sent) == 2:
+                stream.publish(self.users[0].pk, {'notification_count': 5, 'notifications': []})
+
+        scope = {'type': 'http', 'method': 'GET', 'path': stream.PATH, 'headers': headers, 'query_string': query_string}
+        async_to_sync(stream.application)(scope, receive, send)
+        return sent
+
+    def test_stream_pushes_events(self):
+        sent = self.run_stream([(b'authorization', ('JWT ' + self.tokens[0]).encode())], events=2)
+        self.assertEqual(sent[0]['status'], 200)
+        events = [json.loads(x['body'].decode().split('data: ')[1]) for x in sent[1:] if x['body'].startswith(b'event:')]
+        self.assertEqual(events, [{'notification_count': 0}, {'notification_count': 5, 'notifications': []}])
+        self.assertEqual(twitter.pubsub.get_bus().subscriptions, {})     # unsubscribed on disconnect
+
+    def test_stream_token_in_query(self):
+        sent = self.run_stream([], query_string=('token=' + self.tokens[0]).encode())
+        self.assertEqual(sent[0]['status'], 200)
+        sent = self.run_stream([], query_string=b'token=wrong')
+        self.assertEqual(sent[0]['status'], 401)
+
+    def test_like_is_published(self):
+        def like():
+            # the task queued by a like; it publishes once its own transaction commits
+            with self.captureOnCommitCallbacks(execute=True):
+                notification_tasks.notify_all(self.users[1].pk, self.tweet.id, 'LIKE')
+
+        async def listen():
+            subscription = twitter.pubsub.get_bus().subscribe(stream.channel(self.users[0].pk))
+            await sync_to_async(like)()
+            message = await asyncio.wait_for(subscription.get(), 1)
+            subscription.close()
+            return json.loads(message)
+
+        data = async_to_sync(listen)()
+        self.assertEqual(data['notification_count'], 1)
+        self.assertEqual([(x['noti_type'], x['tweet_id'], x['user_id']) for x in data['notifications']], [('LIKE', self.tweet.id, 'user1_id')])
+
+
+class SharedRedis:
+    # the publish / pattern subscribe part of a redis server, for buses of different processes in one test
+
+    def __init__(self):
+        self.subscribers = []       # (pattern, loop, queue)
+
+    def publish(self, channel, message):
+        for pattern, loop, queue in list(self.subscribers):
+            if fnmatch.fnmatchcase(channel, pattern):
+                loop.call_soon_threadsafe(queue.put_nowait, {'type': 'pmessage', 'channel': channel.encode(), 'data': message.encode()})
+        return len(self.subscribers)
+
+    def pubsub(self):
+        return SharedPubSub(self)
+
+    async def close(self):
+        pass
+
+
+class SharedPubSub:
+
+    def __init__(self, server):
+        self.server = server
+        self.queue = asyncio.Queue()
+        self.subscription = None
+
+    async def psubscribe(self, pattern):
+        self.subscription = (pattern, asyncio.get_running_loop(), self.queue)
+        self.server.subscribers.append(self.subscription)
+
+    async def listen(self):
+        while True:
+            yield await self.queue.get()
+
+    async def close(self):
+        self.server.subscribers.remove(self.subscription)
+
+
+class SharedRedisBus(twitter.pubsub.RedisBus):
+
+    def __init__(self, server):
+        super().__init__('redis://shared')
+        self.server = server
+
+    def connect(self):
+        return self.server
+
+    def connect_async(self):
+        return self.server
+
+
+class PubSubTestCase(TestCase):
+
+    def test_publish_from_another_bus(self):
+        # the ASGI process subscribes on its bus, a celery worker publishes on its own
+        server = SharedRedis()
+        subscriber_bus, publisher_bus = SharedRedisBus(server), SharedRedisBus(server)
+
+        async def run():
+            subscription = subscriber_bus.subscribe(stream.channel(1))
+            while not server.subscribers:       # the listener task has subscribed
+                await asyncio.sleep(0.01)
+            publisher_bus.publish(stream.channel(2), 'other')
+            publisher_bus.publish(stream.channel(1), 'message')
+            message = await asyncio.wait_for(subscription.get(), 1)
+            subscription.close()
+            for task in subscriber_bus.listeners.values():
+                task.cancel()
+            return message
+
+        self.assertEqual(async_to_sync(run)(), 'message')
+        self.assertEqual(server.subscribers, [])
+
+    @override_settings(REDIS_URL=None, TESTING=False)
+    def test_no_shared_bus(self):
+        twitter.pubsub.reset()
+        try:
+            with self.assertRaises(ImproperlyConfigured):
+                twitter.pubsub.get_bus()
+        finally:
+            twitter.pubsub.reset()
+
+
+@override_settings(READ_CONCURRENCY=False)     # worker threads would not see the test transaction
+class AsyncReadViewTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            UserFactory(
+                email='email%d@email.com' % i,
+                user_id='user%d_id' % i,
+                username='username%d' % i,
+                password='password',
+                phone_number='010-0000-%04d' % i,
+                is_verified=True,
+            ) for i in range(2)]
+        cls.tokens = ['JWT ' + jwt_token_of(x) for x in cls.users]
+        FollowFactory(follower=cls.users[1], following=cls.users[0])
+        cls.tweet = TweetFactory(tweet_type='GENERAL', author=cls.users[0], content='content')
+        TweetMediaFactory(tweet=cls.tweet, media='image.jpg')
+        UserLikeFactory(user=cls.users[1], liked=cls.tweet)
+        retweet = TweetFactory(tweet_type='RETWEET', author=cls.users[0], retweeting_user='user1_id')
+        RetweetFactory(retweeted=cls.tweet, retweeting=retweet, user=cls.users[1])
+        Notification.objects.create(notified=cls.users[0], user=cls.users[1], tweet=cls.tweet, noti_type='LIKE')
+        call_command('rebuild_timelines', stdout=StringIO())
+
+    def get_async(self, view, path, token, **kwargs):
+        request = APIRequestFactory().get(path, HTTP_AUTHORIZATION=token)
+        response = async_to_sync(view.as_view())(request, **kwargs)
+        response.render()
+        return response
+
+    def assertSameResponse(self, view, path, token, **kwargs):
+        expected = self.client.get(path, HTTP_AUTHORIZATION=token)
+        response = self.get_async(view, path, token, **kwargs)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(json.loads(response.content), expected.json())
+
+    def test_home(self):
+        self.assertSameResponse(AsyncHomeView, '/api/v1/home/', self.tokens[1])
+
+    def test_tweet_detail(self):
+        self.assertSameResponse(AsyncTweetDetailView, '/api/v1/tweet/%d/' % self.tweet.id, self.tokens[1], pk=self.tweet.id)
+        self.assertSameResponse(AsyncTweetDetailView, '/api/v1/tweet/0/', self.tokens[1], pk=0)
+
+    def test_user_tweets(self):
+        self.assertSameResponse(AsyncUserTweetsView, '/api/v1/usertweets/user1_id/tweets/', self.tokens[1], pk='user1_id')
+        self.assertSameResponse(AsyncUserTweetsView, '/api/v1/usertweets/me/tweets/', self.tokens[0], pk='me')
+
+    def test_notification(self):
+        response = self.get_async(AsyncNotificationView, '/api/v1/notification/', self.tokens[0])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        notifications = json.loads(response.content)['notifications']
+        self.assertEqual([(x['noti_type'], x['tweet']['id']) for x in notifications[:-1]], [('LIKE', self.tweet.id)])
+        self.assertFalse(Notification.objects.filter(notified=self.users[0], is_read=False).exists())
+        self.assertEqual(User.objects.get(pk=self.users[0].pk).unread_notifications, 0)
+
+    def test_unauthenticated(self):
+        response = self.get_async(AsyncHomeView, '/api/v1/home/', '')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(QUERY_COUNT_HEADER=True)
+    def test_query_count_header(self):
+        expected = self.client.get('/api/v1/home/', HTTP_AUTHORIZATION=self.tokens[1])
+        middleware = QueryCountMiddleware(AsyncHomeView.as_view())
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        request = APIRequestFactory().get('/api/v1/home/', HTTP_AUTHORIZATION=self.tokens[1])
+        response = async_to_sync(middleware)(request)
+        self.assertGreater(int(expected['X-Query-Count']), 0)
+        self.assertEqual(response['X-Query-Count'], expected['X-Query-Count'])
+
+    @override_settings(READ_CONCURRENCY=True)
+    def test_gather_threads_are_counted(self):
+        def select_one():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+
+        counter = QueryCounter()
+        token = current_counter.set(counter)
+        try:
+            async_to_sync(gather)(select_one, select_one, select_one)
+        finally:
+            current_counter.reset(token)
+        self.assertEqual(counter.count, 3)
+
+
+class ConversationTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            UserFactory(
+                email='email%d@email.com' % i,
+                user_id='user%d_id' % i,
+                username='username%d' % i,
+                password='password',
+                phone_number='010-0000-%04d' % i,
+                is_verified=True,
+            ) for i in range(2)]
+        cls.tokens = ['JWT ' + jwt_token_of(x) for x in cls.users]
+        cls.root = TweetFactory(tweet_type='GENERAL', author=cls.users[0], content='root')
+
+    def reply(self, tweet, content, user=1):
+        response = self.client.post('/api/v1/reply/', data={'id': tweet.id, 'content': content}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[user])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Tweet.objects.get(content=content)
+
+    def get_conversation(self, tweet, cursor=None):
+        path = '/api/v1/tweet/%d/conversation/' % tweet.id
+        if cursor is not None:
+            path += '?cursor=' + cursor
+        response = self.client.get(path, HTTP_AUTHORIZATION=self.tokens[0])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        return [(x['content'], x['depth']) for x in data[:-1]], data[-1]
+
+    def test_conversation_in_tree_order(self):
+        first = self.reply(self.root, 'first')
+        second = self.reply(self.root, 'second', user=0)
+        nested = self.reply(first, 'nested')
+        self.assertEqual((nested.conversation_id, nested.path), (self.root.id, first.path + conversation.segment(nested.id)))
+
+        expected = [('root', 0), ('first', 1), ('nested', 2), ('second', 1)]
+        for tweet in (self.root, nested, second):
+            tweets, pagination_info = self.get_conversation(tweet)
+            self.assertEqual(tweets, expected)
+            self.assertEqual(pagination_info, {'previous': None, 'next': None})
+        self.assertEqual(list(conversation.subtree(first).values_list('content', flat=True)), ['nested'])
+
+    def test_conversation_after_delete(self):
+        first = self.reply(self.root, 'first')
+        self.reply(first, 'nested')
+        self.reply(self.root, 'second')
+        self.assertEqual(self.client.delete('/api/v1/tweet/%d/' % first.id, HTTP_AUTHORIZATION=self.tokens[1]).status_code, status.HTTP_200_OK)
+        self.assertEqual(Reply.objects.get(replying__content='nested').replied, None)
+
+        tweets, pagination_info = self.get_conversation(self.root)
+        self.assertEqual(tweets, [('root', 0), ('nested', 2), ('second', 1)])
+
+        self.root.delete()
+        tweets, pagination_info = self.get_conversation(Tweet.objects.get(content='second'))
+        self.assertEqual(tweets, [('nested', 2), ('second', 1)])
+
+    def test_conversation_pages(self):
+        for i in range(22):
+            reply = TweetFactory(tweet_type='REPLY', author=self.users[1], content='reply %02d' % i)
+            ReplyFactory(replied=self.root, replying=reply)
+            conversation.attach(reply, self.root)
+        with CaptureQueriesContext(connection) as queries:
+            tweets, pagination_info = self.get_conversation(self.root)
+        self.assertEqual(tweets, [('root', 0)] + [('reply %02d' % i, 1) for i in range(20)])
+        self.assertIsNone(pagination_info['previous'])
+        ranges = [x['sql'] for x in queries.captured_queries if '"conversation_id" =' in x['sql']]
+        self.assertEqual(len(ranges), 1)
+
+        tweets, pagination_info = self.get_conversation(self.root, pagination_info['next'])
+        self.assertEqual(tweets, [('reply 20', 1), ('reply 21', 1)])
+        self.assertIsNone(pagination_info['next'])
+        tweets, pagination_info = self.get_conversation(self.root, pagination_info['previous'])
+        self.assertEqual(tweets, [('root', 0)] + [('reply %02d' % i, 1) for i in range(20)])
+
+    def test_conversation_depth_cap(self):
+        tweets = [self.root]
+        for i in range(55):
+            reply = TweetFactory(tweet_type='REPLY', author=self.users[1], content='reply %02d' % i)
+            ReplyFactory(replied=tweets[-1], replying=reply)
+            conversation.attach(reply, tweets[-1])
+            tweets.append(reply)
+        max_depth = conversation.PATH_LENGTH // conversation.SEGMENT - 1
+        self.assertEqual([conversation.depth(x) for x in tweets], [min(i, max_depth) for i in range(56)])
+        self.assertEqual(conversation.subtree(tweets[10]).count(), 45)
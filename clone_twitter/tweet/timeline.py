@@ -0,0 +1,196 @@
+import heapq
+import logging
+from itertools import chain
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery
+
+from tweet.models import Tweet, TimelineEntry
+from user.models import Follow
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+# TIMELINE_BACKFILL_SIZE: how many recent tweets of a newly followed user are copied into the follower's timeline
+# TIMELINE_MAX_LENGTH: entries older than the newest TIMELINE_MAX_LENGTH are dropped when a timeline is trimmed
+# TIMELINE_FANOUT_FOLLOWER_LIMIT: tweets of users with more followers are not fanned out but pulled at read time
+# TIMELINE_TRIM_INTERVAL: fan_out trims each timeline it writes to about once per this many entries
+#
+# an actor dropping back to the limit stops being pulled, so the tweets posted while above it are copied into the
+# timelines of the followers then (backfill_followers, run by tweet.tasks.backfill_followers). tweets fanned out before
+# an actor crossed the limit upwards stay in the timelines; the merge skips them in the pulled source.
+
+
+def is_pulled(actor):
+    return actor.followers_count > settings.TIMELINE_FANOUT_FOLLOWER_LIMIT
+
+
+def actor_tweets(actors):
+    q = Q()
+    q |= (Q(author__in=actors) & ~Q(tweet_type='RETWEET'))                                       # tweets written(or replied, quoted) by the actors
+    q |= (Q(retweeting_user__in=[x.user_id for x in actors]) & Q(tweet_type='RETWEET'))         # tweets retweeted by the actors
+    return Tweet.objects.filter(q)
+
+
+def fan_out(tweet, actor):
+    # push a new tweet into the timeline of its actor and of every follower of the actor
+    limit = settings.TIMELINE_FANOUT_FOLLOWER_LIMIT
+    follower_ids = []
+    if actor.followers_count <= limit:
+        follower_ids = list(Follow.objects.filter(following=actor).values_list('follower_id', flat=True)[:limit + 1])
+        if len(follower_ids) > limit:   # denormalized count drifted: treat as pulled
+            follower_ids = []
+
+    entries = [
+        TimelineEntry(user_id=user_id, tweet=tweet, actor=actor, created_at=tweet.created_at)
+        for user_id in chain([actor.pk], follower_ids)
+    ]
+    TimelineEntry.objects.bulk_create(entries, batch_size=1000, ignore_conflicts=True)
+
+    # trim a sample of the timelines written to, spread by tweet id so every timeline gets its turn
+    interval = settings.TIMELINE_TRIM_INTERVAL
+    trim_many([user_id for user_id in chain([actor.pk], follower_ids) if (user_id + tweet.id) % interval == 0])
+
+
+def fan_out_on_commit(tweet, actor):
+    # fan_out once the tweet is committed. the write has succeeded by then, so a failure is logged, not raised into its response
+    def run():
+        try:
+            fan_out(tweet, actor)
+        except Exception:
+            logger.exception('timeline fan out of tweet %s failed', tweet.id)
+    transaction.on_commit(run)
+
+
+def recent_tweets(actor):
+    return list(actor_tweets([actor]).order_by('-created_at').values_list('id', 'created_at')[:settings.TIMELINE_BACKFILL_SIZE])
+
+
+def backfill(user, actor):
+    # copy recent tweets of a newly followed actor into the user's timeline
+    if user != actor and is_pulled(actor):
+        return
+    entries = [
+        TimelineEntry(user=user, tweet_id=tweet_id, actor=actor, created_at=created_at)
+        for tweet_id, created_at in recent_tweets(actor)
+    ]
+    TimelineEntry.objects.bulk_create(entries, batch_size=1000, ignore_conflicts=True)
+    trim(user)
+
+
+def backfill_followers(actor, batch_size=1000):
+    # copy recent tweets of an actor that is no longer pulled into the timelines of all its followers
+    if is_pulled(actor):    # crossed back above the limit meanwhile
+        return
+    tweets = recent_tweets(actor)
+    last_pk = 0
+    while True:
+        follower_ids = list(Follow.objects.filter(following=actor, follower_id__gt=last_pk)
+                            .order_by('follower_id').values_list('follower_id', flat=True)[:batch_size])
+        if not follower_ids:
+            return
+        last_pk = follower_ids[-1]
+        entries = [
+            TimelineEntry(user_id=user_id, tweet_id=tweet_id, actor=actor, created_at=created_at)
+            for user_id in follower_ids for tweet_id, created_at in tweets
+        ]
+        TimelineEntry.objects.bulk_create(entries, batch_size=1000, ignore_conflicts=True)
+        trim_many(follower_ids)
+
+
+def remove(user, actor):
+    # drop everything an unfollowed actor contributed to the user's timeline
+    TimelineEntry.objects.filter(user=user, actor=actor).delete()
+
+
+def trim(user):
+    trim_many([user.pk])
+
+
+def trim_many(user_ids):
+    # keep only the newest TIMELINE_MAX_LENGTH entries of each timeline: one query for the cutoffs, one delete
+    if not user_ids:
+        return
+    limit = settings.TIMELINE_MAX_LENGTH
+    oldest_kept = TimelineEntry.objects.filter(user=OuterRef('pk')) \
+        .order_by('-created_at', '-id').values('created_at')[limit - 1:limit]
+    cutoffs = User.objects.filter(pk__in=user_ids).annotate(oldest_kept=Subquery(oldest_kept)) \
+        .filter(oldest_kept__isnull=False).values_list('pk', 'oldest_kept')
+    q = Q()
+    for user_id, created_at in cutoffs:
+        q |= Q(user_id=user_id, created_at__lt=created_at)
+    if q:
+        TimelineEntry.objects.filter(q).delete()
+
+
+def rebuild(user):
+    TimelineEntry.objects.filter(user=user).delete()
+    backfill(user, user)
+    for follow in user.follower.select_related('following').all():
+        backfill(user, follow.following)
+
+
+def home_tweets(user):
+    # ordered newest first by ('position', 'id'); position is when the tweet entered the timeline
+    pushed = Tweet.objects.filter(timeline_entries__user=user).select_related('author').annotate(position=F('timeline_entries__created_at'))
+
+    limit = settings.TIMELINE_FANOUT_FOLLOWER_LIMIT
+    pulled_actors = list(User.objects.filter(following__follower=user, followers_count__gt=limit))
+    if not pulled_actors:
+        return pushed.order_by('-position', '-id')
+    pulled = actor_tweets(pulled_actors).select_related('author').annotate(position=F('created_at'))
+    return MergedTimeline(pushed, pulled).order_by('-position', '-id')
+
+
+class MergedTimeline:
+    # k-way merge of the precomputed timeline and the tweets pulled from high-follower actors.
+    # supports filter(), order_by(), count(), query and slicing, so it can be paginated like a queryset.
+
+    def __init__(self, *sources, ordering=()):
+        self.sources = sources
+        self.ordering = ordering
+
+    def filter(self, *args, **kwargs):
+        return MergedTimeline(*[source.filter(*args, **kwargs) for source in self.sources], ordering=self.ordering)
+
+    def order_by(self, *ordering):
+        return MergedTimeline(*[source.order_by(*ordering) for source in self.sources], ordering=ordering)
+
+    @property
+    def query(self):
+        # the query of the first source, for the fields of the ordering
+        return self.sources[0].query
+
+    def count(self):
+        # a tweet in several sources is counted in the first only
+        total = 0
+        for i, source in enumerate(self.sources):
+            for earlier in self.sources[:i]:
+                source = source.exclude(id__in=earlier.values('id'))
+            total += source.count()
+        return total
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start = key.start or 0
+        stop = key.stop if key.stop is not None else self.count()
+
+        # the top `stop` rows of the merge can only come from the top `stop` rows of each source
+        keys = [x.lstrip('-') for x in self.ordering]
+        reverse = self.ordering[0].startswith('-')
+        merged = heapq.merge(*[source[:stop] for source in self.sources], key=lambda x: [getattr(x, key) for key in keys], reverse=reverse)
+        tweets, seen = [], set()
+        for tweet in merged:
+            if tweet.id in seen:    # fanned out before its actor crossed the follower limit
+                continue
+            seen.add(tweet.id)
+            tweets.append(tweet)
+            if len(tweets) == stop:
+                break
+        return tweets[start:stop]
@@ -0,0 +1,53 @@
+import re
+
+# tokenizers of the in-process search index (tweet/search_index.py), selected by TWEET_SEARCH_TOKENIZER.
+# a tokenizer only needs tokenize(text) -> list of terms; the same tokenizer splits indexed text and search keywords.
+
+HANGUL = '가-힣ᄀ-ᇿ㄰-㆏'
+RUN = re.compile(r'[%s]+|[^\W%s_]+' % (HANGUL, HANGUL))
+IS_HANGUL = re.compile(r'[%s]' % HANGUL)
+
+
+class HangulLatinTokenizer:
+    # Hangul runs become character bigrams, which also match words followed by particles ('트위터에서' contains '트위', '위터').
+    # other word runs are lowercased and stemmed ('Running' -> 'run').
+
+    NGRAM = 2
+
+    # (suffix, replacement, minimum length of the word), first match wins
+    SUFFIXES = (
+        ('sses', 'ss', 5),
+        ('ies', 'y', 5),
+        ('ing', '', 6),
+        ('ed', '', 5),
+        ('ily', 'y', 6),
+        ('ly', '', 5),
+        ('s', '', 4),
+    )
+
+    def tokenize(self, text):
+        tokens = []
+        for run in RUN.findall(text):
+            if IS_HANGUL.match(run):
+                tokens.extend(self.ngrams(run))
+            else:
+                tokens.append(self.stem(run.lower()))
+        return tokens
+
+    def ngrams(self, run):
+        if len(run) <= self.NGRAM:
+            return [run]
+        return [run[i:i + self.NGRAM] for i in range(len(run) - self.NGRAM + 1)]
+
+    def stem(self, word):
+        if not word.isalpha():
+            return word
+        for suffix, replacement, min_length in self.SUFFIXES:
+            if len(word) >= min_length and word.endswith(suffix):
+                if suffix == 's' and word.endswith('ss'):
+                    return word
+                word = word[:-len(suffix)] + replacement
+                break
+        if len(word) > 3 and word[-1] == word[-2] and word[-1] not in 'aeiouls':     # running -> runn -> run
+            word = word[:-1]
+        return word
@@ -1,8 +1,13 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import SimpleRouter
 
 
-from tweet.views import TweetPostView, ReplyView, RetweetView, TweetDetailView, LikeView, HomeView, RetweetCancelView, UnlikeView, ThreadViewSet, QuoteView, TweetSearchViewSet, UserTweetsViewSet
+from tweet.views import TweetPostView, ReplyView, RetweetView, TweetDetailView, LikeView, HomeView, RetweetCancelView, UnlikeView, ThreadViewSet, QuoteView, TweetSearchViewSet, UserTweetsViewSet, \
+    AsyncHomeView, AsyncTweetDetailView, AsyncUserTweetsView
+
+if settings.ASYNC_READ_VIEWS:       # ASGI deployments (twitter/asyncviews.py)
+    TweetDetailView, HomeView = AsyncTweetDetailView, AsyncHomeView
 
 router = SimpleRouter()
 router.register('tweet', ThreadViewSet, basename='thread')                          # /api/v1/tweet/
@@ -19,5 +24,9 @@ urlpatterns = [
     path('like/', LikeView.as_view(), name='like'),                                 # /api/v1/like/
     path('like/<int:pk>/', UnlikeView.as_view(), name='unlike'),                    # /api/v1/like/
     path('home/', HomeView.as_view(), name='home'),                                 # /api/v1/home/
-    path('', include(router.urls))
-]
\ No newline at end of file
+]
+
+if settings.ASYNC_READ_VIEWS:
+    urlpatterns.append(path('usertweets/<str:pk>/tweets/', AsyncUserTweetsView.as_view(), name='usertweets-tweets'))     # before the router's
+
+urlpatterns.append(path('', include(router.urls)))
\ No newline at end of file
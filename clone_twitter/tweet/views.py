@@ -2,9 +2,11 @@ from urllib.parse import unquote, unquote_plus
 import re
 from user.models import User
 import tweet.paginations
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.db.models.aggregates import Count
-from django.db.models.expressions import Case, When
+from tweet import conversation, counters, search, search_index
+from tweet.paginations import keyset_paginator
+from django.db.models import F
 from django.db.models.query_utils import Q
 from django.shortcuts import get_object_or_404
 from drf_yasg import openapi
@@ -13,15 +15,17 @@ from rest_framework import permissions, viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from asgiref.sync import sync_to_async
 
 from tweet.models import Tweet, Retweet, UserLike
 
 from tweet.serializers import TweetSearchInfoSerializer, TweetWriteSerializer, ReplySerializer, RetweetSerializer, \
     TweetDetailSerializer, \
-    LikeSerializer, HomeSerializer, UserListSerializer, custom_paginator, TweetSerializer, QuoteSerializer, \
+    LikeSerializer, HomeSerializer, UserListSerializer, TweetSerializer, QuoteSerializer, \
     SearchSerializer
 from datetime import datetime, timedelta
 from user.permissions import IsVerified
+from twitter.asyncviews import AsyncAPIView, gather
 
 
 class TweetPostView(APIView):      # write tweet
@@ -68,13 +72,17 @@ class TweetDetailView(APIView):     # open thread of the tweet
     @swagger_auto_schema(tags=["Thread"], responses=responses)
 
     def get(self, request, pk):
+        tweet = self.source_tweet(pk)
+        serializer = TweetDetailSerializer(tweet, context={'request': request})
+        return Response(serializer.data)
+
+    @staticmethod
+    def source_tweet(pk):
         tweet = get_object_or_404(Tweet, pk=pk)
 
         if tweet.tweet_type == 'RETWEET':
             tweet = tweet.retweeting.all()[0].retweeted
-
-        serializer = TweetDetailSerializer(tweet, context={'request': request})
-        return Response(serializer.data)
+        return tweet
 
     responses = {
         200: 'Successfully delete tweet',
@@ -95,11 +103,14 @@ class TweetDetailView(APIView):     # open thread of the tweet
         if (tweet.tweet_type != 'RETWEET' and tweet.author != me) or (tweet.tweet_type == 'RETWEET' and tweet.retweeting_user != me.user_id):
             return Response(status=status.HTTP_403_FORBIDDEN, data={'message': 'you can delete only your tweets'})
 
-        retweetings = tweet.retweeted_by.all()
-        for retweeting in retweetings:
-            retweeting.retweeting.delete()
+        with transaction.atomic():
+            retweetings = tweet.retweeted_by.all()
+            for retweeting in retweetings:
+                retweeting.retweeting.delete()
 
-        tweet.delete()
+            counters.remove_tweet(tweet)
+            search_index.unindex_tweet(tweet.id)
+            tweet.delete()
         return Response(status=status.HTTP_200_OK, data={'message': 'successfully delete tweet'})
 
 class ReplyView(APIView):       # reply tweet
@@ -195,7 +206,9 @@ class RetweetCancelView(APIView):     # cancel retweet
             retweeting = source_tweet.retweeted_by.get(user=me).retweeting
         except Retweet.DoesNotExist:
             return Response(status=status.HTTP_400_BAD_REQUEST, data={'message': 'you have not retweeted this tweet'})
-        retweeting.delete()
+        with transaction.atomic():
+            counters.remove_tweet(retweeting)
+            retweeting.delete()
         return Response(status=status.HTTP_200_OK, data={'message': 'successfully cancel retweet'})
 
 
@@ -289,7 +302,9 @@ class UnlikeView(APIView):      # cancel like
             user_like = tweet.liked_by.get(user=me)
         except UserLike.DoesNotExist:
             return Response(status=status.HTTP_400_BAD_REQUEST, data={'message': 'you have not liked this tweet'})
-        user_like.delete()
+        with transaction.atomic():
+            user_like.delete()
+            counters.add(tweet.id, 'like_count', -1)
         return Response(status=status.HTTP_200_OK, data={'message': 'successfully cancel like'})
 
 
@@ -316,6 +331,7 @@ class TweetSearchViewSet(viewsets.GenericViewSet):
     permission_classes = (permissions.IsAuthenticated,)
 
     pagination_class = tweet.paginations.TweetListPagination
+    pagination_count_mode = 'none'     # no COUNT over the annotated search queryset; 'count' is null
 
     responses = {
         200: TweetSearchInfoSerializer,
@@ -333,11 +349,10 @@ class TweetSearchViewSet(viewsets.GenericViewSet):
             return Response(status=status.HTTP_400_BAD_REQUEST, data={'message': 'no query provided'})
         search_keywords = unquote_plus(request.query_params['query']).split()
         sorted_queryset = \
-            Tweet.objects.all() \
-            .annotate(num_keywords_included=sum([Case(When(Q(author__username__icontains=keyword) | Q(author__user_id__icontains=keyword) | Q(content__icontains=keyword), then=1), default=0) for keyword in search_keywords]),\
-                num_replies=Count('replied_by'), num_retweets=Count('retweeted_by'), num_likes=Count('liked_by')) \
-            .filter(tweet_type='GENERAL', num_keywords_included__gte=1, written_at__gte=datetime.now()-timedelta(weeks=1)) \
-            .order_by('-num_keywords_included', '-num_retweets', '-num_likes', '-num_replies')
+            search.search_tweets(search_keywords) \
+            .filter(tweet_type='GENERAL', written_at__gte=datetime.now()-timedelta(weeks=1)) \
+            .select_related('author') \
+            .order_by('-num_keywords_included', '-retweet_count', '-like_count', '-reply_count')
         
         page = self.paginate_queryset(sorted_queryset)
 
@@ -365,9 +380,9 @@ class TweetSearchViewSet(viewsets.GenericViewSet):
             return Response(status=status.HTTP_400_BAD_REQUEST, data={'message': 'no query provided'})
         search_keywords = unquote_plus(request.query_params['query']).split()
         sorted_queryset = \
-            Tweet.objects.all() \
-            .annotate(num_keywords_included=sum([Case(When(Q(author__username__icontains=keyword) | Q(author__user_id__icontains=keyword) | Q(content__icontains=keyword), then=1), default=0) for keyword in search_keywords])) \
-            .filter(Q(tweet_type='GENERAL') | Q(tweet_type='REPLY'), num_keywords_included__gte=1) \
+            search.search_tweets(search_keywords) \
+            .filter(Q(tweet_type='GENERAL') | Q(tweet_type='REPLY')) \
+            .select_related('author') \
             .order_by('-num_keywords_included', '-written_at')
 
         page = self.paginate_queryset(sorted_queryset)
@@ -409,9 +424,9 @@ class ThreadViewSet(viewsets.ReadOnlyModelViewSet):
         if tweet.tweet_type == 'RETWEET':
             tweet = tweet.retweeting.all()[0].retweeted
 
-        retweets = tweet.retweeted_by.all()
-        retweeting_user_list = [x.user for x in retweets]
-        retweeting_users, previous_page, next_page = custom_paginator(retweeting_user_list, 20, request)
+        retweets = tweet.retweeted_by.select_related('user').order_by('id')
+        retweets, previous_page, next_page = keyset_paginator(retweets, 20, request)
+        retweeting_users = [x.user for x in retweets]
         serializer = UserListSerializer(retweeting_users, many=True, context={'request': request})
         data = serializer.data
 
@@ -440,9 +455,9 @@ class ThreadViewSet(viewsets.ReadOnlyModelViewSet):
         if tweet.tweet_type == 'RETWEET':
             tweet = tweet.retweeting.all()[0].retweeted
 
-        quotes = tweet.quoted_by.select_related('quoting').all().order_by('-quoting__created_at')
-        tweet_list = [x.quoting for x in quotes]
-        tweets, previous_page, next_page = custom_paginator(tweet_list, 10, request)
+        quotes = tweet.quoted_by.select_related('quoting__author').annotate(position=F('quoting__created_at')).order_by('-position', '-id')
+        quotes, previous_page, next_page = keyset_paginator(quotes, 10, request)
+        tweets = [x.quoting for x in quotes]
         serializer = TweetSerializer(tweets, many=True, context={'request': request})
         data = serializer.data
 
@@ -454,6 +469,42 @@ class ThreadViewSet(viewsets.ReadOnlyModelViewSet):
         data.append(pagination_info)
         return Response(data=data, status=status.HTTP_200_OK)
 
+    responses = {
+        200: TweetSerializer,
+        401: 'Unauthorized user',
+        404: 'Not found: no such tweet exists',
+        405: 'Method not allowed: only GET',
+        500: 'Internal server error'
+    }
+
+    @swagger_auto_schema(tags=["Thread"], responses=responses)
+
+    # GET /api/v1/tweet/{lookup}/conversation/
+    @action(detail=True, methods=['GET'])
+    def conversation(self, request, pk=None):
+        # every tweet of the conversation the tweet is in, depth first (tweet/conversation.py): the root on the first
+        # page, unless deleted, then its replies; 'depth' is 0 at the root
+        tweet = get_object_or_404(Tweet, pk=pk)
+
+        if tweet.tweet_type == 'RETWEET':
+            tweet = tweet.retweeting.all()[0].retweeted
+
+        root = Tweet.objects.select_related('author').filter(pk=conversation.root_id(tweet)).first()
+        replies = conversation.subtree(root or Tweet(id=conversation.root_id(tweet))).select_related('author').order_by('path')
+        replies, previous_page, next_page = keyset_paginator(replies, 20, request)
+        tweets = [root] + replies if root is not None and previous_page is None else replies
+        serializer = TweetSerializer(tweets, many=True, context={'request': request})
+        data = serializer.data
+        for x, tweet in zip(data, tweets):
+            x['depth'] = conversation.depth(tweet)
+
+        pagination_info = dict()
+        pagination_info['previous'] = previous_page
+        pagination_info['next'] = next_page
+
+        data.append(pagination_info)
+        return Response(data=data, status=status.HTTP_200_OK)
+
     success_response = openapi.Schema(
         type=openapi.TYPE_OBJECT,
         properties={
@@ -478,9 +529,9 @@ class ThreadViewSet(viewsets.ReadOnlyModelViewSet):
         if tweet.tweet_type == 'RETWEET':
             tweet = tweet.retweeting.all()[0].retweeted
 
-        userlikes = tweet.liked_by.all()
-        liking_user_list = [x.user for x in userlikes]
-        liking_users, previous_page, next_page = custom_paginator(liking_user_list, 20, request)
+        userlikes = tweet.liked_by.select_related('user').order_by('id')
+        userlikes, previous_page, next_page = keyset_paginator(userlikes, 20, request)
+        liking_users = [x.user for x in userlikes]
         serializer = UserListSerializer(liking_users, many=True, context={'request': request})
         data = serializer.data
 
@@ -496,7 +547,7 @@ class UserTweetsViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = TweetSerializer
     queryset = Tweet.objects.all()
-    pagination_class = tweet.paginations.TweetListPagination
+    pagination_class = tweet.paginations.TweetCursorPagination
 
     responses = {
         200: TweetSerializer,
@@ -511,6 +562,18 @@ class UserTweetsViewSet(viewsets.ReadOnlyModelViewSet):
     # GET /api/v1/usertweets/{user_id}/tweets/
     @action(detail=True, methods=['GET'])
     def tweets(self, request, pk=None):
+        queryset = self.user_tweets(request, pk)
+        page = self.paginate_queryset(queryset)
+
+        if page is not None:
+            serializer = self.get_serializer(page, many=True, context={'request': request})
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(queryset, many=True, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @staticmethod
+    def user_tweets(request, pk):
         if pk == 'me':
             user = request.user
         else:
@@ -520,15 +583,7 @@ class UserTweetsViewSet(viewsets.ReadOnlyModelViewSet):
         q |= (Q(author=user) & Q(tweet_type='GENERAL'))                     # tweets written(or quoted) by the user
         q |= (Q(retweeting_user=user.user_id) & Q(tweet_type='RETWEET'))    # tweets retweeted by the user
 
-        queryset = Tweet.objects.filter(q).order_by('-created_at')
-        page = self.paginate_queryset(queryset)
-
-        if page is not None:
-            serializer = self.get_serializer(page, many=True, context={'request': request})
-            return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(queryset, many=True, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Tweet.objects.filter(q).select_related('author').order_by('-created_at', '-id')
 
     responses = {
         200: TweetSerializer,
@@ -552,7 +607,7 @@ class UserTweetsViewSet(viewsets.ReadOnlyModelViewSet):
         q |= (Q(author=user) & ~Q(tweet_type='RETWEET'))                    # tweets written(or replied, quoted) by the user
         q |= (Q(retweeting_user=user.user_id) & Q(tweet_type='RETWEET'))    # tweets retweeted by the user
         
-        queryset = Tweet.objects.filter(q).order_by('-created_at')
+        queryset = Tweet.objects.filter(q).select_related('author').order_by('-created_at', '-id')
         page = self.paginate_queryset(queryset)
 
         if page is not None:
@@ -582,7 +637,7 @@ class UserTweetsViewSet(viewsets.ReadOnlyModelViewSet):
 
         q = (Q(author=user) & ~Q(tweet_type='RETWEET'))                    # tweets written(or quoted) by the user
 
-        queryset = Tweet.objects.annotate(media_count=Count('media')).filter(q & Q(media_count__gt=0)).order_by('-created_at')
+        queryset = Tweet.objects.annotate(media_count=Count('media')).filter(q & Q(media_count__gt=0)).select_related('author').order_by('-created_at', '-id')
         page = self.paginate_queryset(queryset)
 
         if page is not None:
@@ -610,7 +665,8 @@ class UserTweetsViewSet(viewsets.ReadOnlyModelViewSet):
         else:
             user = get_object_or_404(User, user_id=pk)
 
-        queryset = Tweet.objects.filter(liked_by__user__user_id__contains=user.user_id).order_by('-liked_by__created_at')
+        queryset = Tweet.objects.filter(liked_by__user__user_id__contains=user.user_id).select_related('author') \
+            .annotate(position=F('liked_by__created_at')).order_by('-position', '-id')
         page = self.paginate_queryset(queryset)
 
         if page is not None:
@@ -619,4 +675,52 @@ class UserTweetsViewSet(viewsets.ReadOnlyModelViewSet):
 
         serializer = self.get_serializer(queryset, many=True, context={'request': request})
         return Response(serializer.data, status=status.HTTP_200_OK)
-        
\ No newline at end of file
+        
+
+
+# async variants of the hot read endpoints, routed instead of the views above when settings.ASYNC_READ_VIEWS is on.
+# the page is loaded first, then its independent batch loads run at once (twitter/asyncviews.py) and the response is
+# rendered from the primed loaders.
+
+class AsyncHomeView(AsyncAPIView, HomeView):
+
+    @swagger_auto_schema(tags=["Home"], responses=HomeView.responses)
+
+    async def get(self, request):
+        me = request.user
+        page = await sync_to_async(HomeSerializer.page)(me, request)
+        await gather(*TweetSerializer(context={'request': request}).batches(page[0]))
+        serializer = HomeSerializer(me, context={'request': request, 'page': page})
+        return Response(await sync_to_async(lambda: serializer.data)())
+
+
+class AsyncTweetDetailView(AsyncAPIView, TweetDetailView):
+
+    @swagger_auto_schema(tags=["Thread"], responses={
+        200: TweetDetailSerializer,
+        404: 'Not found: no such tweet exists',
+        405: 'Method not allowed: GET or DELETE',
+        500: 'Internal server error'
+    })
+
+    async def get(self, request, pk):
+        tweet = await sync_to_async(self.source_tweet)(pk)
+        serializer = TweetDetailSerializer(tweet, context={'request': request})
+        await gather(*serializer.batches([tweet]))
+        return Response(await sync_to_async(lambda: serializer.data)())
+
+
+class AsyncUserTweetsView(AsyncAPIView):
+    permission_classes = (permissions.IsAuthenticated,)
+    pagination_class = tweet.paginations.TweetCursorPagination
+
+    @swagger_auto_schema(tags=["Profile"], responses=UserTweetsViewSet.responses)
+
+    # GET /api/v1/usertweets/{user_id}/tweets/
+    async def get(self, request, pk):
+        queryset = await sync_to_async(UserTweetsViewSet.user_tweets)(request, pk)
+        paginator = self.pagination_class()
+        page = await sync_to_async(paginator.paginate_queryset)(queryset, request, self)
+        serializer = TweetSerializer(page, many=True, context={'request': request})
+        await gather(*serializer.child.batches(page))
+        return paginator.get_paginated_response(await sync_to_async(lambda: serializer.data)())
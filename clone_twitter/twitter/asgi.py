@@ -13,4 +13,21 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'twitter.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from notification import stream     # noqa: E402, needs the apps loaded by get_asgi_application
+from tweet import search_index      # noqa: E402
+from twitter.pubsub import get_bus  # noqa: E402
+from user import recommend, search  # noqa: E402
+
+get_bus()       # fails here, at startup, without a bus shared with the processes publishing events
+search_index.start()
+search.start()
+recommend.start()
+
+
+async def application(scope, receive, send):
+    # long-lived event streams are served outside of Django's request handling, which buffers a whole response
+    if scope['type'] == 'http' and scope['path'] == stream.PATH:
+        return await stream.application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,74 @@
+import asyncio
+from contextlib import nullcontext
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework.views import APIView
+
+from twitter.middleware import current_counter
+
+# async read views for ASGI deployments (settings.ASYNC_READ_VIEWS, e.g. uvicorn workers on twitter/asgi.py).
+# the ORM of Django 3.2 is sync only: a handler awaits it through sync_to_async, and gather() runs independent
+# queries of a response (a page's counts, media, users...) at the same time, each in a worker thread with its own
+# database connection, so one slow query delays its response without holding a worker process.
+
+
+def closing(call):
+    def run():
+        counter = current_counter.get()     # X-Query-Count counts the worker thread's queries too
+        with counter.counting() if counter is not None else nullcontext():
+            try:
+                return call()
+            finally:
+                close_old_connections()     # the worker thread's connection, per CONN_MAX_AGE
+    return run
+
+
+async def gather(*calls):
+    # run sync callables at once and return their results in order; one after another on the request's thread
+    # when READ_CONCURRENCY is off (e.g. sqlite in-memory test databases are per connection)
+    if not settings.READ_CONCURRENCY:
+        return [await sync_to_async(call)() for call in calls]
+    return await asyncio.gather(*[sync_to_async(closing(call), thread_sensitive=False)() for call in calls])
+
+
+class AsyncAPIView(APIView):
+    # an APIView whose handlers may be coroutines. authentication and permission checks (which can query the user)
+    # run through sync_to_async; negotiation, exception handling and rendering are DRF's as usual.
+    # sync handlers, like the DELETE of a read endpoint, run through sync_to_async as a whole.
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+
+        async def async_view(request, *args, **kwargs):
+            return await view(request, *args, **kwargs)
+
+        async_view.cls = view.cls
+        async_view.initkwargs = view.initkwargs
+        async_view.csrf_exempt = True
+        return async_view
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            if asyncio.iscoroutinefunction(handler):
+                response = await handler(request, *args, **kwargs)
+            else:
+                response = await sync_to_async(handler)(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
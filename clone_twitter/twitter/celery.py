@@ -1,6 +1,7 @@
 import os
 
 from celery import Celery
+from celery.signals import worker_init
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'twitter.settings')
@@ -17,6 +18,13 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 
+@worker_init.connect
+def check_bus(**kwargs):
+    # workers publish the events of notification/stream.py: fail at startup without a bus shared with the ASGI processes
+    from twitter.pubsub import get_bus
+    get_bus()
+
+
 @app.task(bind=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
\ No newline at end of file
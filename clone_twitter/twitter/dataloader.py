@@ -0,0 +1,66 @@
+from django.db.models import Manager
+from rest_framework import serializers
+
+# request-scoped batch loading for serializers.
+# a DataLoader keeps the values it has loaded by key for one request, and loads all missing keys of a prime() with a
+# single call of its batch function (one IN query), so a page resolves each relation once instead of once per row.
+# list serializers prime the whole page before its rows are serialized; a load() of a key nobody primed is a batch of one.
+
+
+class DataLoader:
+
+    def __init__(self, batch, default=None):
+        self.batch = batch          # iterable of keys -> {key: value}, keys without a value get default
+        self.default = default
+        self.values = dict()
+
+    def prime(self, keys):
+        missing = {x for x in keys if x not in self.values}
+        if missing:
+            found = self.batch(missing)
+            for key in missing:
+                self.values[key] = found.get(key, self.default)
+
+    def load(self, key):
+        self.prime([key])
+        return self.values[key]
+
+    def load_many(self, keys):
+        keys = list(keys)
+        self.prime(keys)
+        return [self.values[x] for x in keys]
+
+
+def get_loader(request, batch, default=None):
+    # the loader of batch for this request, shared by every serializer of the response
+    loaders = getattr(request, '_dataloaders', None)
+    if loaders is None:
+        loaders = dict()
+        request._dataloaders = loaders
+    loader = loaders.get(batch)
+    if loader is None:
+        loader = loaders[batch] = DataLoader(batch, default)
+    return loader
+
+
+class LoaderMixin:
+    # serializers override prime(objs) to prime the loaders they read for a page of objs
+
+    def loader(self, batch, default=None):
+        return get_loader(self.context['request'], batch, default)
+
+    def prime(self, objs):
+        pass
+
+    def to_representation(self, obj):
+        self.prime([obj])       # no-op when the page was already primed by LoaderListSerializer
+        return super().to_representation(obj)
+
+
+class LoaderListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, Manager) else data
+        iterable = list(iterable)
+        self.child.prime(iterable)
+        return super().to_representation(iterable)
@@ -0,0 +1,77 @@
+import asyncio
+import threading
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+
+# the counter of the request being served, seen by the worker threads of twitter.asyncviews.gather() too
+current_counter = ContextVar('query_counter', default=None)
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()     # gather() threads count at once
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def counting(self):
+        # count the queries of the connections of the calling thread
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+
+class QueryCountMiddleware:
+    # reports the number of database queries run for a request in the X-Query-Count response header,
+    # when QUERY_COUNT_HEADER is on (DEBUG by default).
+    # sync and async: under ASGI the ORM of an async view runs in the request's sync_to_async thread, whose
+    # connections are counted; the threads of gather() count theirs through current_counter.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not settings.QUERY_COUNT_HEADER:
+            return self.get_response(request)
+        counter = QueryCounter()
+        token = current_counter.set(counter)
+        try:
+            with counter.counting():
+                response = self.get_response(request)
+        finally:
+            current_counter.reset(token)
+        response['X-Query-Count'] = str(counter.count)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.QUERY_COUNT_HEADER:
+            return await self.get_response(request)
+        counter = QueryCounter()
+        token = current_counter.set(counter)
+        stack = ExitStack()
+        try:
+            await sync_to_async(stack.enter_context)(counter.counting())
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(stack.close)()
+        finally:
+            current_counter.reset(token)
+        response['X-Query-Count'] = str(counter.count)
+        return response
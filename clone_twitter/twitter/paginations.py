@@ -0,0 +1,102 @@
+import hashlib
+
+from django.core.cache import cache
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.views import Response
+
+
+class UncountedPage:
+    # a page fetched as page_size + 1 rows: the extra row only tells whether there is a next page
+
+    def __init__(self, object_list, number, has_next):
+        self.object_list = object_list
+        self.number = number
+        self._has_next = has_next
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self.number > 1
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+
+class CountModePagination(pagination.PageNumberPagination):
+    # page number pagination whose total count is, by count_mode:
+    #   'exact'  - a COUNT on every request (default)
+    #   'none'   - not computed; 'count' is null and next is decided by fetching page_size + 1 rows
+    #   'cached' - like 'none', with the COUNT of the same list cached for count_ttl seconds
+    # a view selects its mode with pagination_count_mode / pagination_count_ttl.
+    count_mode = 'exact'
+    count_ttl = 60
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count_mode = getattr(view, 'pagination_count_mode', self.count_mode)
+        self.count_ttl = getattr(view, 'pagination_count_ttl', self.count_ttl)
+        if self.count_mode == 'exact':
+            return super().paginate_queryset(queryset, request, view)
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        try:
+            number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            number = 0
+        if number < 1:
+            raise NotFound(self.invalid_page_message.format(page_number=request.query_params.get(self.page_query_param), message='Invalid page.'))
+
+        offset = (number - 1) * page_size
+        rows = list(queryset[offset:offset + page_size + 1])
+        if number > 1 and not rows:
+            raise NotFound(self.invalid_page_message.format(page_number=number, message='That page contains no results'))
+        self.page = UncountedPage(rows[:page_size], number, len(rows) > page_size)
+        self.request = request
+        self.total_count = self.cached_count(queryset, request, view) if self.count_mode == 'cached' else None
+        return list(self.page)
+
+    def cached_count(self, queryset, request, view):
+        # keyed by the list (path and query parameters other than the page), not by the page
+        params = sorted((k, v) for k, v in request.query_params.lists() if k != self.page_query_param)
+        key = '%s:%s:%s' % (type(view).__name__, request.path, params)
+        key = 'pagination-count:' + hashlib.md5(key.encode()).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = len(queryset) if isinstance(queryset, list) else queryset.count()
+            cache.set(key, count, self.count_ttl)
+        return count
+
+    def get_count(self):
+        if self.count_mode == 'exact':
+            return self.page.paginator.count
+        return self.total_count
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.get_count(),  # total objects count, None when not counted
+            'next': self.get_next_page_num(),
+            'previous': self.get_prev_page_num(),
+            'results': data
+        })
+
+    def get_next_page_num(self):
+        if not self.page.has_next():
+            return None
+        return self.page.next_page_number()
+
+    def get_prev_page_num(self):
+        if not self.page.has_previous():
+            return None
+        return self.page.previous_page_number()
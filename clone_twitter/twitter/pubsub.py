@@ -0,0 +1,137 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# publish / subscribe between the processes writing events (requests, celery workers) and the ASGI processes
+# streaming them to clients (e.g. notification/stream.py). messages are strings.
+# redis PUBLISH, and one pattern subscription per event loop of an ASGI process that hands messages to its local
+# subscribers. events are published by celery workers, so a bus of one process would never reach the streams: without
+# REDIS_URL only manage.py test gets the in-process bus, anything else fails to start.
+
+PREFIX = 'bus:'
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_bus():
+    global _bus
+    with _bus_lock:
+        if _bus is None:
+            if settings.REDIS_URL:
+                _bus = RedisBus(settings.REDIS_URL)
+            elif settings.TESTING:
+                _bus = LocalBus()
+            else:
+                raise ImproperlyConfigured('REDIS_URL is not set: event streams need a bus shared with the celery workers')
+        return _bus
+
+
+def reset():
+    global _bus
+    with _bus_lock:
+        _bus = None
+
+
+class Subscription:
+    # messages of one channel for one reader on the running event loop; the oldest are dropped past maxsize
+
+    def __init__(self, bus, channel, maxsize=100):
+        self.bus = bus
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+
+    def put(self, message):
+        # from any thread
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:        # loop closed, the reader is gone
+            self.close()
+
+    def _put(self, message):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class LocalBus:
+
+    def __init__(self):
+        self.subscriptions = defaultdict(set)     # channel -> subscriptions
+        self.lock = threading.Lock()
+
+    def publish(self, channel, message):
+        return self.deliver(channel, message)
+
+    def deliver(self, channel, message):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.put(message)
+        return len(subscriptions)
+
+    def subscribe(self, channel):
+        # call on the event loop that reads the subscription
+        subscription = Subscription(self, channel)
+        with self.lock:
+            self.subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[subscription.channel]
+
+
+class RedisBus(LocalBus):
+
+    def __init__(self, url):
+        super().__init__()
+        self.url = url
+        self.listeners = dict()     # event loop -> task reading the pattern subscription
+        self.client = None
+
+    def connect(self):
+        import redis
+        return redis.Redis.from_url(self.url)
+
+    def connect_async(self):
+        import redis.asyncio
+        return redis.asyncio.Redis.from_url(self.url)
+
+    def publish(self, channel, message):
+        if self.client is None:
+            self.client = self.connect()
+        return self.client.publish(PREFIX + channel, message)
+
+    def subscribe(self, channel):
+        subscription = super().subscribe(channel)
+        listener = self.listeners.get(subscription.loop)
+        if listener is None or listener.done():
+            self.listeners[subscription.loop] = subscription.loop.create_task(self.listen())
+        return subscription
+
+    async def listen(self):
+        client = self.connect_async()
+        pubsub = client.pubsub()
+        await pubsub.psubscribe(PREFIX + '*')
+        try:
+            async for message in pubsub.listen():
+                if message['type'] == 'pmessage':
+                    self.deliver(message['channel'].decode()[len(PREFIX):], message['data'].decode())
+        finally:
+            await pubsub.close()
+            await client.close()
@@ -0,0 +1,157 @@
+import threading
+import time
+
+from django.conf import settings
+
+# redis client shared by the caches of this project (e.g. user/graph.py).
+# REDIS_URL unset (the default of manage.py test): an in-process stand-in implementing the commands used here, so tests
+# run without a redis server; each process then has its own data, so it is not for processes serving requests.
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_redis():
+    global _client
+    with _client_lock:
+        if _client is None:
+            if settings.REDIS_URL:
+                import redis
+                _client = redis.Redis.from_url(settings.REDIS_URL)
+            else:
+                _client = LocalRedis()
+        return _client
+
+
+def reset():
+    # forget the stand-in's data; a real redis is left alone
+    global _client
+    with _client_lock:
+        if isinstance(_client, LocalRedis):
+            _client = None
+
+
+class LocalRedis:
+    # members and values are kept as strings like redis keeps them as bytes; callers convert with int()
+
+    def __init__(self):
+        self.data = dict()
+        self.expires = dict()       # key -> time.monotonic() deadline
+        self.lock = threading.RLock()
+
+    def _get(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline < time.monotonic():
+            self.data.pop(key, None)
+            del self.expires[key]
+        return self.data.get(key)
+
+    def _set(self, key):
+        members = self._get(key)
+        if members is None:
+            members = self.data[key] = set()
+        return members
+
+    def get(self, key):
+        with self.lock:
+            return self._get(key)
+
+    def set(self, key, value, ex=None):
+        with self.lock:
+            self.data[key] = str(value)
+            self.expires.pop(key, None)
+            if ex is not None:
+                self.expires[key] = time.monotonic() + ex
+            return True
+
+    def incrby(self, key, amount=1):
+        with self.lock:
+            value = int(self._get(key) or 0) + amount
+            self.data[key] = str(value)
+            return value
+
+    def exists(self, *keys):
+        with self.lock:
+            return sum(self._get(x) is not None for x in keys)
+
+    def delete(self, *keys):
+        with self.lock:
+            n = 0
+            for key in keys:
+                n += self._get(key) is not None
+                self.data.pop(key, None)
+                self.expires.pop(key, None)
+            return n
+
+    def expire(self, key, seconds):
+        with self.lock:
+            if self._get(key) is None:
+                return False
+            self.expires[key] = time.monotonic() + seconds
+            return True
+
+    def sadd(self, key, *members):
+        with self.lock:
+            members = {str(x) for x in members}
+            current = self._set(key)
+            added = len(members - current)
+            current.update(members)
+            return added
+
+    def srem(self, key, *members):
+        with self.lock:
+            current = self._get(key)
+            if current is None:
+                return 0
+            members = {str(x) for x in members}
+            removed = len(members & current)
+            current.difference_update(members)
+            if not current:
+                self.delete(key)
+            return removed
+
+    def sismember(self, key, member):
+        with self.lock:
+            return str(member) in (self._get(key) or ())
+
+    def smembers(self, key):
+        with self.lock:
+            return set(self._get(key) or ())
+
+    def scard(self, key):
+        with self.lock:
+            return len(self._get(key) or ())
+
+    def sinter(self, *keys):
+        with self.lock:
+            return set.intersection(*[set(self._get(x) or ()) for x in keys])
+
+    def flushdb(self):
+        with self.lock:
+            self.data.clear()
+            self.expires.clear()
+
+    def pipeline(self, transaction=True):
+        return LocalPipeline(self)
+
+
+class LocalPipeline:
+    # queues commands and runs them under the stand-in's lock on execute()
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self.client.lock:
+            results = [method(*args, **kwargs) for method, args, kwargs in self.commands]
+        self.commands = []
+        return results
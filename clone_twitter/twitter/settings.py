@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
 from pathlib import Path
-import os, json, datetime
+import os, sys, json, datetime
 from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -77,8 +77,11 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'twitter.middleware.QueryCountMiddleware',
 ]
 
+QUERY_COUNT_HEADER = DEBUG     # X-Query-Count header on every response (twitter/middleware.py)
+
 # 이후 frontend host를 알게 되면 이 값 False로 하고 Whitelist 지정
 CORS_ORIGIN_ALLOW_ALL = True
 
@@ -199,10 +202,91 @@ EMAIL_USE_TLS = True
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
 
+# manage.py test: no celery worker or redis server is needed
+TESTING = sys.argv[1:2] == ['test']
+
 # celery
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
+CELERY_TASK_ALWAYS_EAGER = TESTING or os.getenv('CELERY_TASK_ALWAYS_EAGER') == 'true'     # run tasks inline, without a worker
+CELERY_TASK_EAGER_PROPAGATES = TESTING or os.getenv('CELERY_TASK_EAGER_PROPAGATES') == 'true'     # errors of inline tasks are raised
+CELERY_BEAT_SCHEDULE = {        # needs a beat process: celery -A twitter worker -B
+    'flush-tweet-counters': {
+        'task': 'tweet.tasks.flush_tweet_counters',
+        'schedule': 5.0,
+    },
+    'refresh-stale-recommendations': {
+        'task': 'user.tasks.refresh_recommendations',
+        'schedule': 300.0,
+    },
+    'refresh-all-recommendations': {
+        'task': 'user.tasks.refresh_recommendations',
+        'schedule': 24 * 60 * 60.0,
+        'kwargs': {'full': True},
+    },
+    'reconcile-unread-notification-counts': {
+        'task': 'notification.tasks.reconcile_unread_counts',
+        'schedule': 60 * 60.0,
+    },
+    'reconcile-followers-counts': {
+        'task': 'user.tasks.reconcile_followers_counts',
+        'schedule': 60 * 60.0,
+    },
+}
+
+# home timeline (tweet/timeline.py)
+TIMELINE_BACKFILL_SIZE = 200          # recent tweets copied into a timeline on follow
+TIMELINE_MAX_LENGTH = 800             # entries kept per timeline
+TIMELINE_FANOUT_FOLLOWER_LIMIT = 10000  # authors with more followers are pulled at read time instead of fanned out
+TIMELINE_TRIM_INTERVAL = 50           # fan-outs trim each timeline about once per this many entries
+
+# engagement counters (tweet/counters.py)
+TWEET_COUNTER_SHARDS = 8                # shards per like / retweet counter, 0 to update the tweet row directly
+TWEET_COUNTER_FLUSH_BATCH = 1000        # shard rows folded into Tweet per flush
+
+# threads (tweet/conversation.py)
+TWEET_THREAD_MAX_DEPTH = 20             # tweets replied to shown above a tweet; a deeper chain links to the next one
+
+# tweet search (tweet/search.py)
+TWEET_SEARCH_BACKEND = 'database'       # 'database': FULLTEXT lookup / scan, 'index': in-process inverted index (tweet/search_index.py)
+TWEET_SEARCH_TOKENIZER = 'tweet.tokenizers.HangulLatinTokenizer'
+TWEET_SEARCH_INDEX_SNAPSHOT = os.path.join(BASE_DIR, 'search_index.snapshot')     # written by manage.py snapshot_search_index
+TWEET_SEARCH_INDEX_OVERLAP = 100        # ids below the index watermark re-read on catch up, for late commits
+TWEET_SEARCH_INDEX_CATCH_UP = 5         # seconds between catch ups of the index of a process
+TWEET_SEARCH_INDEX_MAX_HITS = 1000      # newest matches of a keyword ranked by an indexed search
+
+# people search (user/search.py)
+PEOPLE_INDEX_TTL = 60                   # seconds between background rebuilds of the people index of a process
+PEOPLE_TYPEAHEAD_LIMIT = 10             # users returned by /search/people/typeahead/
+
+# redis for caches shared by the worker processes (twitter/redis.py), the server of the celery broker by default.
+# manage.py test runs with an in-process stand-in instead, which is not shared between processes
+REDIS_URL = os.getenv('REDIS_URL', None if TESTING else 'redis://localhost:6379/1')
+
+# follow graph cache (user/graph.py)
+FOLLOW_GRAPH_TTL = 3600                 # seconds before a cached follower / following set is reloaded from Follow
+
+# recommendation graph (user/recommend.py)
+FOLLOW_GRAPH_REBUILD_INTERVAL = 300     # seconds before the in-process snapshot of Follow is rebuilt in the background
+FOLLOW_GRAPH_MAX_PATCHES = 10000        # follows / unfollows patched onto a snapshot before it is rebuilt early
+FOLLOW_GRAPH_CHECK_INTERVAL = 10        # seconds between checks whether the snapshot needs a rebuild
+
+# who to follow batch (user/who_to_follow.py)
+RECOMMENDATION_TOP_K = 20               # recommendations stored per user
+RECOMMENDATION_CHUNK_SIZE = 1000        # users scored per celery task
+
+# notification groups (notification/fanout.py)
+NOTIFICATION_GROUP_TYPES = ('LIKE', 'RETWEET')  # types collapsed into one row per tweet
+NOTIFICATION_GROUP_WINDOW = 24 * 60 * 60        # seconds of quiet after which another actor starts a new group
+NOTIFICATION_GROUP_SAMPLE = 3                   # actors listed per group
+
+# notification event stream (notification/stream.py, served by twitter/asgi.py)
+NOTIFICATION_STREAM_HEARTBEAT = 15      # seconds between comments sent on an idle stream
+
+# async read views (twitter/asyncviews.py), for ASGI deployments: uvicorn workers on twitter.asgi:application
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS') == 'true'
+READ_CONCURRENCY = True                 # run the independent queries of a response at once, one connection each
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'twitter.settings')
 
 application = get_wsgi_application()
+
+from tweet import search_index      # noqa: E402, needs the apps loaded by get_wsgi_application
+from user import recommend, search  # noqa: E402
+
+search_index.start()
+search.start()
+recommend.start()
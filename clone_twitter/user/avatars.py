@@ -0,0 +1,29 @@
+from user.models import ProfileMedia, User
+
+# the url of a user's current ProfileMedia is denormalized onto User.avatar_url ('' for the default image).
+# it is written wherever a ProfileMedia is saved (UserProfileSerializer.update, the social login callbacks), so users
+# are serialized from the row alone, e.g. authors from select_related('author').
+
+
+def media_url(profile_media):
+    return profile_media.media.url if profile_media.media else profile_media.image_url
+
+
+def save_avatar(user, profile_media):
+    # store the url of the user's just saved profile media on the user
+    user.avatar_url = media_url(profile_media)
+    User.objects.filter(pk=user.pk).update(avatar_url=user.avatar_url)
+
+
+def avatar_url(user):
+    return user.avatar_url or ProfileMedia.default_profile_img
+
+
+class AvatarMixin:
+    # profile_img of a serializer of users; serializers of other objects override avatar_user
+
+    def avatar_user(self, obj):
+        return obj
+
+    def get_profile_img(self, obj):
+        return avatar_url(self.avatar_user(obj))
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from tweet import tasks as tweet_tasks
+from user.models import Follow, User
+
+# User.followers_count is kept by FollowSerializer.create and UserUnfollowView.delete; Follow rows deleted with their
+# follower are not subtracted, so reconcile_followers() (scheduled by CELERY_BEAT_SCHEDULE) corrects drift.
+# a correction that takes a user back to TIMELINE_FANOUT_FOLLOWER_LIMIT backfills its followers, like an unfollow does.
+
+
+def reconcile_followers(batch_size=1000):
+    # rewrite the counts that differ from the Follow rows; returns the number of users corrected
+    corrected = 0
+    last_pk = 0
+    while True:
+        users = list(User.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'followers_count')[:batch_size])
+        if not users:
+            return corrected
+        last_pk = users[-1][0]
+        follows = Follow.objects.filter(following_id__gte=users[0][0], following_id__lte=last_pk)
+        actual = dict(follows.values_list('following_id').annotate(n=Count('id')).order_by())
+        for pk, count in users:
+            if actual.get(pk, 0) != count:
+                User.objects.filter(pk=pk).update(followers_count=actual.get(pk, 0))
+                corrected += 1
+                limit = settings.TIMELINE_FANOUT_FOLLOWER_LIMIT
+                if count > limit >= actual.get(pk, 0):
+                    transaction.on_commit(lambda pk=pk: tweet_tasks.backfill_followers.delay(pk))
@@ -0,0 +1,116 @@
+from collections import defaultdict
+
+from django.conf import settings
+
+from twitter.redis import get_redis
+from user.models import Follow
+
+# follow graph cache: for every user, the pks it follows and the pks following it as redis sets
+# ('follow:<pk>:following', 'follow:<pk>:followers').
+# a set is loaded from Follow on first use and marked loaded by 'follow:<pk>:<kind>:loaded'; both expire after
+# FOLLOW_GRAPH_TTL seconds, so any drift (e.g. a write racing a reload) heals. follows and unfollows
+# (FollowSerializer.create, UserUnfollowView.delete, cascades) patch the loaded sets of both users via user/signals.py.
+
+FOLLOWING = 'following'
+FOLLOWERS = 'followers'
+
+
+def key(pk, kind):
+    return 'follow:%d:%s' % (pk, kind)
+
+
+def loaded_key(pk, kind):
+    return 'follow:%d:%s:loaded' % (pk, kind)
+
+
+def ensure(pks, kind):
+    # load the sets of the users that are not cached, with one query
+    pks = list(set(pks))
+    if not pks:
+        return
+    redis = get_redis()
+    pipe = redis.pipeline()
+    for pk in pks:
+        pipe.exists(loaded_key(pk, kind))
+    missing = [pk for pk, loaded in zip(pks, pipe.execute()) if not loaded]
+    if not missing:
+        return
+
+    column, other = ('follower_id', 'following_id') if kind == FOLLOWING else ('following_id', 'follower_id')
+    sets = defaultdict(list)
+    for pk, member in Follow.objects.filter(**{column + '__in': missing}).values_list(column, other).iterator():
+        sets[pk].append(member)
+
+    ttl = settings.FOLLOW_GRAPH_TTL
+    pipe = redis.pipeline()
+    for pk in missing:
+        pipe.delete(key(pk, kind))
+        if sets[pk]:
+            pipe.sadd(key(pk, kind), *sets[pk])
+            pipe.expire(key(pk, kind), ttl)
+        pipe.set(loaded_key(pk, kind), 1, ex=ttl)
+    pipe.execute()
+
+
+def members(pk, kind):
+    ensure([pk], kind)
+    return {int(x) for x in get_redis().smembers(key(pk, kind))}
+
+
+def following(pk):
+    return members(pk, FOLLOWING)
+
+
+def followers(pk):
+    return members(pk, FOLLOWERS)
+
+
+def following_count(pk):
+    ensure([pk], FOLLOWING)
+    return get_redis().scard(key(pk, FOLLOWING))
+
+
+def follower_count(pk):
+    ensure([pk], FOLLOWERS)
+    return get_redis().scard(key(pk, FOLLOWERS))
+
+
+def follows(follower_pk, following_pk):
+    if follower_pk is None:     # anonymous viewer
+        return False
+    ensure([follower_pk], FOLLOWING)
+    return bool(get_redis().sismember(key(follower_pk, FOLLOWING), following_pk))
+
+
+def follows_many(edges):
+    # (follower pk, following pk) -> whether the follower follows
+    result = {edge: False for edge in edges}
+    edges = [x for x in result if x[0] is not None]      # anonymous viewers follow nobody
+    ensure([x for x, y in edges], FOLLOWING)
+    pipe = get_redis().pipeline()
+    for follower_pk, following_pk in edges:
+        pipe.sismember(key(follower_pk, FOLLOWING), following_pk)
+    result.update({edge: bool(found) for edge, found in zip(edges, pipe.execute())})
+    return result
+
+
+# writes
+
+def add(follower_pk, following_pk):
+    patch(follower_pk, following_pk, 'sadd')
+
+
+def remove(follower_pk, following_pk):
+    patch(follower_pk, following_pk, 'srem')
+
+
+def patch(follower_pk, following_pk, command):
+    # only loaded sets are patched; a set not loaded yet will be read from Follow including this write
+    redis = get_redis()
+    for pk, kind, member in ((follower_pk, FOLLOWING, following_pk), (following_pk, FOLLOWERS, follower_pk)):
+        if redis.exists(loaded_key(pk, kind)):
+            getattr(redis, command)(key(pk, kind), member)
+
+
+def forget(pk):
+    get_redis().delete(*[f(pk, kind) for f in (key, loaded_key) for kind in (FOLLOWING, FOLLOWERS)])
@@ -0,0 +1,17 @@
+from user import graph
+from user.models import User
+
+# batch functions of twitter/dataloader.py for users and follow edges
+
+
+def users_by_pk(pks):
+    return User.objects.in_bulk(pks)
+
+
+def users_by_user_id(user_ids):
+    return User.objects.in_bulk(user_ids, field_name='user_id')
+
+
+def follows(edges):
+    # (follower pk, following pk) -> whether the follower follows, from the follow graph cache (user/graph.py)
+    return graph.follows_many(edges)
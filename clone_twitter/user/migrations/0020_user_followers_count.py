@@ -0,0 +1,27 @@
+# Generated by Django 3.2.6 on 2026-10-17 18:52
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+
+
+def count_followers(apps, schema_editor):
+    User = apps.get_model('user', 'User')
+    Follow = apps.get_model('user', 'Follow')
+    followers = Follow.objects.filter(following=OuterRef('pk')).values('following').annotate(c=Count('id')).values('c')
+    User.objects.filter(pk__in=Follow.objects.values('following_id')).update(followers_count=Subquery(followers))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0019_authcode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_followers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.6 on 2026-10-17 19:00
+
+from django.db import migrations, models
+
+
+def copy_avatar_urls(apps, schema_editor):
+    # the url of each user's last ProfileMedia, as user/avatars.py writes it
+    User = apps.get_model('user', 'User')
+    ProfileMedia = apps.get_model('user', 'ProfileMedia')
+    urls = dict()
+    for profile_media in ProfileMedia.objects.order_by('id').iterator():
+        urls[profile_media.user_id] = profile_media.media.url if profile_media.media else profile_media.image_url
+    for user_id, url in urls.items():
+        User.objects.filter(pk=user_id).update(avatar_url=url)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0021_user_handle_fulltext'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='avatar_url',
+            field=models.URLField(blank=True, max_length=500),
+        ),
+        migrations.RunPython(copy_avatar_urls, migrations.RunPython.noop),
+    ]
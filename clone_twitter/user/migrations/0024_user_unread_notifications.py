@@ -0,0 +1,28 @@
+# Generated by Django 3.2.6 on 2026-10-17 19:15
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+
+
+def count_unread(apps, schema_editor):
+    User = apps.get_model('user', 'User')
+    Notification = apps.get_model('notification', 'Notification')
+    unread = Notification.objects.filter(notified=OuterRef('pk'), is_read=False).values('notified').annotate(c=Count('id')).values('c')
+    User.objects.filter(pk__in=Notification.objects.filter(is_read=False).values('notified_id')).update(unread_notifications=Subquery(unread))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0023_recommendation'),
+        ('notification', '0007_notification_read_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='unread_notifications',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_unread, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+# rebuild user_handle_ft with InnoDB's stopword list disabled: with the default list, ngrams containing a stopword
+# (e.g. the bigrams of "a" or "i" with a neighbor) were never indexed, so search missed matches a scan finds.
+# the stopword setting is read when an index is built, so a server rebuilding it later (ALTER TABLE ... FORCE,
+# OPTIMIZE TABLE with innodb_optimize_fulltext_only off) needs innodb_ft_enable_stopword=OFF too; see tweet/search.py
+
+
+def rebuild(apps, schema_editor, stopwords):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    table = schema_editor.quote_name(apps.get_model('user', 'User')._meta.db_table)
+    schema_editor.execute('ALTER TABLE %s DROP INDEX user_handle_ft' % table)
+    schema_editor.execute('SET SESSION innodb_ft_enable_stopword = %s' % ('ON' if stopwords else 'OFF'))
+    try:
+        schema_editor.execute('ALTER TABLE %s ADD FULLTEXT INDEX user_handle_ft (username, user_id) WITH PARSER ngram' % table)
+    finally:
+        schema_editor.execute('SET SESSION innodb_ft_enable_stopword = ON')
+
+
+def without_stopwords(apps, schema_editor):
+    rebuild(apps, schema_editor, False)
+
+
+def with_stopwords(apps, schema_editor):
+    rebuild(apps, schema_editor, True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0024_user_unread_notifications'),
+    ]
+
+    operations = [
+        migrations.RunPython(without_stopwords, with_stopwords),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.6 on 2026-10-17 19:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0025_fulltext_without_stopwords'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='username',
+            field=models.CharField(db_index=True, max_length=50),
+        ),
+    ]
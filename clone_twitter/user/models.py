@@ -54,7 +54,7 @@ class User(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = 'user_id'
 
     user_id = models.CharField(max_length=15, unique=True, db_index=True)  # ex) @waffle -> user_id = waffle (up to length 15)
-    username = models.CharField(max_length=50)  # nickname ex) Waffle @1234 -> Waffle (up to length 50)
+    username = models.CharField(max_length=50, db_index=True)  # nickname ex) Waffle @1234 -> Waffle (up to length 50)
     email = models.EmailField(max_length=100, unique=True, null=True)
 
     phone_number_pattern = RegexValidator(regex=r"[\d]{3}-[\d]{4}-[\d]{4}")  # another option: 1)validation with drf 2)external library
@@ -70,6 +70,9 @@ class User(AbstractBaseUser, PermissionsMixin):
     bio = models.CharField(max_length=255, blank=True)
     birth_date = models.DateField(null=True)
     allow_notification = models.BooleanField(default=True)
+    followers_count = models.PositiveIntegerField(default=0)  # denormalized count of Follow rows with following=self
+    avatar_url = models.URLField(max_length=500, blank=True)  # denormalized url of the current ProfileMedia, '' for the default image
+    unread_notifications = models.PositiveIntegerField(default=0)  # denormalized count of unread Notification rows with notified=self
     created_at = models.DateTimeField(auto_now_add=True)
     is_superuser = models.BooleanField(default=False)
     is_staff = models.BooleanField(default=False)
@@ -85,6 +88,23 @@ class Follow(models.Model):
         # no duplicated follow relation
         constraints = [models.UniqueConstraint(fields=['follower', 'following'], name='follower-following relation')]
 
+class Recommendation(models.Model):
+    # precomputed "who to follow" of a user, written by user.who_to_follow.refresh
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()   # 0 is the best
+    score = models.FloatField()                 # Adamic-Adar index, 0 for users filled in by popularity
+    mutuals = models.PositiveIntegerField()     # users followed by self who follow recommended
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'rank'], name='user-rank recommendation')]
+
+class StaleRecommendation(models.Model):
+    # users whose follow set changed since their recommendations were computed.
+    # no foreign key constraint: unfollows cascading from a user's deletion mark the deleted user
+    user = models.OneToOneField(User, primary_key=True, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    marked_at = models.DateTimeField()
+
 class SocialAccount(models.Model):
     TYPES = (('kakao', 'Kakao'),)  # add Google later after implementation
 
@@ -0,0 +1,214 @@
+import heapq
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from user.models import Follow, User
+
+# in-process snapshot of the follow graph for recommendations, in compressed sparse row form:
+# users are numbered by position in the sorted pk array, and the positions followed by the user at position i are
+# indices[indptr[i]:indptr[i + 1]]. a few bytes per edge, so millions of follows fit in one worker.
+# follows / unfollows of this process are patched in by user/signals.py. start() (twitter/wsgi.py, twitter/asgi.py)
+# builds the snapshot in a background thread and rebuilds it every FOLLOW_GRAPH_REBUILD_INTERVAL seconds, or once
+# FOLLOW_GRAPH_MAX_PATCHES patches have piled up, swapping it in whole; requests never build it and go to the database
+# until it is there. a lookup costs one pass over the rows of the users followed, the sum of their out-degrees.
+
+
+class FollowGraph:
+
+    def __init__(self, pks, indptr, indices):
+        self.pks = pks                  # array of user pks, ascending
+        self.indptr = indptr            # array, row offsets into indices
+        self.indices = indices          # array of followed positions, row by row
+        self.followers = array('l', [0]) * len(pks)     # in-degree by position
+        for j in indices:
+            self.followers[j] += 1
+        # positions by popularity, to fill recommendations when the network of a user is too small
+        self.popular = array('l', sorted(range(len(pks)), key=lambda j: (-self.followers[j], pks[j])))
+        self.added = defaultdict(set)       # follower pk -> followed pks patched in since the build
+        self.removed = defaultdict(set)     # follower pk -> unfollowed pks patched out since the build
+        self.patches = 0
+        self.stale = False
+        self.built_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def build(cls):
+        pks = array('q', User.objects.order_by('id').values_list('id', flat=True).iterator())
+        indptr = array('q', [0])
+        indices = array('l')
+        position = {pk: i for i, pk in enumerate(pks)}
+
+        row = 0
+        edges = Follow.objects.order_by('follower_id', 'following_id').values_list('follower_id', 'following_id')
+        for follower_id, following_id in edges.iterator(chunk_size=10000):
+            i, j = position.get(follower_id), position.get(following_id)
+            if i is None or j is None:      # user created after the pks were read
+                continue
+            while row < i:
+                indptr.append(len(indices))
+                row += 1
+            indices.append(j)
+        while row < len(pks):
+            indptr.append(len(indices))
+            row += 1
+        return cls(pks, indptr, indices)
+
+    def expired(self):
+        return self.stale or self.patches > settings.FOLLOW_GRAPH_MAX_PATCHES \
+            or time.monotonic() - self.built_at > settings.FOLLOW_GRAPH_REBUILD_INTERVAL
+
+    def position(self, pk):
+        i = bisect_left(self.pks, pk)
+        return i if i < len(self.pks) and self.pks[i] == pk else None
+
+    def row(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    # patches from user/signals.py
+
+    def follow(self, follower_pk, following_pk):
+        with self.lock:
+            self.count_follower(following_pk, 0 if following_pk in self.following(follower_pk) else 1)
+            self.removed[follower_pk].discard(following_pk)
+            self.added[follower_pk].add(following_pk)
+            self.patches += 1
+
+    def unfollow(self, follower_pk, following_pk):
+        with self.lock:
+            self.count_follower(following_pk, -1 if following_pk in self.following(follower_pk) else 0)
+            self.added[follower_pk].discard(following_pk)
+            self.removed[follower_pk].add(following_pk)
+            self.patches += 1
+
+    def count_follower(self, pk, delta):
+        # in-degree of a patched edge; the popularity order waits for the next rebuild
+        j = self.position(pk)
+        if j is not None and delta:
+            self.followers[j] += delta
+
+    def add_user(self, pk):
+        with self.lock:
+            if self.pks and pk <= self.pks[-1]:     # not the newest pk: renumbering needs a rebuild
+                self.stale = True
+                return
+            self.pks.append(pk)
+            self.indptr.append(self.indptr[-1])
+            self.followers.append(0)
+            self.popular.append(len(self.pks) - 1)
+
+    def mark_stale(self):
+        self.stale = True
+
+    # lookups
+
+    def following(self, pk):
+        i = self.position(pk)
+        base = {self.pks[j] for j in self.row(i)} if i is not None else set()
+        return (base - self.removed.get(pk, set())) | self.added.get(pk, set())
+
+    def friends_of_friends(self, mine):
+        # position of every user followed by someone in mine -> how many of them follow it
+        counts = Counter()
+        for followed in mine:
+            i = self.position(followed)
+            if i is not None:
+                counts.update(self.row(i))
+            counts.update(self.positions(self.added.get(followed, ())))
+            counts.subtract(self.positions(self.removed.get(followed, ())))
+        return counts
+
+    def positions(self, pks):
+        # users created since the build have no position and are left out until the next one
+        return [i for i in map(self.position, pks) if i is not None]
+
+    def rank(self, candidates, counts, limit):
+        # positions with the most friends of friends first, then the most followers; returns pks
+        top = heapq.nlargest(limit, candidates, key=lambda j: (counts[j], self.followers[j], -self.pks[j]))
+        return [self.pks[j] for j in top]
+
+    def recommend(self, pk, limit):
+        # users the user does not follow, by friends of friends, filled up with the most followed users
+        mine = self.following(pk)
+        excluded = set(self.positions(mine | {pk}))
+        counts = self.friends_of_friends(mine)
+        result = self.rank([j for j, n in counts.items() if n > 0 and j not in excluded], counts, limit)
+        if len(result) < limit:
+            excluded.update(self.positions(result))
+            popular = (j for j in self.popular if j not in excluded)
+            result.extend(self.pks[j] for j in islice(popular, limit - len(result)))
+        return result
+
+    def recommend_from(self, pk, other_pk, limit):
+        # users followed by other_pk that the user does not follow, by friends of friends of the user
+        mine = self.following(pk)
+        candidates = self.positions(self.following(other_pk) - mine - {pk})
+        return self.rank(candidates, self.friends_of_friends(mine), limit)
+
+
+logger = logging.getLogger(__name__)
+
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def current_graph():
+    # the graph of this process if it has been built, without building it
+    return _graph
+
+
+def rebuild():
+    # build a new graph while the current one keeps serving, then swap it in
+    global _graph
+    graph = FollowGraph.build()
+    with _graph_lock:
+        _graph = graph
+    return graph
+
+
+def reset():
+    global _graph
+    with _graph_lock:
+        _graph = None
+
+
+def start():
+    # at server startup, in every worker process (start it after fork, i.e. without gunicorn --preload)
+    thread = threading.Thread(target=keep_up, name='follow-graph', daemon=True)
+    thread.start()
+    return thread
+
+
+def keep_up():
+    while True:
+        close_old_connections()     # this thread's connection, per CONN_MAX_AGE
+        try:
+            graph = current_graph()
+            if graph is None or graph.expired():
+                rebuild()
+        except Exception:
+            logger.exception('follow graph rebuild failed')
+        time.sleep(settings.FOLLOW_GRAPH_CHECK_INTERVAL)
+
+
+# from the database, by follower count, while the graph of the process is not built
+
+def popular(pk, limit):
+    # the most followed users the user does not follow
+    mine = Follow.objects.filter(follower_id=pk).values('following_id')
+    users = User.objects.exclude(pk=pk).exclude(pk__in=mine).order_by('-followers_count', 'pk')
+    return list(users.values_list('pk', flat=True)[:limit])
+
+
+def followed_by(pk, other_pk, limit):
+    # the most followed users followed by other_pk that the user does not follow
+    mine = Follow.objects.filter(follower_id=pk).values('following_id')
+    users = User.objects.filter(following__follower_id=other_pk).exclude(pk=pk).exclude(pk__in=mine).order_by('-followers_count', 'pk')
+    return list(users.values_list('pk', flat=True)[:limit])
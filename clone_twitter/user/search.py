@@ -0,0 +1,214 @@
+import heapq
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Count, Q
+
+from tweet.search import NGRAM_TOKEN_SIZE, Match, boolean_query
+from user.models import Follow, User
+
+# in-process people index: user_id / username of every user with their follower counts.
+# kept current within this process by user/signals.py. start() (twitter/wsgi.py, twitter/asgi.py) builds it in a
+# background thread and rebuilds it from the database every PEOPLE_INDEX_TTL seconds, which also picks up changes
+# made by other processes; a rebuilt index is swapped in whole, requests keep using the previous one meanwhile.
+# keywords shorter than a trigram are looked up in the database instead (handle_matches).
+
+GRAM = 3
+
+
+def grams(text):
+    return {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+
+class PeopleIndex:
+
+    def __init__(self, users, followers):
+        self.users = dict()                 # pk -> (user_id, username)
+        self.followers = defaultdict(int, followers)    # pk -> number of followers
+        self.handles = []                   # sorted (lowercased handle, pk) over user_id and username, for prefix lookups
+        self.grams = defaultdict(set)       # trigram of a lowercased handle -> pks, for substring lookups
+        self.top = dict()                   # typeahead results of short prefixes
+        self.lock = threading.Lock()
+
+        for pk, user_id, username in users:
+            self.users[pk] = (user_id, username)
+            for handle in self.keys(user_id, username):
+                self.handles.append((handle, pk))
+                for gram in grams(handle):
+                    self.grams[gram].add(pk)
+        self.handles.sort()
+
+    @classmethod
+    def build(cls):
+        users = User.objects.values_list('id', 'user_id', 'username')
+        followers = Follow.objects.values_list('following').annotate(n=Count('id')).order_by()
+        return cls(users.iterator(), followers)
+
+    @staticmethod
+    def keys(user_id, username):
+        return {user_id.lower(), username.lower()}
+
+    # updates from user/signals.py
+
+    def put_user(self, pk, user_id, username):
+        with self.lock:
+            if self.users.get(pk) == (user_id, username):
+                return
+            self._remove(pk)
+            self.users[pk] = (user_id, username)
+            for handle in self.keys(user_id, username):
+                insort(self.handles, (handle, pk))
+                for gram in grams(handle):
+                    self.grams[gram].add(pk)
+            self.top.clear()
+
+    def remove_user(self, pk):
+        with self.lock:
+            self._remove(pk)
+            self.top.clear()
+
+    def _remove(self, pk):
+        if pk not in self.users:
+            return
+        for handle in self.keys(*self.users.pop(pk)):
+            i = bisect_left(self.handles, (handle, pk))
+            if i < len(self.handles) and self.handles[i] == (handle, pk):
+                del self.handles[i]
+            for gram in grams(handle):
+                self.grams[gram].discard(pk)
+
+    def add_follower(self, pk, delta):
+        with self.lock:
+            self.followers[pk] = max(0, self.followers[pk] + delta)
+            self.top.clear()
+
+    # lookups
+
+    def containing(self, keyword):
+        # pks of users whose user_id or username contains the keyword, case-insensitively; at least GRAM characters
+        keyword = keyword.lower()
+        sets = sorted((self.grams.get(x, set()) for x in grams(keyword)), key=len)
+        candidates = set.intersection(*sets)
+        return {pk for pk in candidates if any(keyword in x for x in self.keys(*self.users[pk]))}
+
+    def prefixed(self, prefix):
+        # pks of users whose user_id or username starts with the prefix
+        prefix = prefix.lower()
+        pks = set()
+        for i in range(bisect_left(self.handles, (prefix,)), len(self.handles)):
+            handle, pk = self.handles[i]
+            if not handle.startswith(prefix):
+                break
+            pks.add(pk)
+        return pks
+
+    def typeahead(self, prefix, limit):
+        # exact user_id match first, then by followers
+        prefix = prefix.lower()
+        cached = len(prefix) <= 2
+        if cached and (prefix, limit) in self.top:
+            return self.top[(prefix, limit)]
+        rank = lambda pk: (self.users[pk][0].lower() == prefix, self.followers[pk], -pk)
+        result = heapq.nlargest(limit, self.prefixed(prefix), key=rank)
+        if cached:
+            self.top[(prefix, limit)] = result
+        return result
+
+
+logger = logging.getLogger(__name__)
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    # built here only before the first background build is done, or in processes that did not start() one
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = PeopleIndex.build()
+        return _index
+
+
+def current_index():
+    # the index of this process if it has been built, without building it
+    return _index
+
+
+def rebuild():
+    # build a new index while the current one keeps serving, then swap it in
+    global _index
+    index = PeopleIndex.build()
+    with _index_lock:
+        _index = index
+    return index
+
+
+def reset():
+    global _index
+    with _index_lock:
+        _index = None
+
+
+def start():
+    # at server startup, in every worker process (start it after fork, i.e. without gunicorn --preload)
+    thread = threading.Thread(target=keep_up, name='people-index', daemon=True)
+    thread.start()
+    return thread
+
+
+def keep_up():
+    while True:
+        close_old_connections()     # this thread's connection, per CONN_MAX_AGE
+        try:
+            if current_index() is None:
+                get_index()
+            else:
+                rebuild()
+        except Exception:
+            logger.exception('people index rebuild failed')
+        time.sleep(settings.PEOPLE_INDEX_TTL)
+
+
+def handle_matches(keyword):
+    # pks of users whose user_id or username contains a keyword too short for the trigrams, from the database:
+    # through the ngram FULLTEXT index on MySQL, or by prefix on the handle indexes when shorter than its ngrams
+    if len(keyword) < NGRAM_TOKEN_SIZE:
+        users = User.objects.filter(Q(user_id__istartswith=keyword) | Q(username__istartswith=keyword))
+    else:
+        users = User.objects.filter(Q(user_id__icontains=keyword) | Q(username__icontains=keyword))
+        if connection.vendor == 'mysql':
+            users = users.annotate(score=Match('username', 'user_id', query=boolean_query([keyword]))).filter(score__gt=0)
+    return set(users.values_list('id', flat=True))
+
+
+def search_people(keywords, tag_keywords):
+    # pks of users matching a keyword in user_id, username or bio, in the order of the people search:
+    # exact @user_id first, then by keywords in username, keywords anywhere, followers
+    if not keywords:
+        return []
+    index = get_index()
+    keywords = [x.lower() for x in keywords]
+    tag_keywords = [x.lower() for x in tag_keywords]
+    by_handle = {x: index.containing(x) if len(x) >= GRAM else handle_matches(x) for x in keywords}
+
+    # bio is not indexed; only users whose bio contains a keyword are read
+    bios = User.objects.filter(reduce(or_, [Q(bio__icontains=x) for x in keywords])).values_list('id', 'bio')
+    bios = {pk: bio.lower() for pk, bio in bios}
+
+    def rank(pk):
+        user_id, username = index.users.get(pk, ('', ''))
+        is_tag_keyword = sum(user_id.lower() == x for x in tag_keywords)
+        num_keywords_in_username = sum(x in username.lower() for x in keywords)
+        num_keywords_included = sum(pk in by_handle[x] or x in bios.get(pk, '') for x in keywords)
+        return -is_tag_keyword, -num_keywords_in_username, -num_keywords_included, -index.followers[pk], pk
+
+    candidates = set(bios).union(*by_handle.values())
+    return sorted(candidates, key=rank)
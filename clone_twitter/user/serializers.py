@@ -4,10 +4,18 @@ from django.contrib.auth import get_user_model, authenticate
 from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 import re
+from tweet import timeline
 from tweet.models import Retweet, Tweet
-from tweet.serializers import TweetSerializer, custom_paginator, notify
+from tweet.paginations import keyset_paginator
+from notification import tasks as notification_tasks
+from tweet.serializers import TweetSerializer
+from user import avatars, graph
+from twitter.dataloader import LoaderListSerializer, LoaderMixin
+from user.avatars import AvatarMixin
+from user.loaders import follows
 from user.models import Follow, ProfileMedia
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import F, Q
 
 # jwt token setting
 User = get_user_model()
@@ -113,12 +121,15 @@ class FollowSerializer(serializers.Serializer):
     def create(self, validated_data):
         follower = self.context['request'].user
         following = User.objects.get(user_id=validated_data['user_id'])
-        follow_relation = Follow.objects.create(follower=follower, following=following)
-        notify(follower, following.user_id, None, 'FOLLOW')
+        with transaction.atomic():
+            follow_relation = Follow.objects.create(follower=follower, following=following)
+            User.objects.filter(pk=following.pk).update(followers_count=F('followers_count') + 1)
+            timeline.backfill(follower, following)
+        notification_tasks.dispatch(notification_tasks.notify, follower.pk, following.user_id, None, 'FOLLOW')
         return follow_relation
 
 
-class UserFollowSerializer(serializers.ModelSerializer):
+class UserFollowSerializer(AvatarMixin, LoaderMixin, serializers.ModelSerializer):
     id = serializers.IntegerField(source='follower.id')
     username = serializers.CharField(source='follower.username')
     user_id = serializers.CharField(source='follower.user_id')
@@ -129,6 +140,7 @@ class UserFollowSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Follow
+        list_serializer_class = LoaderListSerializer
         fields = (
             'id',
             'username',
@@ -139,26 +151,23 @@ class UserFollowSerializer(serializers.ModelSerializer):
             'i_follow',
         )
 
-    def get_profile_img(self, follow):
-        try:
-            profile_img = follow.follower.profile_img.get()
-        except ProfileMedia.DoesNotExist:
-            return ProfileMedia.default_profile_img
-        return profile_img.media.url if profile_img.media else profile_img.image_url
+    def avatar_user(self, follow):
+        return follow.follower
+
+    def prime(self, relations):
+        me = self.context['request'].user
+        self.loader(follows).prime([(x.follower_id, me.pk) for x in relations] + [(me.pk, x.follower_id) for x in relations])
 
     def get_follows_me(self, follow):
         me = self.context['request'].user
-        follows_me = Follow.objects.filter(Q(follower=follow.follower) & Q(following=me)).exists()
-        return follows_me
+        return self.loader(follows).load((follow.follower_id, me.pk))
 
     def get_i_follow(self, follow):
         me = self.context['request'].user
-        user = follow.follower
-        i_follow = user.following.filter(follower=me).count()
-        return i_follow == 1
+        return self.loader(follows).load((me.pk, follow.follower_id))
 
 
-class UserFollowingSerializer(serializers.ModelSerializer):
+class UserFollowingSerializer(AvatarMixin, LoaderMixin, serializers.ModelSerializer):
     id = serializers.IntegerField(source='following.id')
     username = serializers.CharField(source='following.username')
     user_id = serializers.CharField(source='following.user_id')
@@ -169,6 +178,7 @@ class UserFollowingSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Follow
+        list_serializer_class = LoaderListSerializer
         fields = (
             'id',
             'username',
@@ -179,26 +189,23 @@ class UserFollowingSerializer(serializers.ModelSerializer):
             'i_follow'
         )
 
-    def get_profile_img(self, follow):
-        try:
-            profile_img = follow.following.profile_img.get()
-        except ProfileMedia.DoesNotExist:
-            return ProfileMedia.default_profile_img
-        return profile_img.media.url if profile_img.media else profile_img.image_url
+    def avatar_user(self, follow):
+        return follow.following
+
+    def prime(self, relations):
+        me = self.context['request'].user
+        self.loader(follows).prime([(x.following_id, me.pk) for x in relations] + [(me.pk, x.following_id) for x in relations])
 
     def get_follows_me(self, follow):
         me = self.context['request'].user
-        follows_me = Follow.objects.filter(Q(follower=follow.following) & Q(following=me)).exists()
-        return follows_me
+        return self.loader(follows).load((follow.following_id, me.pk))
 
     def get_i_follow(self, follow):
         me = self.context['request'].user
-        user = follow.following
-        i_follow = user.following.filter(follower=me).count()
-        return i_follow == 1
+        return self.loader(follows).load((me.pk, follow.following_id))
 
 
-class UserRecommendSerializer(serializers.ModelSerializer):
+class UserRecommendSerializer(AvatarMixin, serializers.ModelSerializer):
     profile_img = serializers.SerializerMethodField()
 
     class Meta:
@@ -210,15 +217,20 @@ class UserRecommendSerializer(serializers.ModelSerializer):
             'bio',
             # Q. id ?
         ]
-
-    def get_profile_img(self, obj):
-        try:
-            profile_img = obj.profile_img.get()
-        except ProfileMedia.DoesNotExist:
-            return ProfileMedia.default_profile_img
-        return profile_img.media.url if profile_img.media else profile_img.image_url
           
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserTypeaheadSerializer(AvatarMixin, serializers.ModelSerializer):
+    profile_img = serializers.SerializerMethodField()
+
+    class Meta:
+        model = User
+        fields = [
+            'username',
+            'user_id',
+            'profile_img',
+        ]
+
+
+class UserProfileSerializer(AvatarMixin, serializers.ModelSerializer):
     username = serializers.CharField(max_length=50)
     bio = serializers.CharField(allow_blank=True)
     birth_date =serializers.DateField(allow_null=True)
@@ -243,18 +255,14 @@ class UserProfileSerializer(serializers.ModelSerializer):
 
     def get_i_follow(self, user):
         me = self.context['request'].user
-        i_follow = user.following.filter(follower=me).count()
-        return i_follow == 1
-
-    def get_profile_img(self, obj):
-        try:
-            profile_img = obj.profile_img.get()
-        except ProfileMedia.DoesNotExist:
-            return ProfileMedia.default_profile_img
-        return profile_img.media.url if profile_img.media else profile_img.image_url
+        return graph.follows(me.pk, user.pk)
       
     def update(self, me, validated_data):
-        super().update(me, validated_data)
+        # only the edited columns: counters on the row (followers_count, unread_notifications, avatar_url) are updated
+        # concurrently, and me was loaded at authentication
+        for attr, value in validated_data.items():
+            setattr(me, attr, value)
+        me.save(update_fields=list(validated_data))
         media = self.context['request'].FILES.get('profile_img')
         if media is None:
             return me
@@ -263,11 +271,12 @@ class UserProfileSerializer(serializers.ModelSerializer):
             profile_media.media = media
             profile_media.save()
         except ProfileMedia.DoesNotExist:
-            ProfileMedia.objects.create(media=media, user=me)
+            profile_media = ProfileMedia.objects.create(media=media, user=me)
+        avatars.save_avatar(me, profile_media)
 
         return me
 
-class UserInfoSerializer(serializers.ModelSerializer):
+class UserInfoSerializer(AvatarMixin, serializers.ModelSerializer):
     username = serializers.CharField(max_length=50)
     user_id = serializers.CharField(min_length=4, max_length=15, validators= [UniqueValidator(queryset=User.objects.all())])
     
@@ -301,22 +310,15 @@ class UserInfoSerializer(serializers.ModelSerializer):
             'i_follow',
         )
 
-    def get_profile_img(self, obj):
-        try:
-            profile_img = obj.profile_img.get()
-        except ProfileMedia.DoesNotExist:
-            return ProfileMedia.default_profile_img
-        return profile_img.media.url if profile_img.media else profile_img.image_url
-
     def get_tweets(self, obj):
         q = Q()
         q |= (Q(author=obj) & ~Q(tweet_type='RETWEET'))                    # tweets written(or replied, quoted) by the user
         q |= (Q(retweeting_user=obj.user_id) & Q(tweet_type='RETWEET'))    # tweets retweeted by the user
 
-        tweets = Tweet.objects.filter(q).order_by('-created_at')
+        tweets = Tweet.objects.filter(q).select_related('author').order_by('-created_at', '-id')
 
         request = self.context['request']
-        tweets, previous_page, next_page = custom_paginator(tweets, 10, request)
+        tweets, previous_page, next_page = keyset_paginator(tweets, 10, request)
         serializer = TweetSerializer(tweets, many=True, context={'request': request})
         data = serializer.data
 
@@ -336,15 +338,14 @@ class UserInfoSerializer(serializers.ModelSerializer):
         return Tweet.objects.filter(q).count()
 
     def get_following(self, obj):
-        return obj.follower.all().count()
+        return graph.following_count(obj.pk)
 
     def get_follower(self, obj):
-        return obj.following.all().count()
+        return graph.follower_count(obj.pk)
 
     def get_i_follow(self, obj):
         me = self.context['request'].user
-        i_follow = obj.following.filter(follower=me).count()
-        return i_follow == 1
+        return graph.follows(me.pk, obj.pk)
 
     # at least 4, at most 15 letters
     # only letters, digits, underscore(_) are allowed
@@ -360,11 +361,11 @@ class UserInfoSerializer(serializers.ModelSerializer):
 
     def update(self, instance, validated_data):
         instance.user_id = validated_data.get('user_id', instance.user_id)
-        instance.save()
+        instance.save(update_fields=['user_id'])
         return instance
 
       
-class UserSearchInfoSerializer(serializers.ModelSerializer):
+class UserSearchInfoSerializer(AvatarMixin, serializers.ModelSerializer):
     username = serializers.CharField(max_length=50)
     user_id = serializers.CharField(min_length=4, max_length=15, validators= [UniqueValidator(queryset=User.objects.all())])
     bio = serializers.CharField(allow_blank=True)
@@ -386,18 +387,11 @@ class UserSearchInfoSerializer(serializers.ModelSerializer):
             'follower'
         )
 
-    def get_profile_img(self, obj):
-        try:
-            profile_img = obj.profile_img.get()
-        except ProfileMedia.DoesNotExist:
-            return ProfileMedia.default_profile_img
-        return profile_img.media.url if profile_img.media else profile_img.image_url
-
     def get_tweets_num(self, obj):
         return obj.tweets.all().count()
 
     def get_following(self, obj):
-        return obj.following.all().count()
+        return graph.follower_count(obj.pk)
 
     def get_follower(self, obj):
-        return obj.follower.all().count()
+        return graph.following_count(obj.pk)
@@ -0,0 +1,68 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from user import graph, recommend, search, who_to_follow
+from user.models import Follow, Recommendation, User
+
+# keep the people index of this process (user/search.py) current; other processes catch up when theirs is rebuilt.
+# the follow graph cache (user/graph.py) is shared by all processes through redis and patched on every follow / unfollow;
+# the recommendation graph (user/recommend.py) is per process like the index, and patched when it has been built.
+# both are patched once the follow / unfollow commits, so a rolled back one leaves no edge behind.
+# a follow or unfollow marks the follower for the next incremental who to follow run (user/who_to_follow.py)
+
+
+@receiver(post_save, sender=User)
+def index_user(sender, instance, created, **kwargs):
+    index = search.current_index()
+    if index is not None:
+        index.put_user(instance.pk, instance.user_id, instance.username)
+    if created:
+        graph.forget(instance.pk)       # sets cached for a previous user with the same pk
+        follow_graph = recommend.current_graph()
+        if follow_graph is not None:
+            follow_graph.add_user(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def unindex_user(sender, instance, **kwargs):
+    index = search.current_index()
+    if index is not None:
+        index.remove_user(instance.pk)
+    follow_graph = recommend.current_graph()
+    if follow_graph is not None:
+        follow_graph.mark_stale()
+
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, **kwargs):
+    index = search.current_index()
+    if index is not None and created:
+        index.add_follower(instance.following_id, 1)
+    if created:
+        transaction.on_commit(lambda: patch_follow(instance.follower_id, instance.following_id))
+        who_to_follow.mark_stale(instance.follower_id)
+        Recommendation.objects.filter(user_id=instance.follower_id, recommended_id=instance.following_id).delete()
+
+
+@receiver(post_delete, sender=Follow)
+def count_unfollow(sender, instance, **kwargs):
+    index = search.current_index()
+    if index is not None:
+        index.add_follower(instance.following_id, -1)
+    transaction.on_commit(lambda: patch_unfollow(instance.follower_id, instance.following_id))
+    who_to_follow.mark_stale(instance.follower_id)
+
+
+def patch_follow(follower_pk, following_pk):
+    graph.add(follower_pk, following_pk)
+    follow_graph = recommend.current_graph()
+    if follow_graph is not None:
+        follow_graph.follow(follower_pk, following_pk)
+
+
+def patch_unfollow(follower_pk, following_pk):
+    graph.remove(follower_pk, following_pk)
+    follow_graph = recommend.current_graph()
+    if follow_graph is not None:
+        follow_graph.unfollow(follower_pk, following_pk)
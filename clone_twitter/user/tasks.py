@@ -1,5 +1,8 @@
 from django.core.mail import EmailMessage
-from celery import shared_task
+from django.utils.dateparse import parse_datetime
+from celery import group, shared_task
+
+from user import counts, who_to_follow
 
 
 @shared_task
@@ -7,4 +10,24 @@ def send_email_task(mail_title, message_data, mail_to):
     email = EmailMessage(mail_title, message_data, to=[mail_to])
     sent_message_count = email.send()
     print(sent_message_count)
-    return sent_message_count
\ No newline at end of file
+    return sent_message_count
+
+
+@shared_task
+def refresh_recommendations(full=False):
+    # scheduled by CELERY_BEAT_SCHEDULE: stale users often, everyone daily. one subtask per chunk of users, so the
+    # workers score them side by side (a prefork worker is daemonic and cannot start processes of its own)
+    started, work = who_to_follow.plan(full)
+    group(score_recommendations.s(pks, started.isoformat()) for pks in work).apply_async()
+    return sum(len(pks) for pks in work)
+
+
+@shared_task
+def score_recommendations(pks, started):
+    return who_to_follow.score(pks, parse_datetime(started))
+
+
+@shared_task
+def reconcile_followers_counts():
+    # scheduled by CELERY_BEAT_SCHEDULE
+    return counts.reconcile_followers()
@@ -1,15 +1,24 @@
 import datetime
+import multiprocessing
+import tempfile
+from unittest import mock
 from django.db.models import query
 from django.test import TestCase
 
 from factory.django import DjangoModelFactory
 from tweet.models import Retweet, Tweet
 
-from user.models import User, Follow
-from django.test import TestCase
-from django.db import transaction
+from user.models import User, Follow, ProfileMedia, Recommendation, StaleRecommendation
+from django.test import TestCase, override_settings
+from django.db import connection, transaction
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from django.core.files.uploadedfile import SimpleUploadedFile
 from rest_framework import status
-from user.serializers import jwt_token_of
+import twitter.redis
+from user import avatars, counts, graph, recommend, search, tasks, who_to_follow
+from django.test import RequestFactory
+from user.serializers import jwt_token_of, UserInfoSerializer, UserProfileSerializer
 
 class UserFactory(DjangoModelFactory):
     class Meta:
@@ -389,6 +398,12 @@ class GetRecommendTestCase(TestCase):
         Follow.objects.create(follower=cls.user5, following=cls.user4)
         Follow.objects.create(follower=cls.user5, following=cls.user6)
 
+    def setUp(self):
+        recommend.rebuild()     # by the background thread of a server
+
+    def tearDown(self):
+        recommend.reset()
+
     def test_get_recommend_success(self):
         response = self.client.get(
             '/api/v1/recommend/',
@@ -397,9 +412,10 @@ class GetRecommendTestCase(TestCase):
             HTTP_AUTHORIZATION=self.user1_token)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         data = response.json()
-        self.assertEqual(data[0]['user_id'], "user3_id")
-        self.assertEqual(data[1]['user_id'], "user4_id")
-        self.assertEqual(data[2]['user_id'], "user5_id")
+        # nobody is two hops away from user1, so the most followed users are recommended
+        self.assertEqual(data[0]['user_id'], "user4_id")
+        self.assertEqual(data[1]['user_id'], "user6_id")
+        self.assertEqual(data[2]['user_id'], "user3_id")
 
     def test_get_recommend_empty(self):
         response = self.client.get(
@@ -431,6 +447,17 @@ class GetRecommendTestCase(TestCase):
         self.assertEqual(data[1]['user_id'], "user4_id")
         self.assertEqual(data[2]['user_id'], "user6_id")
 
+    def test_database_until_the_graph_is_built(self):
+        recommend.reset()
+        for user, count in ((self.user1, 3), (self.user4, 2), (self.user6, 2), (self.user3, 1)):
+            User.objects.filter(pk=user.pk).update(followers_count=count)
+
+        response = self.client.get('/api/v1/recommend/', HTTP_AUTHORIZATION=self.user1_token)
+        self.assertEqual([x['user_id'] for x in response.json()], ['user4_id', 'user6_id', 'user3_id'])
+        response = self.client.get('/api/v1/follow/%d/recommend/' % self.user5.pk, HTTP_AUTHORIZATION=self.user1_token)
+        self.assertEqual([x['user_id'] for x in response.json()], ['user4_id', 'user6_id', 'user3_id'])
+        self.assertIsNone(recommend.current_graph())
+
 
 class GetUserProfileTestCase(TestCase):
     
@@ -569,6 +596,31 @@ class PatchUserProfileTestCase(TestCase):
         self.assertEqual(data['bio'], self.static_response_patch2['bio'])
         self.assertEqual(data['birth_date'], self.static_response_patch2['birth_date'])
 
+    def test_patch_keeps_counters(self):
+        # counters updated after the user was loaded by authentication survive the edits
+        me = User.objects.get(pk=self.user1.pk)
+        User.objects.filter(pk=me.pk).update(followers_count=5, unread_notifications=3, avatar_url='https://cdn/a.png')
+        request = RequestFactory().patch('/api/v1/user/profile/')
+        request.user = me
+        serializer = UserProfileSerializer(me, data={'bio': 'edited'}, partial=True, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        serializer = UserInfoSerializer(me, data={'user_id': 'user1_new'}, partial=True, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        user = User.objects.get(pk=me.pk)
+        self.assertEqual((user.bio, user.user_id), ('edited', 'user1_new'))
+        self.assertEqual((user.followers_count, user.unread_notifications, user.avatar_url), (5, 3, 'https://cdn/a.png'))
+
+    def test_reconcile_followers(self):
+        other = UserFactory(email='other@email.com', user_id='other_id', username='other', password='password', phone_number='010-0000-0000')
+        Follow.objects.create(follower=other, following=self.user1)
+        User.objects.filter(pk=self.user1.pk).update(followers_count=3)
+        self.assertEqual(counts.reconcile_followers(batch_size=1), 1)
+        self.assertEqual(User.objects.get(pk=self.user1.pk).followers_count, 1)
+        self.assertEqual(counts.reconcile_followers(), 0)
+
 class GetUserTestCase(TestCase):
     
     @classmethod
@@ -883,4 +935,335 @@ class GetSearchPeopleTestCase(TestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(list(map(lambda x:x['user_id'], response.json()['results'])),
-        ['kk', 'tt', 'test9', 'test8ee', 'test7', 'test6', 'test5', 'test4', 'test1', 'test3', 'test2'])
\ No newline at end of file
+        ['kk', 'tt', 'test9', 'test8ee', 'test7', 'test6', 'test5', 'test4', 'test1', 'test3', 'test2'])
+
+class SearchPeopleTypeaheadTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+
+        user_id_list = ['waffle', 'waffle_fan', 'wafflestudio', 'toast', 'Wally']
+        username_list = ['Waffle', 'fan', 'Waffle Studio', 'waffle lover', 'wall']
+
+        cls.users = [
+            UserFactory(
+                email='email%d@email.com' % i,
+                user_id=user_id_list[i],
+                username=username_list[i],
+                password='password',
+                phone_number='010-0000-%04d' % i,
+                is_verified=True
+            ) for i in range(len(user_id_list))]
+
+        cls.tokens = ['JWT ' + jwt_token_of(User.objects.get(email='email%d@email.com' % i))
+            for i in range(len(user_id_list))]
+
+        for follower in cls.users[2:4]:
+            Follow.objects.create(follower=follower, following=cls.users[1])
+        Follow.objects.create(follower=cls.users[0], following=cls.users[2])
+
+    def setUp(self):
+        search.reset()
+
+    def typeahead(self, query):
+        response = self.client.get('/api/v1/search/people/typeahead/', {'query': query}, HTTP_AUTHORIZATION=self.tokens[0])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [x['user_id'] for x in response.json()]
+
+    def test_typeahead(self):
+        # exact user_id first, then by followers; user_id or username prefix
+        self.assertEqual(self.typeahead('waffle'), ['waffle', 'waffle_fan', 'wafflestudio', 'toast'])
+        self.assertEqual(self.typeahead('@WA'), ['waffle_fan', 'wafflestudio', 'waffle', 'toast', 'Wally'])
+        self.assertEqual(self.typeahead('waffles'), ['wafflestudio'])
+        self.assertEqual(self.typeahead('x'), [])
+
+        response = self.client.get('/api/v1/search/people/typeahead/', {'query': '@'}, HTTP_AUTHORIZATION=self.tokens[0])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_index_follows_writes(self):
+        self.assertEqual(self.typeahead('wa')[:2], ['waffle_fan', 'wafflestudio'])
+
+        self.client.post('/api/v1/follow/', data={'user_id': 'wafflestudio'}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[4])
+        self.client.post('/api/v1/follow/', data={'user_id': 'wafflestudio'}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[3])
+        self.assertEqual(self.typeahead('wa')[:2], ['wafflestudio', 'waffle_fan'])
+
+        response = self.client.patch('/api/v1/user/id/', data={'user_id': 'pancake'}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[1])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('waffle_fan', self.typeahead('waffle'))
+        self.assertEqual(self.typeahead('panc'), ['pancake'])
+
+    def test_search_people_uses_index_counts(self):
+        response = self.client.get('/api/v1/search/people/', {'query': 'waffle @toast'}, HTTP_AUTHORIZATION=self.tokens[0])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([x['user_id'] for x in response.json()['results']], ['toast', 'wafflestudio', 'waffle', 'waffle_fan'])
+
+    def test_short_keywords_query_the_database(self):
+        index = search.get_index()
+        with mock.patch.object(index, 'containing', side_effect=AssertionError):
+            self.assertEqual(set(search.search_people(['wa'], [])), search.handle_matches('wa'))
+            self.assertEqual(search.handle_matches('wa'), {x.pk for x in self.users})       # substring
+            self.assertEqual(search.handle_matches('F'), {self.users[1].pk})                # prefix, shorter than the ngrams
+
+    def test_rebuilt_in_the_background(self):
+        index = search.get_index()
+        User.objects.filter(pk=self.users[3].pk).update(user_id='wafer')       # another process, no signal
+        with self.settings(PEOPLE_INDEX_TTL=0):
+            self.assertEqual(self.typeahead('wafe'), [])
+            self.assertIs(search.current_index(), index)       # requests never rebuild
+
+        search.rebuild()
+        self.assertIsNot(search.current_index(), index)
+        self.assertEqual(self.typeahead('wafe'), ['wafer'])
+
+
+class AvatarTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            UserFactory(
+                email='email%d@email.com' % i,
+                user_id='user%d_id' % i,
+                username='username%d' % i,
+                password='password',
+                phone_number='010-0000-%04d' % i,
+                is_verified=True
+            ) for i in range(3)]
+        cls.tokens = ['JWT ' + jwt_token_of(x) for x in cls.users]
+
+        for follower in cls.users[1:]:
+            Follow.objects.create(follower=follower, following=cls.users[0])
+        avatars.save_avatar(cls.users[1], ProfileMedia.objects.create(user=cls.users[1], image_url='https://example.com/1.png'))
+
+    def test_followers_without_profile_media(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/follow_list/user0_id/follower/', HTTP_AUTHORIZATION=self.tokens[0])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([x for x in queries.captured_queries if 'user_profilemedia' in x['sql']])
+
+        urls = {x['user_id']: x['profile_img'] for x in response.json()['results']}
+        self.assertEqual(urls, {'user1_id': 'https://example.com/1.png', 'user2_id': ProfileMedia.default_profile_img})
+
+    def test_profile_update_writes_avatar_url(self):
+        image = SimpleUploadedFile('avatar.gif', b'GIF89a\x01\x00\x01\x00\x00\x00\x00;', content_type='image/gif')
+        # a local storage, so the upload never reaches the S3 bucket
+        with tempfile.TemporaryDirectory() as media_root, self.settings(
+                DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage', MEDIA_ROOT=media_root):
+            response = self.client.patch(
+                '/api/v1/user/profile/',
+                data=encode_multipart(BOUNDARY, {'profile_img': image}),
+                content_type=MULTIPART_CONTENT,
+                HTTP_AUTHORIZATION=self.tokens[2])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            user = User.objects.get(pk=self.users[2].pk)
+            self.assertTrue(user.avatar_url.endswith('.gif'))
+            self.assertEqual(user.avatar_url, ProfileMedia.objects.get(user=user).media.url)
+            self.assertEqual(response.json()['profile_img'], user.avatar_url)
+
+
+@override_settings(QUERY_COUNT_HEADER=True)
+class FollowListLoaderTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            UserFactory(
+                email='email%d@email.com' % i,
+                user_id='user%d_id' % i,
+                username='username%d' % i,
+                password='password',
+                phone_number='010-0000-%04d' % i,
+                is_verified=True
+            ) for i in range(6)]
+        cls.token = 'JWT ' + jwt_token_of(cls.users[0])
+
+        for follower in cls.users[1:3]:
+            Follow.objects.create(follower=follower, following=cls.users[0])
+        Follow.objects.create(follower=cls.users[0], following=cls.users[1])
+
+    def setUp(self):
+        twitter.redis.reset()
+
+    def followers(self):
+        response = self.client.get('/api/v1/follow_list/user0_id/follower/', HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_query_count_does_not_grow_with_page(self):
+        response = self.followers()
+        n_queries = int(response['X-Query-Count'])
+        flags = {x['user_id']: (x['follows_me'], x['i_follow']) for x in response.json()['results']}
+        self.assertEqual(flags, {'user1_id': (True, True), 'user2_id': (True, False)})
+
+        for follower in self.users[3:]:
+            Follow.objects.create(follower=follower, following=self.users[0])
+        twitter.redis.reset()       # cold follow graph cache, like the first request
+        response = self.followers()
+        self.assertEqual(len(response.json()['results']), 5)
+        self.assertEqual(int(response['X-Query-Count']), n_queries)
+
+    @override_settings(QUERY_COUNT_HEADER=False)
+    def test_no_header_by_default(self):
+        self.assertNotIn('X-Query-Count', self.followers())
+
+
+class FollowGraphTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            UserFactory(
+                email='email%d@email.com' % i,
+                user_id='user%d_id' % i,
+                username='username%d' % i,
+                password='password',
+                phone_number='010-0000-%04d' % i,
+                is_verified=True
+            ) for i in range(5)]
+        cls.tokens = ['JWT ' + jwt_token_of(x) for x in cls.users]
+
+        Follow.objects.create(follower=cls.users[1], following=cls.users[0])
+        Follow.objects.create(follower=cls.users[1], following=cls.users[2])
+        Follow.objects.create(follower=cls.users[1], following=cls.users[3])
+
+    def setUp(self):
+        twitter.redis.reset()
+        recommend.reset()
+
+    def info(self, user_id):
+        response = self.client.get('/api/v1/user/%s/' % user_id, HTTP_AUTHORIZATION=self.tokens[0])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_follow_and_unfollow_patch_cached_sets(self):
+        pks = [x.pk for x in self.users]
+        self.assertEqual(graph.following(pks[1]), {pks[0], pks[2], pks[3]})
+        self.assertEqual(graph.followers(pks[0]), {pks[1]})
+        self.assertFalse(graph.follows(pks[0], pks[1]))
+        self.assertEqual(graph.follower_count(pks[1]), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/follow/', data={'user_id': 'user1_id'}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[0])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(graph.follows(pks[0], pks[1]))
+            self.assertEqual(graph.follower_count(pks[1]), 1)
+        self.assertEqual(len(queries), 0)
+
+        data = self.info('user1_id')
+        self.assertEqual((data['following'], data['follower'], data['i_follow']), (3, 1, True))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete('/api/v1/unfollow/user1_id/', HTTP_AUTHORIZATION=self.tokens[0])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = self.info('user1_id')
+        self.assertEqual((data['following'], data['follower'], data['i_follow']), (3, 0, False))
+
+    def test_rolled_back_follow_is_not_cached(self):
+        pks = [x.pk for x in self.users]
+        self.assertFalse(graph.follows(pks[0], pks[1]))
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                Follow.objects.create(follower=self.users[0], following=self.users[1])
+                transaction.set_rollback(True)
+        self.assertFalse(graph.follows(pks[0], pks[1]))
+        self.assertEqual(graph.followers(pks[1]), set())
+
+    def test_recommend_from_cached_sets(self):
+        recommend.rebuild()
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.create(follower=self.users[0], following=self.users[2])
+        response = self.client.get('/api/v1/follow/%d/recommend/' % self.users[1].pk, HTTP_AUTHORIZATION=self.tokens[4])
+        self.assertEqual([x['user_id'] for x in response.json()], ['user2_id', 'user0_id', 'user3_id'])
+
+        response = self.client.get('/api/v1/follow/%d/recommend/' % self.users[1].pk, HTTP_AUTHORIZATION=self.tokens[0])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)     # only user3 is left
+
+        response = self.client.get('/api/v1/recommend/', HTTP_AUTHORIZATION=self.tokens[0])
+        self.assertEqual([x['user_id'] for x in response.json()], ['user3_id', 'user1_id', 'user4_id'])
+
+    def test_recommend_friends_of_friends(self):
+        pks = [x.pk for x in self.users]
+        Follow.objects.create(follower=self.users[4], following=self.users[1])
+        follow_graph = recommend.rebuild()
+        self.assertEqual(follow_graph.recommend(pks[4], 3), [pks[0], pks[2], pks[3]])
+
+        # patched in without a rebuild: user0 is followed by both friends of user4 now
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.create(follower=self.users[4], following=self.users[2])
+            Follow.objects.create(follower=self.users[2], following=self.users[0])
+        self.assertIs(recommend.current_graph(), follow_graph)
+        self.assertEqual(follow_graph.recommend(pks[4], 3), [pks[0], pks[3]])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.filter(follower=self.users[4], following=self.users[1]).delete()
+        self.assertEqual(follow_graph.recommend(pks[4], 3), [pks[0], pks[1], pks[3]])
+
+
+class WhoToFollowTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            UserFactory(
+                email='email%d@email.com' % i,
+                user_id='user%d_id' % i,
+                username='username%d' % i,
+                password='password',
+                phone_number='010-0000-%04d' % i,
+                is_verified=True
+            ) for i in range(6)]
+        cls.tokens = ['JWT ' + jwt_token_of(x) for x in cls.users]
+
+        for follower, following in ((0, 1), (0, 2), (1, 3), (2, 3), (2, 4)):
+            Follow.objects.create(follower=cls.users[follower], following=cls.users[following])
+        for i, count in ((1, 1), (2, 1), (3, 2), (4, 1)):
+            User.objects.filter(pk=cls.users[i].pk).update(followers_count=count)
+        StaleRecommendation.objects.all().delete()
+
+    def setUp(self):
+        recommend.reset()
+
+    def recommendations(self, i):
+        rows = Recommendation.objects.filter(user=self.users[i]).order_by('rank')
+        return [(x.recommended.user_id, round(x.score, 3), x.mutuals) for x in rows]
+
+    def test_refresh_all(self):
+        self.assertEqual(who_to_follow.refresh(full=True), 6)
+        # user3 through both followed users (1 / ln 2 + 1 / ln 3), user4 through user2, user5 by popularity
+        self.assertEqual(self.recommendations(0), [('user3_id', 2.353, 2), ('user4_id', 0.91, 1), ('user5_id', 0.0, 0)])
+
+        response = self.client.get('/api/v1/recommend/', HTTP_AUTHORIZATION=self.tokens[0])
+        self.assertEqual([x['user_id'] for x in response.json()], ['user3_id', 'user4_id', 'user5_id'])
+        self.assertIsNone(recommend.current_graph())
+
+    @override_settings(RECOMMENDATION_CHUNK_SIZE=2)
+    def test_refresh_all_in_tasks(self):
+        self.assertEqual(tasks.refresh_recommendations.delay(full=True).get(), 6)
+        self.assertEqual(self.recommendations(0), [('user3_id', 2.353, 2), ('user4_id', 0.91, 1), ('user5_id', 0.0, 0)])
+        self.assertEqual(Recommendation.objects.filter(user=self.users[5]).count(), 5)
+
+    @override_settings(RECOMMENDATION_CHUNK_SIZE=2)
+    def test_refresh_in_daemonic_worker(self):
+        # as in a celery prefork worker, which cannot start processes of its own
+        def run(pipe):
+            try:
+                tasks.refresh_recommendations.delay(full=True).get()
+                pipe.send(self.recommendations(0))
+            except Exception as e:
+                pipe.send(repr(e))
+
+        reader, writer = multiprocessing.get_context('fork').Pipe(duplex=False)
+        worker = multiprocessing.get_context('fork').Process(target=run, args=(writer,), daemon=True)
+        worker.start()
+        worker.join(30)
+        self.assertEqual(reader.recv(), [('user3_id', 2.353, 2), ('user4_id', 0.91, 1), ('user5_id', 0.0, 0)])
+
+    def test_refresh_stale(self):
+        who_to_follow.refresh(full=True)
+        others = self.recommendations(1)
+        response = self.client.post('/api/v1/follow/', data={'user_id': 'user3_id'}, content_type='application/json', HTTP_AUTHORIZATION=self.tokens[0])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.recommendations(0), [('user4_id', 0.91, 1), ('user5_id', 0.0, 0)])
+        self.assertEqual(list(StaleRecommendation.objects.values_list('user_id', flat=True)), [self.users[0].pk])
+
+        self.assertEqual(who_to_follow.refresh(), 1)
+        self.assertEqual(self.recommendations(0), [('user4_id', 0.91, 1), ('user5_id', 0.0, 0)])
+        self.assertFalse(StaleRecommendation.objects.exists())
+        self.assertEqual(self.recommendations(1), others)     # only the stale user is rescored
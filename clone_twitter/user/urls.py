@@ -2,7 +2,7 @@ from django.urls import path, include
 from rest_framework.routers import SimpleRouter
 
 from user.views import PingPongView, EmailSignUpView, SearchPeopleView, UserInfoViewSet, UserLoginView, TokenVerifyView,\
-    UserFollowView, UserUnfollowView, FollowListViewSet, KakaoCallbackView, KaKaoSignInView, \
+    UserFollowView, UserUnfollowView, FollowListViewSet, SearchPeopleTypeaheadView, KakaoCallbackView, KaKaoSignInView, \
     UserRecommendView, FollowRecommendView, UserDeactivateView, KakaoUnlinkView, SignupEmailSendView, EmailActivateView, \
     GoogleSignInView, GoogleCallbackView, VerifySMSViewSet
 
@@ -27,6 +27,7 @@ urlpatterns = [
     path('kakao/signup/', KaKaoSignInView.as_view(), name='kakao-signup'),
     path('kakao/unlink/', KakaoUnlinkView.as_view(), name='kakao-unlink'),
     path('search/people/', SearchPeopleView.as_view(), name='search-people'),           # /api/v1/search/people/
+    path('search/people/typeahead/', SearchPeopleTypeaheadView.as_view(), name='search-people-typeahead'),   # /api/v1/search/people/typeahead/
     path('google/signup/', GoogleSignInView.as_view(), name='google-signup'),
     path('google/callback/', GoogleCallbackView.as_view(), name='google-callback'),
     path('', include(router.urls))
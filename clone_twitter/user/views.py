@@ -8,20 +8,22 @@ from django.test import tag
 
 import hashlib, hmac, time, requests, sys, os
 import user.paginations
-from django.db.models.expressions import Case, When
 from django.contrib.auth import authenticate
 
+from tweet import tasks as tweet_tasks, timeline
+from user import avatars, recommend, search, who_to_follow
 from tweet.serializers import SearchSerializer
 from twitter.utils import unique_random_id_generator, unique_random_email_generator
+from django.conf import settings
 from django.shortcuts import get_object_or_404, redirect
 from rest_framework import status, permissions, viewsets
 from rest_framework.views import Response, APIView
 from rest_framework.decorators import action
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-from user.serializers import UserCreateSerializer, UserInfoSerializer, UserLoginSerializer, FollowSerializer, UserFollowSerializer, UserFollowingSerializer, UserProfileSerializer, UserSearchInfoSerializer, jwt_token_of, UserRecommendSerializer
+from user.serializers import UserCreateSerializer, UserInfoSerializer, UserLoginSerializer, FollowSerializer, UserFollowSerializer, UserFollowingSerializer, UserProfileSerializer, UserSearchInfoSerializer, jwt_token_of, UserRecommendSerializer, UserTypeaheadSerializer
 from django.db import IntegrityError, transaction
-from django.db.models import Q, Count
+from django.db.models import F
 from user.models import Follow, User, SocialAccount, ProfileMedia, AuthCode
 import requests
 from twitter.settings import get_secret, FRONT_URL
@@ -231,7 +233,13 @@ class UserUnfollowView(APIView):
             return Response(status=status.HTTP_404_NOT_FOUND, data={'message': 'no such user exists'})
         except Follow.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND, data={'message': 'you can unfollow only currently following user'})
-        follow_relation.delete()
+        with transaction.atomic():
+            follow_relation.delete()
+            User.objects.filter(pk=following.pk, followers_count__gt=0).update(followers_count=F('followers_count') - 1)
+            timeline.remove(request.user, following)
+            following.refresh_from_db(fields=['followers_count'])
+            if following.followers_count == settings.TIMELINE_FANOUT_FOLLOWER_LIMIT:     # no longer pulled
+                transaction.on_commit(lambda: tweet_tasks.backfill_followers.delay(following.pk))
         return Response(status=status.HTTP_200_OK, data='successfully unfollowed')
 
 
@@ -255,7 +263,7 @@ class FollowListViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=True, methods=['GET'])
     def follower(self, request, pk=None):
         user = get_object_or_404(User, user_id=pk)
-        followers = Follow.objects.filter(following=user).order_by('-created_at')
+        followers = Follow.objects.filter(following=user).select_related('follower').order_by('-created_at')
         page = self.paginate_queryset(followers)
 
         if page is not None:
@@ -279,7 +287,7 @@ class FollowListViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=True, methods=['GET'])
     def following(self, request, pk=None):
         user = get_object_or_404(User, user_id=pk)
-        followings = Follow.objects.filter(follower=user).order_by('-created_at')
+        followings = Follow.objects.filter(follower=user).select_related('following').order_by('-created_at')
         page = self.paginate_queryset(followings)
 
         if page is not None:
@@ -490,6 +498,7 @@ class KakaoCallbackView(APIView):
                 profile_media = ProfileMedia()
             profile_media.user = user
             profile_media.save()
+            avatars.save_avatar(user, profile_media)
 
             kakao_account = SocialAccount.objects.create(account_id=kakao_id, type='kakao', user=user)
             token = jwt_token_of(user)
@@ -643,6 +652,7 @@ class GoogleCallbackView(APIView):
                 profile_media = ProfileMedia(image_url=profile_img_url)
                 profile_media.user = user
                 profile_media.save()
+                avatars.save_avatar(user, profile_media)
 
             if user is not None:
                 google_account = SocialAccount.objects.create(account_id=google_id, type='google', user=user)
@@ -653,8 +663,8 @@ class GoogleCallbackView(APIView):
             return redirect(FRONT_URL + "oauth/callback/google/?code=null" + "&message=creation failed")
 
 
-class UserRecommendView(APIView):  # recommend random ? users who I don't follow
-    queryset = User.objects.all().reverse()
+class UserRecommendView(APIView):  # recommend users who I don't follow, precomputed by user/who_to_follow.py
+    queryset = User.objects.all()
     permission_classes = (permissions.IsAuthenticated,)
 
     responses = {
@@ -670,16 +680,21 @@ class UserRecommendView(APIView):  # recommend random ? users who I don't follow
     # GET /api/v1/recommend/  TODO: Q. request.user? or specify..?
     def get(self, request):
         me = request.user
-        unfollowing_users = self.queryset.exclude(Q(following__follower=me) | Q(pk=me.pk))[:3]
-
-        if unfollowing_users.count() < 3:
+        unfollowing_users = who_to_follow.recommended_users(me.pk, 3)
+        if len(unfollowing_users) < 3:     # not computed yet (new user) or followed since the last run
+            follow_graph = recommend.current_graph()
+            candidates = follow_graph.recommend(me.pk, 3) if follow_graph is not None else recommend.popular(me.pk, 3)
+            users = self.queryset.in_bulk(candidates)
+            unfollowing_users = [users[x] for x in candidates if x in users]
+
+        if len(unfollowing_users) < 3:
             return Response(status=status.HTTP_400_BAD_REQUEST, data={'message': "not enough users to recommend"})
 
         serializer = UserRecommendSerializer(unfollowing_users, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
-class FollowRecommendView(APIView):  # recommend random ? users who I don't follow
+class FollowRecommendView(APIView):  # recommend users followed by {pk} who I don't follow
     queryset = User.objects.all()
     permission_classes = (permissions.IsAuthenticated,)
 
@@ -702,10 +717,15 @@ class FollowRecommendView(APIView):  # recommend random ? users who I don't foll
         except User.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND, data={'message': 'no such user exists'})
 
-        followings = User.objects.filter(following__follower=new_following)
-        recommending_users = followings.exclude(Q(following__follower=me) | Q(pk=me.pk))[:3]
+        follow_graph = recommend.current_graph()
+        if follow_graph is not None:
+            candidates = follow_graph.recommend_from(me.pk, new_following.pk, 3)
+        else:
+            candidates = recommend.followed_by(me.pk, new_following.pk, 3)
+        users = User.objects.in_bulk(candidates)
+        recommending_users = [users[x] for x in candidates if x in users]
 
-        if recommending_users.count() < 3:
+        if len(recommending_users) < 3:
             return Response(status=status.HTTP_400_BAD_REQUEST, data={'message': "not enough users to recommend"})
 
         serializer = UserRecommendSerializer(recommending_users, many=True)
@@ -739,22 +759,43 @@ class SearchPeopleView(APIView, UserListPagination):
                 tag_keywords.append(search_keywords[k])
 
 
-        sorted_queryset = \
-            User.objects.all() \
-            .annotate(num_keywords_included=sum([Case(When(Q(username__icontains=keyword) | Q(user_id__icontains=keyword) | Q(bio__icontains=keyword), then=1), default=0) for keyword in search_keywords]),
-                num_keywords_in_username=sum([Case(When(Q(username__icontains=keyword), then=1), default=0) for keyword in search_keywords]),
-                is_tag_keyword=sum([Case(When(user_id=keyword, then=1), default=0) for keyword in tag_keywords]),
-                num_followers=Count('following')) \
-            .filter(num_keywords_included__gte=1) \
-            .order_by('-is_tag_keyword', '-num_keywords_in_username', '-num_keywords_included', '-num_followers')
+        # ranked by is_tag_keyword, num_keywords_in_username, num_keywords_included, num_followers (user/search.py)
+        sorted_ids = search.search_people(search_keywords, tag_keywords[1:])
 
-        page = self.paginate_queryset(sorted_queryset, request)
+        page = self.paginate_queryset(sorted_ids, request)
 
         if page is not None:
-            serializer = UserInfoSerializer(page, many=True, context={'request': request})
+            users = User.objects.in_bulk(page)
+            serializer = UserInfoSerializer([users[x] for x in page if x in users], many=True, context={'request': request})
             return self.get_paginated_response(serializer.data)
 
-        serializer = UserInfoSerializer(sorted_queryset, many=True, context={'request': request})
+        users = User.objects.in_bulk(sorted_ids)
+        serializer = UserInfoSerializer([users[x] for x in sorted_ids if x in users], many=True, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class SearchPeopleTypeaheadView(APIView):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    responses = {
+        200: UserTypeaheadSerializer(many=True),
+        400: 'Invalid input data: no query provided',
+        405: 'Method not allowed: only GET',
+        500: 'Internal server error'
+    }
+
+    @swagger_auto_schema(tags=["Search"], query_serializer=SearchSerializer, responses=responses)
+
+    # GET /api/v1/search/people/typeahead/
+    # users whose user_id or username starts with the query
+    def get(self, request):
+        prefix = unquote_plus(request.query_params.get('query', '')).strip().lstrip('@')
+        if not prefix:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'message': 'no query provided'})
+
+        ids = search.get_index().typeahead(prefix, settings.PEOPLE_TYPEAHEAD_LIMIT)
+        users = User.objects.in_bulk(ids)
+        serializer = UserTypeaheadSerializer([users[x] for x in ids if x in users], many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
@@ -865,7 +906,7 @@ class VerifySMSViewSet(viewsets.GenericViewSet):
 
         if is_verified:
             request.user.is_verified=True
-            request.user.save()
+            request.user.save(update_fields=['is_verified'])     # the rest of the row may have changed since authentication
             return Response({"message": "sms verification success"}, status=status.HTTP_200_OK)
         return Response(status=status.HTTP_400_BAD_REQUEST, data={'message': 'wrong code'})
 
@@ -903,7 +944,7 @@ class VerifySMSViewSet(viewsets.GenericViewSet):
 
         if is_verified:
             request.user.is_verified = True
-            request.user.save()
+            request.user.save(update_fields=['is_verified'])     # the rest of the row may have changed since authentication
             return Response({"message": "email verification success"}, status=status.HTTP_200_OK)
         return Response(status=status.HTTP_400_BAD_REQUEST, data={'message': 'wrong code'})
 
@@ -0,0 +1,153 @@
+import heapq
+import math
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from user.models import Follow, Recommendation, StaleRecommendation, User
+
+# offline "who to follow": user.tasks.refresh_recommendations computes the top RECOMMENDATION_TOP_K users of every
+# user (full run) or of the users marked in StaleRecommendation (incremental run) and writes them to Recommendation,
+# so UserRecommendView reads one indexed range.
+# candidates are the users two follows away, ranked by Adamic-Adar (common neighbors weighted by 1 / log of their
+# out-degree), then common neighbors, then followers_count; users with too few of them are filled up by popularity.
+# users are scored in chunks of RECOMMENDATION_CHUNK_SIZE, each a celery task of its own that streams only the
+# Follow rows its users reach into compact arrays, so chunks spread over the worker processes.
+
+FETCH_SIZE = 10000      # Follow rows per round trip
+
+
+class Snapshot:
+    # follow rows of some users as compressed sparse rows keyed by pk, followers_count of the users they follow,
+    # and the most followed users
+
+    def __init__(self, edges):
+        self.pks = array('q')           # followers with a row, ascending
+        self.indptr = array('q', [0])
+        self.indices = array('q')       # followed pks, row by row
+        self.followers = dict()         # followed pk -> followers_count
+        for follower_id, following_id, followers_count in edges:
+            if not self.pks or self.pks[-1] != follower_id:
+                if self.pks:
+                    self.indptr.append(len(self.indices))
+                self.pks.append(follower_id)
+            self.indices.append(following_id)
+            self.followers[following_id] = followers_count
+        if self.pks:
+            self.indptr.append(len(self.indices))
+        self.popular = array('q')       # most followed pks first, filled by load()
+
+    @classmethod
+    def load(cls, pks, limit):
+        # what scoring users pks reads: their rows and the rows of everyone they follow
+        followed_ids = Follow.objects.filter(follower_id__in=pks).values('following_id')
+        edges = Follow.objects.filter(Q(follower_id__in=pks) | Q(follower_id__in=followed_ids)) \
+            .order_by('follower_id', 'following_id').values_list('follower_id', 'following_id', 'following__followers_count')
+        snapshot = cls(edges.iterator(chunk_size=FETCH_SIZE))
+        # enough to fill up any of them after leaving out the users it follows
+        longest = max((len(snapshot.row(pk)) for pk in pks), default=0)
+        popular = User.objects.order_by('-followers_count', 'id').values_list('id', flat=True)[:limit + longest + 1]
+        snapshot.popular.extend(popular)
+        return snapshot
+
+    def row(self, pk):
+        i = bisect_left(self.pks, pk)
+        if i < len(self.pks) and self.pks[i] == pk:
+            return self.indices[self.indptr[i]:self.indptr[i + 1]]
+        return ()
+
+    def popularity(self, pk):
+        return self.followers.get(pk, 0)
+
+    def top(self, pk, limit):
+        # [(recommended pk, score, mutuals)] for the user, best first
+        mine = set(self.row(pk))
+        scores = defaultdict(float)
+        mutuals = Counter()
+        for followed in mine:
+            row = self.row(followed)
+            if not row:
+                continue
+            weight = 1 / math.log1p(len(row))
+            for candidate in row:
+                if candidate != pk and candidate not in mine:
+                    scores[candidate] += weight
+                    mutuals[candidate] += 1
+        best = heapq.nlargest(limit, scores, key=lambda x: (scores[x], mutuals[x], self.popularity(x), -x))
+        result = [(x, scores[x], mutuals[x]) for x in best]
+        if len(result) < limit:
+            excluded = mine | set(best) | {pk}
+            popular = (x for x in self.popular if x not in excluded)
+            result.extend((x, 0.0, 0) for x in islice(popular, limit - len(result)))
+        return result
+
+
+def chunks(pks, size):
+    pks = iter(pks)
+    chunk = list(islice(pks, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(pks, size))
+
+
+def save(results):
+    # replace the recommendations of the users in results, [(user pk, top)]
+    with transaction.atomic():
+        Recommendation.objects.filter(user_id__in=[pk for pk, top in results]).delete()
+        Recommendation.objects.bulk_create([
+            Recommendation(user_id=pk, recommended_id=recommended, rank=rank, score=score, mutuals=mutuals)
+            for pk, top in results
+            for rank, (recommended, score, mutuals) in enumerate(top)
+        ])
+
+
+def plan(full=False):
+    # (start of the run, chunks of the user pks to score)
+    started = timezone.now()
+    users = User.objects.all()
+    if not full:
+        stale = StaleRecommendation.objects.filter(marked_at__lte=started)
+        stale.exclude(user_id__in=users.values('id')).delete()      # marks of deleted users
+        users = users.filter(pk__in=stale.values('user_id'))
+    pks = users.order_by('id').values_list('id', flat=True).iterator(chunk_size=FETCH_SIZE)
+    return started, list(chunks(pks, settings.RECOMMENDATION_CHUNK_SIZE))
+
+
+def score(pks, started):
+    # write the recommendations of users pks; returns how many. marks made after the run started stay for the next one
+    limit = settings.RECOMMENDATION_TOP_K
+    snapshot = Snapshot.load(pks, limit)
+    save([(pk, snapshot.top(pk, limit)) for pk in pks])
+    StaleRecommendation.objects.filter(user_id__in=pks, marked_at__lte=started).delete()
+    return len(pks)
+
+
+def refresh(full=False):
+    # score every chunk in this process; returns the number of users whose recommendations were written
+    started, work = plan(full)
+    return sum(score(pks, started) for pks in work)
+
+
+def mark_stale(pk):
+    # call when the follow set of user pk changes
+    now = timezone.now()
+    marks = StaleRecommendation.objects.filter(user_id=pk)
+    if marks.update(marked_at=now):
+        return
+    try:
+        with transaction.atomic():
+            StaleRecommendation.objects.create(user_id=pk, marked_at=now)
+    except IntegrityError:      # created concurrently
+        marks.update(marked_at=now)
+
+
+def recommended_users(pk, limit):
+    # users precomputed for user pk, best first; [] until the first run covering the user
+    recommendations = Recommendation.objects.filter(user_id=pk).select_related('recommended').order_by('rank')[:limit]
+    return [x.recommended for x in recommendations]